@@ -1,7 +1,9 @@
 #!/usr/bin/which python
 import datetime
+import multiprocessing
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from peewee import SelectQuery
 import pandas as pd
@@ -11,56 +13,41 @@ import numpy as np
 import io
 
 from common.common import Common
+from backend.metrics import registry, start_http_server
 from backend.storage import *
+from backend.timeline import state_changes, minute_occupancy
 
 plt.style.use('dark_background')
 pd.set_option('display.max_rows', None)
 
 
-def polar_24hours(query: SelectQuery, end_date: datetime = None, headless=True):
+RENDER_SECONDS = registry.histogram("charts_render_seconds", "Chart render time (in a worker process)", ("type",))
+FETCH_SECONDS = registry.histogram("charts_fetch_seconds", "Chart data fetch time", ("type",))
+
+
+def _frame(rows: SelectQuery | list | dict) -> pd.DataFrame:
+    # Charts take a model query (get_lasts), rows of storage.get_history or columns of storage.get_series
+    return pd.DataFrame(rows.dicts() if isinstance(rows, SelectQuery) else rows)
+
+
+def polar_24hours(rows: SelectQuery | list, end_date: datetime = None, headless=True):
     hours = 24
     if end_date is None:
         end_date = datetime.datetime.now()
     end_date = end_date.replace(microsecond=0)
     start_date = end_date - datetime.timedelta(hours=hours)
 
-    df = pd.DataFrame(query.dicts())
+    df = _frame(rows)
     if not df.empty:
-        # Drop milliseconds:
-        df["datetime"] = pd.to_datetime(df["create_at"]).dt.floor("s")
-        # Cast boolean to int:
-        df["value"] = df["value"].astype(int)
-        # Remove unnecessary columns:
-        df.drop(columns=["id", "name", "create_at"], inplace=True)
-        # Add border records:
-        df = pd.concat([
-            pd.DataFrame([[(df.iloc[0]["value"] + 1) % 2, start_date]], columns=df.columns),
-            df,
-            pd.DataFrame([[df.iloc[-1]["value"], end_date]], columns=df.columns)], ignore_index=True)
-        # Remove records from the same second. Take '0's for such:
-        df = df.sort_values("value", ascending=True).drop_duplicates("datetime").sort_index()
-        # print(df)
-
-        # Fill gaps for each second:
-        df.set_index("datetime", inplace=True, verify_integrity=True)
-        df = (df.resample(rule='s', origin=start_date)
-              .ffill()
-              .reset_index())
-
-        # Trim seconds, so leave only minutes important:
-        df["datetime"] = pd.to_datetime(df["datetime"]).dt.floor("min")
-        # print(df)
-        # Remove duplicates.
-        df = df.sort_values("value", ascending=False).drop_duplicates("datetime").sort_index().reset_index()
-        # print(df)
+        seconds, values = state_changes(df["create_at"], df["value"], start_date, end_date)
+        minutes, occupied = minute_occupancy(seconds, values)
 
         # Make the oldest data 1/4 height and increase to 1 for end date
-        df["value"] = df['value'] * (0.75 * (df.index / df.count()["value"]) + 0.25)
+        bars = occupied * (0.75 * (np.arange(len(occupied)) / len(occupied)) + 0.25)
 
-        # Translate timestamp seconds to radians:
-        df["datetime"] = df["datetime"] - datetime.datetime.strptime('00:00:00', '%H:%M:%S')
-        df["datetime"] = df["datetime"].dt.seconds / (hours * 60 * 60)
-        df["datetime"] = df["datetime"] * 2 * np.pi
+        # Translate timestamp seconds (of the day) to radians:
+        theta = (minutes % (24 * 60 * 60)) / (hours * 60 * 60)
+        theta = theta * 2 * np.pi
 
     # The same with end date
     chart_end_date = end_date - datetime.datetime.strptime('00:00:00', '%H:%M:%S')
@@ -87,7 +74,7 @@ def polar_24hours(query: SelectQuery, end_date: datetime = None, headless=True):
     ax2.set_rorigin(radius + 1)
 
     if not df.empty:
-        ax2.bar(df["datetime"], df["value"], width=2 * np.pi / (hours * 30))
+        ax2.bar(theta, bars, width=2 * np.pi / (hours * 30))
     ax2.bar([chart_end_date], [1], width=2 * np.pi / (hours * 30), color='r')
     ax2.plot()
     plt.subplots_adjust(left=0, bottom=0, right=1, top=1, wspace=0, hspace=0)
@@ -110,8 +97,8 @@ def polar_24hours(query: SelectQuery, end_date: datetime = None, headless=True):
     return bio
 
 
-def chart_1week(query: SelectQuery, headless=True, value_column_name="value"):
-    df = pd.DataFrame(query.dicts())
+def chart_1week(rows: SelectQuery | list | dict, headless=True, value_column_name="value"):
+    df = _frame(rows)
 
     fig = plt.figure(figsize=(8, 4), facecolor='#303030')
     ax2 = fig.subplots(1, 1)
@@ -135,40 +122,16 @@ def chart_1week(query: SelectQuery, headless=True, value_column_name="value"):
     return bio
 
 
-def new_chart(query: SelectQuery, start_date: datetime, end_date: datetime, value_column_name="value", headless=True):
-    df = pd.DataFrame(query.dicts())
-
-    # Drop milliseconds:
-    df["datetime"] = pd.to_datetime(df["create_at"]).dt.floor("s")
-
-    # Add border records:
-    df = pd.concat([
-        pd.DataFrame([[(df.iloc[0][value_column_name] + 1) % 2, start_date]], columns=df.columns),
-        df,
-        pd.DataFrame([[df.iloc[-1][value_column_name], end_date]], columns=df.columns)], ignore_index=True)
-    # Remove records from the same second. Take '0's for such:
-    df = df.sort_values(value_column_name, ascending=True).drop_duplicates("datetime").sort_index()
-    # print(df)
-
-    # Fill gaps for each second:
-    df.set_index("datetime", inplace=True, verify_integrity=True)
-    df = (df.resample(rule='s', origin=start_date)
-          .ffill()
-          .reset_index())
-
-    # # Trim seconds, so leave only minutes important:
-    # df["datetime"] = pd.to_datetime(df["datetime"]).dt.floor("min")
-    # # print(df)
-    # # Remove duplicates.
-    # df = df.sort_values("value", ascending=False).drop_duplicates("datetime").sort_index().reset_index()
-    # # print(df)
-
+def new_chart(rows: SelectQuery | list, start_date: datetime, end_date: datetime, value_column_name="value", headless=True):
+    df = _frame(rows)
+    seconds, values = state_changes(df["create_at"], df[value_column_name], start_date, end_date)
 
     fig = plt.figure(figsize=(8, 4), facecolor='#303030')
     ax2 = fig.subplots(1, 1)
     ax2.set_facecolor("#303030")
     ax2.xaxis.set_major_formatter(mdates.ConciseDateFormatter(ax2.xaxis.get_major_locator()))
-    ax2.plot(df["datetime"], df[value_column_name])
+    # Each value holds until the next change:
+    ax2.step(seconds.astype("datetime64[s]"), values, where="post")
 
     # Save plot to BytesIO
     bio = io.BytesIO()
@@ -186,50 +149,96 @@ def new_chart(query: SelectQuery, start_date: datetime, end_date: datetime, valu
     return bio
 
 
+def render(chart_type: str, rows: list | dict, end_date: datetime.datetime) -> tuple[bytes, float]:
+    # Runs in a ChartsGenerator worker process: rows are already fetched, so no database access here.
+    start = time.perf_counter()
+    if chart_type == "polar":
+        bio = polar_24hours(rows, end_date)
+    else:
+        bio = chart_1week(rows)
+    return bio.getvalue(), time.perf_counter() - start
+
+
 class ChartsGenerator(Common):
 
-    def __init__(self):
+    # period: (chart type, configuration key, minimal interval between renders, maximal chart age)
+    PERIODS = {
+        ChartPeriod.hours24: ("polar", "24hours", ChartPeriod.hours24.refresh(), datetime.timedelta(minutes=15)),
+        ChartPeriod.days7: ("default", "1week", ChartPeriod.days7.refresh(), datetime.timedelta(hours=1)),
+    }
+
+    def __init__(self, metrics_port: int = None):
         super().__init__("CHARTS_GENERATOR")
         self.charts = Configuration.get_charts_config()
+        self.workers = self.charts.get("workers", 2)
+        self.metrics_port = metrics_port
         self.exit = False
 
-    def start(self):
-        minutes5 = datetime.timedelta(minutes=5)
-        minutes15 = datetime.timedelta(minutes=15)
-        week1 = datetime.timedelta(weeks=1)
-        day1 = datetime.timedelta(days=1)
-
-        while not self.exit:
-
-            for model_str, names in self.charts["24hours"]["polar"].items():
+    def jobs(self):
+        for period, (chart_type, key, min_interval, max_age) in self.PERIODS.items():
+            for model_str, names in self.charts.get(key, {}).get(chart_type, {}).items():
                 model = getattr(sys.modules['backend.storage'], model_str)
                 for name in names:
-                    now = datetime.datetime.now()
-                    if (last := FigureCache.get_last(model.__name__, ChartPeriod.hours24, name)) is None or last.create_at + minutes5 < now:
-                        self.log("Regenerating chart: {} {} ...".format(model.__name__, name))
-                        bio = polar_24hours(model.get_lasts(name, now - day1))
-                        if last is None:
-                            last = FigureCache(model=model.__name__, name=name, period=ChartPeriod.hours24)
-                        last.create_at = now
-                        last.data = bio.getvalue()
-                        last.save()
-                        self.log("Regenerating chart: {} {} DONE".format(model.__name__, name))
-
-            for model_str, names in self.charts["1week"]["default"].items():
-                model = getattr(sys.modules['backend.storage'], model_str)
-                for name in names:
-                    now = datetime.datetime.now()
-                    if (last := FigureCache.get_last(model.__name__, ChartPeriod.days7, name)) is None or last.create_at + minutes15 < now:
-                        self.log("Regenerating chart: {} {} ...".format(model.__name__, name))
-                        bio = chart_1week(model.get_lasts(name, now - week1))
-                        if last is None:
-                            last = FigureCache(model=model.__name__, name=name, period=ChartPeriod.days7)
-                        last.create_at = now
-                        last.data = bio.getvalue()
-                        last.save()
-                        self.log("Regenerating chart: {} {} DONE".format(model.__name__, name))
-
-            time.sleep(10)
+                    yield period, chart_type, model, name, min_interval, max_age
+
+    @staticmethod
+    def is_due(model, name: str, last: Chart, now: datetime.datetime, min_interval, max_age) -> bool:
+        if last is None or last.create_at + max_age < now:
+            return True
+        if last.create_at + min_interval > now:
+            return False
+        # Any row newer than the chart? One index lookup on (name_id, create_at):
+        newest = model.select(peewee.fn.MAX(model.create_at)).where(model.name == name).scalar()
+        return newest is not None and newest > last.create_at
+
+    @staticmethod
+    def fetch(period: ChartPeriod, model, name: str, now: datetime.datetime):
+        if period == ChartPeriod.hours24:
+            return get_history(model, name, from_date=now - datetime.timedelta(days=1))
+        return get_series(model, name, now - datetime.timedelta(weeks=1), now, datetime.timedelta(minutes=10))
+
+    def cycle(self, pool: ProcessPoolExecutor):
+        futures = {}
+        with database:
+            for period, chart_type, model, name, min_interval, max_age in self.jobs():
+                now = datetime.datetime.now()
+                last = Chart.get_last(model, period, name)
+                if self.is_due(model, name, last, now, min_interval, max_age):
+                    start = time.perf_counter()
+                    rows = self.fetch(period, model, name, now)
+                    fetched = time.perf_counter() - start
+                    futures[pool.submit(render, chart_type, rows, now)] = (period, chart_type, model, name, last, now, fetched)
+
+        for future in as_completed(futures):
+            period, chart_type, model, name, last, now, fetched = futures[future]
+            try:
+                data, rendered = future.result()
+                RENDER_SECONDS.labels(chart_type).observe(rendered)
+                FETCH_SECONDS.labels(chart_type).observe(fetched)
+                start = time.perf_counter()
+                if last is None:
+                    last = Chart(model=model.__name__, name=name, period=period, type=chart_type)
+                last.status = ChartStatus.ready
+                last.create_at = now
+                last.data = data
+                last.save()
+                self.log("Chart {} {} {} regenerated: fetch {:.0f}ms, render {:.0f}ms, save {:.0f}ms".format(
+                    model.__name__, name, period.value, fetched * 1000, rendered * 1000, (time.perf_counter() - start) * 1000))
+            except Exception as e:
+                self.log("Chart {} {} {} regeneration failed: {}".format(model.__name__, name, period.value, e))
+
+    def start(self):
+        # A fork context pool forks all its workers on the first submit: a no-op one, once the
+        # connections opened at import (pooled ones included) are closed and before any other
+        # thread (metrics) is started, so workers inherit neither and only render.
+        database.close_all()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            pool.submit(int).result()
+            if self.metrics_port:
+                start_http_server(self.metrics_port)
+            while not self.exit:
+                self.cycle(pool)
+                time.sleep(10)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict
+
+import aiohttp
+
+from backend import jsoncodec
+from backend.metrics import registry
+from configuration import Configuration
+
+logger = logging.getLogger("onair.http")
+
+REQUESTS = registry.counter("http_client_requests_total", "Shared HTTP client requests: upstream, cache hit, shared in-flight, error", ("result",))
+
+
+class HttpResponse:
+    """Status and body of a completed request; it can be cached and shared between callers."""
+
+    def __init__(self, status: int, text: str):
+        self.status = status
+        self.text = text
+
+    def json(self):
+        return jsoncodec.loads(self.text)
+
+
+class HttpClient:
+    """
+    One aiohttp session per event loop, so connections (DNS, TCP and TLS) are kept
+    alive and reused across providers and calls. Successful responses can be
+    cached for 'ttl' seconds, keyed by method, URL and body, and concurrent
+    requests for the same key share one upstream call.
+    """
+
+    def __init__(self):
+        conf = Configuration.get_http_config()
+        self.limit = conf.get("limit", 10)
+        self.timeout = conf.get("timeout", 30)
+        self.cache_size = conf.get("cache_size", 128)
+        # A session is bound to the loop it was created in: one per loop, none replaced while open
+        self.sessions = weakref.WeakKeyDictionary()
+        self.cache = OrderedDict()
+        self.inflight = {}
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if (session := self.sessions.get(loop)) is None or session.closed:
+            session = self.sessions[loop] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return session
+
+    async def get(self, url: str, ttl: float = 0, timeout: float = None) -> HttpResponse:
+        return await self.request("GET", url, ttl=ttl, timeout=timeout)
+
+    async def post(self, url: str, json=None, ttl: float = 0, timeout: float = None) -> HttpResponse:
+        return await self.request("POST", url, json=json, ttl=ttl, timeout=timeout)
+
+    async def request(self, method: str, url: str, json=None, ttl: float = 0, timeout: float = None) -> HttpResponse:
+        key = (method, url, jsoncodec.dumps(json, sort_keys=True) if json is not None else None)
+        if ttl and (cached := self.cache.get(key)) is not None:
+            expires, response = cached
+            if expires > time.monotonic():
+                REQUESTS.labels("hit").inc()
+                self.cache.move_to_end(key)
+                return response
+            del self.cache[key]
+
+        if (pending := self.inflight.get(key)) is not None:
+            REQUESTS.labels("shared").inc()
+            return await asyncio.shield(pending)
+
+        pending = self.inflight[key] = asyncio.ensure_future(self._fetch(method, url, json, timeout))
+        try:
+            response = await asyncio.shield(pending)
+        finally:
+            self.inflight.pop(key, None)
+        if ttl and response.status == 200:
+            self.cache[key] = (time.monotonic() + ttl, response)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return response
+
+    async def _fetch(self, method: str, url: str, json, timeout: float = None) -> HttpResponse:
+        REQUESTS.labels("upstream").inc()
+        start = time.monotonic()
+        try:
+            kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+            async with self.session().request(method, url, json=json, **kwargs) as response:
+                result = HttpResponse(response.status, await response.text())
+        except Exception:
+            REQUESTS.labels("error").inc()
+            raise
+        logger.debug(f"{method} {url}: {result.status} in {(time.monotonic() - start) * 1000:.0f}ms")
+        return result
+
+    def invalidate(self, method: str, url: str, json=None):
+        self.cache.pop((method, url, jsoncodec.dumps(json, sort_keys=True) if json is not None else None), None)
+
+    def stats(self) -> dict:
+        return {"requests": int(REQUESTS.get("upstream")), "hits": int(REQUESTS.get("hit")), "shared": int(REQUESTS.get("shared")),
+                "errors": int(REQUESTS.get("error")), "cached": len(self.cache), "inflight": len(self.inflight)}
+
+    async def close(self):
+        # The session of this loop is closed here, those of other (running) loops in their own loop
+        current = asyncio.get_running_loop()
+        for loop, session in list(self.sessions.items()):
+            if session.closed:
+                continue
+            if loop is current:
+                await session.close()
+            elif loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+        self.sessions.clear()
+
+
+http = HttpClient()
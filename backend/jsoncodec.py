@@ -0,0 +1,84 @@
+import datetime
+import decimal
+import json
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON codec behind json_serial / json_deserial (backend.tools). orjson is used when
+# installed, the standard library otherwise; both encode the same values: compact
+# separators, UTF-8, datetimes in ISO format, Decimals as floats and non-finite floats
+# (NaN, Infinity - not JSON) as null. The text of floats in exponent notation differs
+# (orjson 1e16, 1e-7; standard library 1e+16, 1e-07), it decodes to the same number.
+# Floats are decoded as floats - models turn them into Decimals where a DecimalField
+# needs it (see storage.DecimalField).
+
+
+class HomeCtrlJsonEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime.datetime) or isinstance(obj, datetime.date) or isinstance(obj, datetime.time):
+            return obj.isoformat()
+        elif isinstance(obj, decimal.Decimal):
+            return float(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+def _orjson_default(obj):
+    # orjson handles datetimes natively, Decimals are left to us:
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _finite(obj):
+    # Non-finite floats (and Decimals) replaced with None, as orjson writes them
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    elif isinstance(obj, (float, decimal.Decimal)) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def dumps_stdlib(obj, indent: int = None, sort_keys: bool = False) -> str:
+    def encode(value):
+        return json.dumps(value, cls=HomeCtrlJsonEncoder, ensure_ascii=False, indent=indent, sort_keys=sort_keys,
+                          separators=(",", ":") if indent is None else (",", ": "), allow_nan=False)
+    try:
+        return encode(obj)
+    except ValueError:
+        # NaN or Infinity somewhere, rare enough to walk the object only then
+        return encode(_finite(obj))
+
+
+def loads_stdlib(data):
+    return json.loads(data)
+
+
+def dumps(obj, indent: int = None, sort_keys: bool = False) -> str:
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=_orjson_default, option=option).decode()
+        except orjson.JSONEncodeError:
+            # e.g. integers above 64 bits, the standard library copes with them
+            pass
+    return dumps_stdlib(obj, indent=indent, sort_keys=sort_keys)
+
+
+def loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity literals are accepted by the standard library only
+            pass
+    return loads_stdlib(data)
@@ -0,0 +1,233 @@
+import bisect
+import http.server
+import logging
+import threading
+import time
+
+logger = logging.getLogger("onair.metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast handler call up to a slow provider fetch or chart render:
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self, lock: threading.Lock):
+        self.value = 0.0
+        self.lock = lock
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_max(self, value: float) -> None:
+        with self.lock:
+            if value > self.value:
+                self.value = value
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets: tuple, lock: threading.Lock):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = lock
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: _Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    """
+    One metric family; labels(*values) returns (and keeps) the child holding the
+    value of one combination of label values, so the hot path is a dictionary
+    lookup and an increment.
+    """
+
+    TYPE = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._child()
+
+    def _child(self):
+        return _Value(self.lock)
+
+    def labels(self, *values):
+        if (child := self.children.get(values)) is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def get(self, *values) -> float:
+        # Current value of a counter or gauge child, for the stats() of the instrumented classes
+        return self.labels(*values).value
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}", *self.samples()])
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        self.children[()].inc(amount)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def inc(self, amount: float = 1) -> None:
+        self.children[()].inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.children[()].dec(amount)
+
+    def set(self, value: float) -> None:
+        self.children[()].set(value)
+
+    def set_max(self, value: float) -> None:
+        self.children[()].set_max(value)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return _Histogram(self.buckets, self.lock)
+
+    def observe(self, value: float) -> None:
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            with self.lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="{}"'.format("+Inf" if bound == float("inf") else repr(float(bound)))
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, values)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, values)} {count}"
+
+
+class Registry:
+    """Metrics of the process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, clazz, name: str, documentation: str, labelnames: tuple, **kwargs):
+        with self.lock:
+            if (metric := self.metrics.get(name)) is None:
+                metric = self.metrics[name] = clazz(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not clazz or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered as {metric.TYPE} {metric.labelnames}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_http_server(port: int, host: str = "") -> http.server.ThreadingHTTPServer:
+    # For processes without a web framework (onair, charts): GET /metrics on a daemon thread
+    server = http.server.ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Metrics served at http://{host or '0.0.0.0'}:{port}/metrics")
+    return server
@@ -1,86 +1,315 @@
 import asyncio
+import concurrent.futures
 import importlib.util
 import inspect
 import pathlib
 
 import logging
+import signal
 import threading
+import time
 import traceback
 
 from backend.storage import *
-from backend.tools import MQTTClient
-from backend.services.onairservice import OnAirService
+from backend.httpclient import http
+from backend.metrics import registry, start_http_server
+from backend.profiling import Profiler
+from backend.tools import MQTTClient, json_serial
+from backend.topictrie import TopicTrie
+from backend.services.onairservice import OnAirService, OnAirMessage
+from configuration import Configuration, Topic
 
 logger = logging.getLogger("onair")
 PLUGINS_DIR = pathlib.Path(__file__).parent / "services"
 
+MESSAGES = registry.counter("onair_messages_total", "MQTT messages received, per topic", ("topic",))
+HANDLER_SECONDS = registry.histogram("onair_handler_seconds", "Service callback run time", ("service", "handler"))
+QUEUE_SECONDS = registry.histogram("onair_queue_seconds", "Time from MQTT receipt to the end of the callback (async dispatch)", ("service",))
+QUEUE_DEPTH = registry.gauge("onair_queue_depth", "Callbacks waiting in the service queue (async dispatch)", ("service",))
+QUEUE_MAX_DEPTH = registry.gauge("onair_queue_max_depth", "Highest service queue depth (async dispatch)", ("service",))
+CALLBACKS = registry.counter("onair_callbacks_total", "Service callbacks handled, failed or dropped on a full queue (async dispatch)", ("service", "result"))
+QUEUE_MAX_SECONDS = registry.gauge("onair_queue_max_seconds", "Longest time from MQTT receipt to the end of the callback (async dispatch)", ("service",))
+HANDLER_MAX_SECONDS = registry.gauge("onair_handler_max_seconds", "Longest service callback run time (async dispatch)", ("service",))
+
+
+class ServiceQueue:
+    """
+    Callbacks of one service in the async dispatch mode. They are queued by the
+    MQTT thread and run one at a time, in order, by a task on the OnAir loop:
+    'async def' handlers are awaited, plain ones go to the shared thread pool.
+    """
+
+    def __init__(self, service: OnAirService, size: int, timing=None):
+        self.service = service
+        self.timing = timing
+        self.queue = asyncio.Queue(maxsize=size)
+        self.name = type(service).__name__
+        self.depth = QUEUE_DEPTH.labels(self.name)
+        self.max_depth = QUEUE_MAX_DEPTH.labels(self.name)
+        self.latency = QUEUE_SECONDS.labels(self.name)
+        self.latency_max = QUEUE_MAX_SECONDS.labels(self.name)
+        self.handler_max = HANDLER_MAX_SECONDS.labels(self.name)
+
+    def put(self, handler, args: tuple):
+        try:
+            self.queue.put_nowait((handler, args, time.monotonic()))
+            self.max_depth.set_max(self.queue.qsize())
+            self.depth.set(self.queue.qsize())
+        except asyncio.QueueFull:
+            CALLBACKS.labels(self.name, "dropped").inc()
+            logger.error(f"{self.name} queue full, {handler.__name__} dropped")
+
+    async def consume(self, executor: concurrent.futures.Executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            handler, args, queued_at = await self.queue.get()
+            self.depth.set(self.queue.qsize())
+            start = time.monotonic()
+            try:
+                if inspect.iscoroutinefunction(handler):
+                    await handler(*args)
+                else:
+                    await loop.run_in_executor(executor, handler, *args)
+                CALLBACKS.labels(self.name, "handled").inc()
+            except Exception as e:
+                CALLBACKS.labels(self.name, "failed").inc()
+                logger.fatal("Exception caught in {}.{}! {}".format(self.name, handler.__name__, e))
+                traceback.print_exc()
+            end = time.monotonic()
+            HANDLER_SECONDS.labels(self.name, handler.__name__).observe(end - start)
+            if self.timing is not None:
+                self.timing(self.service, handler.__name__, end - start)
+            self.latency.observe(end - queued_at)
+            self.latency_max.set_max(end - queued_at)
+            self.handler_max.set_max(end - start)
+
+    def stats(self) -> dict:
+        # From the registry: the averages are the sums of the service's histograms over their counts
+        handled, failed = CALLBACKS.get(self.name, "handled"), CALLBACKS.get(self.name, "failed")
+        calls = max(1, handled + failed)
+        handler_total = sum(child.sum for (service, _), child in list(HANDLER_SECONDS.children.items()) if service == self.name)
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": int(self.max_depth.value),
+            "handled": int(handled),
+            "failed": int(failed),
+            "dropped": int(CALLBACKS.get(self.name, "dropped")),
+            "latency_avg_ms": round(self.latency.sum / calls * 1000, 2),
+            "latency_max_ms": round(self.latency_max.value * 1000, 2),
+            "handler_avg_ms": round(handler_total / calls * 1000, 2),
+            "handler_max_ms": round(self.handler_max.value * 1000, 2),
+        }
+
+
 class OnAir:
 
-    def __init__(self):
+    CONTROL_TOPIC = Topic.Control.format("onair", "profile")
+
+    def __init__(self, services: list = None, exclude: list = None, reporter=None, metrics_port: int = None, name: str = "onair"):
+        # services/exclude: class names to load (default all) or to leave out, see backend.supervisor
+        self.name = name
         self.mqtt = None
+        self.metrics_port = metrics_port
+        self.profiler = Profiler(name)
+        self.profile_timer = None
+        # Per call timing of the services it is enabled for at runtime: {service: {handler: [calls, total, max]}}
+        self.timings = {}
         self.loop = None
         self.stop_event = asyncio.Event()
-        self.services = self._load_services()
+        self.services = self._load_services(services, exclude)
+        self.reporter = reporter
+        self.subscriptions = TopicTrie()
+        for service in self.services:
+            for topic in service.MQTT_SUBSCRIPTIONS:
+                self.subscriptions.add(topic, service)
 
-    def on_connect(self, client, userdata, flags, reason_code, properties):
+        # "sync": service callbacks run on the MQTT network thread,
+        # "async": they are queued per service and run on the OnAir loop (see ServiceQueue)
+        conf = Configuration.get_onair_config()
+        self.dispatch = conf.get("dispatch", "sync")
+        self.queue_size = conf.get("queue_size", 1000)
+        self.stats_interval = conf.get("stats_interval", 300)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=conf.get("workers", 4), thread_name_prefix="onair")
+        self.queues: dict[OnAirService, ServiceQueue] = {}
+
+    def call(self, services: list, name: str, *args):
+        if self.dispatch == "async":
+            self.loop.call_soon_threadsafe(self._enqueue, services, name, args)
+            return
+        for service in services:
+            handler = getattr(service, name)
+            start = time.monotonic()
+            try:
+                if inspect.iscoroutinefunction(handler):
+                    asyncio.run_coroutine_threadsafe(handler(*args), self.loop).result()
+                else:
+                    handler(*args)
+            except Exception as e:
+                logger.fatal("Exception caught in {}.{}! {}".format(type(service).__name__, name, e))
+                traceback.print_exc()
+            elapsed = time.monotonic() - start
+            HANDLER_SECONDS.labels(type(service).__name__, name).observe(elapsed)
+            self.time_call(service, name, elapsed)
+
+    def time_call(self, service: OnAirService, name: str, seconds: float):
+        if (timing := self.timings.get(service)) is not None:
+            calls = timing.setdefault(name, [0, 0.0, 0.0])
+            calls[0] += 1
+            calls[1] += seconds
+            calls[2] = max(calls[2], seconds)
+
+    def timing_stats(self, service: OnAirService) -> dict:
+        return {name: {"calls": calls, "avg_ms": round(total / calls * 1000, 3), "max_ms": round(longest * 1000, 3)}
+                for name, (calls, total, longest) in list(self.timings.get(service, {}).items())}
+
+    def set_timing(self, names) -> None:
+        # names: service class names, "*" for all; the others stop being timed
+        enabled = {service for service in self.services if names == "*" or type(service).__name__ in (names or [])}
+        for service in list(self.timings):
+            if service not in enabled:
+                logger.info(f"Timing of {type(service).__name__} disabled: {self.timing_stats(service)}")
+                del self.timings[service]
+        for service in enabled:
+            self.timings.setdefault(service, {})
+        logger.info(f"Timing enabled for: {[type(service).__name__ for service in enabled]}")
+
+    def control(self, request) -> None:
+        # Profiling control (OnAir loop), e.g. {"action": "start", "mode": "sample", "duration": 30}, {"action": "stop"},
+        # {"action": "timing", "services": ["Devices"]} (or "*", or [] to disable); a dict or the control topic message
         try:
-            logger.info(f"Connected with result code: {reason_code}, flags: {flags}, userdata: {userdata}")
-            for service in self.services:
-                service.on_connect(client, userdata, flags, reason_code, properties)
-        except UnicodeError as e:
-            logger.fatal("Unicode error caught! {}".format(e))
-            traceback.print_exc()
+            if isinstance(request, OnAirMessage):
+                request = request.data
+            action = request["action"]
+            if action == "start":
+                duration = self.profiler.start(request.get("mode"), request.get("duration"))
+                self.profile_timer = self.loop.call_later(duration, self.stop_profiling)
+                self.publish_profile({"name": self.name, "mode": self.profiler.running, "running": True, "duration": duration})
+            elif action == "stop":
+                self.stop_profiling()
+            elif action == "timing":
+                self.set_timing(request.get("services"))
+            else:
+                raise ValueError(f"unknown action: {action}")
         except Exception as e:
-            logger.fatal("Exception caught! {}".format(e))
-            traceback.print_exc()
+            logger.error(f"Profiling control {getattr(request, 'text', request)} failed: {e}")
+
+    def toggle_profiling(self) -> None:
+        # SIGUSR1: start with the configured mode and duration, or stop early
+        self.control({"action": "stop" if self.profiler.running else "start"})
+
+    def stop_profiling(self) -> None:
+        if self.profile_timer is not None:
+            self.profile_timer.cancel()
+            self.profile_timer = None
+        self.publish_profile(self.profiler.stop() | {"running": False})
+
+    def publish_profile(self, summary: dict) -> None:
+        self.mqtt.publish(Topic.OnAir.format(Topic.OnAir.Facet.profile, self.name), json_serial(summary), retain=True)
+
+    def _enqueue(self, services: list, name: str, args: tuple):
+        for service in services:
+            self.queues[service].put(getattr(service, name), args)
+
+    def stats(self) -> dict:
+        result = {}
+        for service in self.services:
+            name = type(service).__name__
+            result[name] = service.stats()
+            if (queue := self.queues.get(service)) is not None:
+                result[name]["dispatch"] = queue.stats()
+            if service in self.timings:
+                result[name]["timing"] = self.timing_stats(service)
+        if self.mqtt is not None:
+            result["mqtt"] = self.mqtt.stats()
+        return result
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        logger.info(f"Connected with result code: {reason_code}, flags: {flags}, userdata: {userdata}")
+        for topic in self.subscriptions.filters:
+            client.subscribe(topic)
+        client.subscribe(self.CONTROL_TOPIC)
+        self.call(self.services, "on_connect", client, userdata, flags, reason_code, properties)
 
     def on_message(self, client, userdata, msg):
         try:
-            logger.debug(f"[{msg.topic}]{msg.payload.decode()}")
-            for service in self.services:
-                service.on_message(client, userdata, msg)
+            message = OnAirMessage(msg)
         except UnicodeError as e:
             logger.fatal("Unicode error caught! {}".format(e))
             logger.fatal("On message: [{}]{}".format(msg.topic, msg.payload))
-            traceback.print_exc()
-        except Exception as e:
-            logger.fatal("Exception caught! {}".format(e))
-            logger.fatal("On message: [{}]{}".format(msg.topic, msg.payload.decode()))
-            traceback.print_exc()
+            return
+        logger.debug(f"[{message.topic}]{message.text}")
+        MESSAGES.labels(message.topic).inc()
+        if message.topic == self.CONTROL_TOPIC:
+            if message.text:
+                # Decoded by control() on the OnAir loop, where a malformed payload is only logged
+                self.loop.call_soon_threadsafe(self.control, message)
+            return
+        if services := self.subscriptions.match(message.topic):
+            self.call(services, "on_message", client, userdata, message)
 
     def on_disconnect(self, *args, **kwargs):
-        try:
-            logger.info("MQTT disconnected!")
-            for service in self.services:
-                service.on_disconnect(*args, **kwargs)
-        except UnicodeError as e:
-            logger.fatal("Unicode error caught! {}".format(e))
-            traceback.print_exc()
-        except Exception as e:
-            logger.fatal("Exception caught! {}".format(e))
-            traceback.print_exc()
+        logger.info("MQTT disconnected!")
+        self.call(self.services, "on_disconnect", *args)
 
     @staticmethod
-    def _load_services():
-        tasks = []
+    def service_classes() -> list:
+        result = []
         for file in PLUGINS_DIR.glob("*.py"):
             spec = importlib.util.spec_from_file_location(file.stem, file)
             mod = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(mod)
 
             for name, obj in inspect.getmembers(mod, inspect.isclass):
-                if issubclass(obj, OnAirService) and obj is not OnAirService:
-                    tasks.append(obj())
+                if issubclass(obj, OnAirService) and obj is not OnAirService and obj not in result:
+                    result.append(obj)
+        return result
+
+    @staticmethod
+    def _load_services(names: list = None, exclude: list = None):
+        tasks = []
+        for clazz in OnAir.service_classes():
+            if (names is None or clazz.__name__ in names) and clazz.__name__ not in (exclude or []):
+                tasks.append(clazz())
         return tasks
 
+    async def log_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            services = self.stats()
+            logger.info(f"MQTT publishes: {services.pop('mqtt', None)}")
+            for name, stats in services.items():
+                logger.info(f"Dispatch {name}: {stats.get('dispatch')}")
+
+    async def report(self, interval: float):
+        while True:
+            try:
+                self.reporter(self.stats())
+            except Exception as e:
+                logger.error(f"Status report failed: {e}")
+            await asyncio.sleep(interval)
+
     async def main(self):
-        logger.info(f"OnAir services: {self.services}")
+        logger.info(f"OnAir services: {self.services}, dispatch: {self.dispatch}")
         self.loop = asyncio.get_running_loop()
         self.mqtt = MQTTClient(on_connect=self.on_connect, on_message=self.on_message, on_disconnect=self.on_disconnect)
 
         for service in self.services:
             service.mqtt = self.mqtt
 
+        consumers = []
+        if self.dispatch == "async":
+            for service in self.services:
+                self.queues[service] = ServiceQueue(service, self.queue_size, self.time_call)
+                consumers.append(asyncio.create_task(self.queues[service].consume(self.executor)))
+            consumers.append(asyncio.create_task(self.log_stats()))
+        if self.reporter is not None:
+            consumers.append(asyncio.create_task(self.report(Configuration.get_onair_config().get("supervisor", {}).get("status_interval", 30))))
+
+        try:
+            self.loop.add_signal_handler(signal.SIGUSR1, self.toggle_profiling)
+        except (NotImplementedError, RuntimeError) as e:
+            logger.warning(f"No SIGUSR1 profiling toggle: {e}")
+
         thread = threading.Thread(target=self.mqtt.loop_forever, daemon=True)
         thread.start()
 
@@ -88,14 +317,22 @@ class OnAir:
 
         await self.stop_event.wait()
         await asyncio.gather(*tasks, return_exceptions=True)
+        if self.profiler.running:
+            self.stop_profiling()
 
         self.mqtt.disconnect()
         self.mqtt.loop_stop()
 
         # Wait for MQTT thread to exit
         thread.join(timeout=2)
+        for consumer in consumers:
+            consumer.cancel()
+        await http.close()
+        self.executor.shutdown(wait=False)
 
     def start(self):
+        if self.metrics_port:
+            start_http_server(self.metrics_port)
         for service in self.services:
             service.on_start()
         asyncio.run(self.main())
@@ -0,0 +1,172 @@
+import collections
+import cProfile
+import datetime
+import logging
+import os
+import pathlib
+import pstats
+import sys
+import threading
+import time
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+from configuration import Configuration
+
+logger = logging.getLogger("onair.profiling")
+
+MODES = ("sample", "cprofile", "yappi")
+
+
+class Sampler(threading.Thread):
+    """
+    Statistical profiler of all the threads of the process: their stacks are
+    sampled every 'interval' seconds with sys._current_frames(), so the cost
+    does not depend on how much code runs.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    @staticmethod
+    def function(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.function(frame))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def dump(self, file: pathlib.Path):
+        # Collapsed stacks, as taken by flamegraph.pl / speedscope
+        with open(file, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def top(self, count: int) -> list:
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, samples in self.stacks.items():
+            own[stack[-1]] += samples
+            for function in set(stack):
+                total[function] += samples
+        return [{"function": function, "self_samples": samples, "total_samples": total[function],
+                 "self_pct": round(100 * samples / max(1, sum(own.values())), 1)}
+                for function, samples in own.most_common(count)]
+
+
+class Profiler:
+    """
+    Profiling of a running OnAir process for a bounded window:
+      sample    - Sampler, all threads (default)
+      cprofile  - deterministic, the thread that starts it (the OnAir loop: async handlers, service tasks)
+      yappi     - deterministic, all threads and asyncio tasks (if yappi is installed)
+    The profile is written under 'profiling.directory' and its top functions returned as a summary.
+    """
+
+    def __init__(self, name: str):
+        conf = Configuration.get_profiling_config()
+        self.name = name
+        self.directory = pathlib.Path(conf.get("directory", "/var/tmp/homectrl/profiles"))
+        self.top = conf.get("top", 20)
+        self.mode = conf.get("mode", "sample")
+        self.duration = conf.get("duration", 30)
+        self.max_duration = conf.get("max_duration", 300)
+        self.interval = conf.get("interval", 0.005)
+        self.running = None
+        self.started_at = None
+        self.profile = None
+
+    def start(self, mode: str = None, duration: float = None) -> float:
+        # Returns the duration of the window; the caller stops the profiler when it ends
+        if self.running is not None:
+            raise RuntimeError(f"Profiling ({self.running}) already running")
+        mode = mode or self.mode
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}, one of: {', '.join(MODES)}")
+        if mode == "yappi" and yappi is None:
+            raise ValueError("yappi is not installed")
+        duration = min(float(duration or self.duration), self.max_duration)
+
+        if mode == "sample":
+            self.profile = Sampler(self.interval)
+            self.profile.start()
+        elif mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            yappi.clear_stats()
+            yappi.set_clock_type("wall")
+            yappi.start()
+        self.running = mode
+        self.started_at = time.monotonic()
+        logger.info(f"Profiling ({mode}) started for {duration:.0f}s")
+        return duration
+
+    def stop(self) -> dict:
+        if self.running is None:
+            raise RuntimeError("Profiling not running")
+        mode = self.running
+        duration = time.monotonic() - self.started_at
+        base = f"{self.name}-{os.getpid()}-{datetime.datetime.now():%Y%m%d-%H%M%S}-{mode}"
+        try:
+            # Stopped first: whatever happens writing the profile, it does not keep running
+            if mode == "sample":
+                self.profile.stop()
+            elif mode == "cprofile":
+                self.profile.disable()
+            else:
+                yappi.stop()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if mode == "sample":
+                file = self.directory / f"{base}.txt"
+                self.profile.dump(file)
+                top = self.profile.top(self.top)
+            else:
+                file = self.directory / f"{base}.prof"
+                if mode == "cprofile":
+                    self.profile.dump_stats(file)
+                else:
+                    yappi.get_func_stats().save(str(file), type="pstat")
+                top = self.pstats_top(file, self.top)
+        finally:
+            self.running = None
+            self.profile = None
+
+        logger.info(f"Profiling ({mode}) stopped after {duration:.0f}s, written to {file}")
+        return {
+            "name": self.name,
+            "pid": os.getpid(),
+            "mode": mode,
+            "duration": round(duration, 1),
+            "file": str(file),
+            "create_at": datetime.datetime.now(),
+            "top": top,
+        }
+
+    @staticmethod
+    def pstats_top(file: pathlib.Path, count: int) -> list:
+        stats = pstats.Stats(str(file))
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:count]
+        return [{"function": f"{os.path.basename(filename)}:{line}({function})", "calls": calls,
+                 "self_ms": round(own * 1000, 2), "total_ms": round(total * 1000, 2)}
+                for (filename, line, function), (_, calls, own, total, _) in rows]
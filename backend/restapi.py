@@ -1,28 +1,36 @@
 import asyncio
 import datetime
+import email.utils
 import json
 import traceback
 import uuid
+from collections import OrderedDict
 from typing import Any
 
 from starlette.responses import JSONResponse
 from starlette.websockets import WebSocketState, WebSocketDisconnect
-from websockets.exceptions import ConnectionClosed
 from classy_fastapi import Routable, get, websocket, post
-from fastapi import FastAPI, WebSocket, status, HTTPException
+from fastapi import FastAPI, WebSocket, status, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
 from contextlib import asynccontextmanager
 from dateutil.relativedelta import relativedelta
 
+from backend.metrics import registry, CONTENT_TYPE
 from backend.storage import Chart, ChartPeriod, Laundry
-from configuration import Topic
+from backend.tracing import LatencyTracer, now_ms
+from configuration import Configuration, Topic
 from backend.tools import json_serial, json_deserial, MQTTClient
 
 import logging
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
+WS_CLIENTS = registry.gauge("restapi_websocket_clients", "Connected WebSocket clients")
+WS_SEND_SECONDS = registry.histogram("restapi_websocket_send_seconds", "Time to send one batch of frames to its clients")
+WS_FRAMES = registry.counter("restapi_websocket_frames_total", "Frames sent to WebSocket clients, per facet and type", ("facet", "type"))
+MQTT_MESSAGES = registry.counter("restapi_mqtt_messages_total", "onair messages received, per facet", ("facet",))
+
 class PrettyJSONResponse(JSONResponse):
 
     def render(self, content) -> bytes:
@@ -30,23 +38,64 @@ class PrettyJSONResponse(JSONResponse):
                           indent=2, separators=(",", ":")).encode("utf-8")
 
 
+class ChartCache:
+    """PNG bytes of the most recently served charts, keyed by (model, period, name, create_at)."""
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.charts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> bytes | None:
+        if (data := self.charts.get(key)) is not None:
+            self.charts.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return data
+
+    def put(self, key: tuple, data: bytes):
+        self.charts[key] = data
+        self.charts.move_to_end(key)
+        while len(self.charts) > self.size:
+            self.charts.popitem(last=False)
+
+
 class ConnectionManager:
     MQTT_SUBSCRIPTIONS = [
         Topic.OnAir.format("+", "+")
     ]
+    SEND_TIMEOUT = 5
 
     def __init__(self) -> None:
-        self.connections = {}
-        self.mqtt = MQTTClient(on_connect=self.on_connect, on_message=self.on_message, on_disconnect=self.on_disconnect)
+        self.clients = {}
+        self.subscriptions = {}
+        self.mqtt = None
         self.onair = {}
+        self.loop = None
+        self.changed = {}
+        self.pending = {}
+        self.senders = {}
+        conf = Configuration.get_restapi_config()
+        self.push_interval = conf.get("push_interval", 0.5)
+        self.push_intervals = conf.get("push_intervals", {})
+        self.idle_timeout = conf.get("ws_idle_timeout", 60)
+        self.tracer = LatencyTracer(conf.get("trace_window", 500))
 
     def on_start(self):
+        # MQTT callbacks hand over to this loop, which owns the WebSockets and the onair state:
+        self.loop = asyncio.get_running_loop()
+        # Connected here, not on import, so the module can be loaded without a broker (see benchmarks):
+        self.mqtt = MQTTClient(on_connect=self.on_connect, on_message=self.on_message, on_disconnect=self.on_disconnect)
         self.mqtt.loop_start()
         logger.info("ON START!!!")
 
     def on_stop(self):
         self.mqtt.disconnect()
         self.mqtt.loop_stop()
+        for task in self.senders.values():
+            task.cancel()
         logger.info("ON STOP!!!")
 
     def on_connect(self, client, userdata, flags, reason_code, properties):
@@ -58,50 +107,158 @@ class ConnectionManager:
         logger.info("MQTT disconnected!")
 
     def on_message(self, client, userdata, msg):
+        # paho network thread: parse only, everything else happens on the application loop
         try:
             decoded = msg.payload.decode()
             if decoded:
                 logger.debug("[{}]{}".format(msg.topic, decoded))
                 facet, device = Topic.OnAir.parse(msg.topic)
+                MQTT_MESSAGES.labels(facet).inc()
                 message = json_deserial(decoded)
                 if isinstance(message, dict):
                     message["name"] = device
+                    # A retained message replayed on subscribe is not a delivery, its latency is not traced
+                    if isinstance(trace := message.get("trace"), dict) and not msg.retain:
+                        trace["restapi_rx"] = now_ms()
                 #if facet != "live":
                  #   message["live"] = self.onair.get("live") and self.onair["live"].get(device) and self.onair["live"][device]["value"]
-                if not self.onair.get(facet):
-                    self.onair[facet] = {}
-                self.onair[facet][device] = message
-                asyncio.run(self.send_message(self.prepare_response(facet), facet))
+                self.loop.call_soon_threadsafe(self.update, facet, device, message)
         except Exception as e:
             logger.fatal("Exception caught! {}".format(e))
             logger.fatal("On message: [{}]{}".format(msg.topic, msg.payload.decode()))
             traceback.print_exc()
 
-    def prepare_response(self, facet: str):
-        return json_serial({"status": "OK", "result": list(self.onair[facet].values())})
+    def update(self, facet: str, device: str, message):
+        if facet == "trace":
+            # Envelope of every device message, see backend.tracing
+            self.tracer.received(device, message)
+            return
+        if not self.onair.get(facet):
+            self.onair[facet] = {}
+        self.onair[facet][device] = message
+        if self.subscriptions.get(facet):
+            self.changed.setdefault(facet, set()).add(device)
+            if (pending := self.pending.get(facet)) is None:
+                pending = self.pending[facet] = asyncio.Event()
+                self.senders[facet] = asyncio.create_task(self.sender(facet, pending))
+            pending.set()
+
+    async def sender(self, facet: str, pending: asyncio.Event):
+        # At most one push per interval, carrying only the devices changed in the meantime.
+        # The first change after a quiet period goes out immediately.
+        interval = self.push_intervals.get(facet, self.push_interval)
+        while True:
+            await pending.wait()
+            pending.clear()
+            if devices := self.changed.pop(facet, None):
+                try:
+                    await self.send_delta(facet, devices)
+                except Exception as e:
+                    logger.error("Sending facet {} failed: {}".format(facet, e))
+            await asyncio.sleep(interval)
+
+    def prepare_response(self, facet: str, devices: frozenset = None):
+        entries = self.onair.get(facet, {})
+        result = list(entries.values()) if devices is None else [entries[device] for device in devices if device in entries]
+        return json_serial({"status": "OK", "type": "snapshot", "facet": facet, "result": result})
+
+    def prepare_delta(self, facet: str, devices: set):
+        entries = self.onair.get(facet, {})
+        return json_serial({"status": "OK", "type": "delta", "facet": facet,
+                            "result": [entries[device] for device in devices if device in entries]})
 
     async def connect(self, ws: WebSocket, facet: str = None) -> str:
         await ws.accept()
         id = str(uuid.uuid4())
         logger.debug("Client #{} connected".format(id))
-        if not self.connections.get(facet):
-            self.connections[facet] = {}
-        self.connections[facet][id] = ws
-        await ws.send_text(self.prepare_response(facet))
+        self.clients[id] = ws
+        WS_CLIENTS.set(len(self.clients))
+        if facet is not None:
+            await self.subscribe(id, facet)
         return id
 
-    async def disconnect(self, id, facet: str = None) -> None:
-        logger.debug("Client #{} removed from manager".format(id))
-        del self.connections[facet][id]
+    async def subscribe(self, id, facet: str, devices: list = None) -> None:
+        if facet not in self.subscriptions:
+            self.subscriptions[facet] = {}
+        self.subscriptions[facet][id] = frozenset(devices) if devices else None
+        await self.snapshot(id, facet)
 
-    async def send_message(self, message, facet: str = None) -> None:
-        if self.connections.get(facet):
-            for id, ws in self.connections[facet].items():
-                try:
-                    await ws.send_text(message)
-                except ConnectionClosed:
-                    logger.debug("Client #{} disconnected while send".format(id))
-                    await self.disconnect(id, facet)
+    async def unsubscribe(self, id, facet: str) -> None:
+        self.subscriptions.get(facet, {}).pop(id, None)
+
+    async def snapshot(self, id, facet: str) -> None:
+        if (subscribers := self.subscriptions.get(facet, {})) and id in subscribers:
+            WS_FRAMES.labels(facet, "snapshot").inc()
+            await self.send_message([(id, self.prepare_response(facet, subscribers[id]))])
+
+    async def receive(self, id, data: str) -> None:
+        # Multiplexed endpoint protocol, e.g.: {"action": "subscribe", "facet": "temperature", "devices": ["kitchen"]}
+        try:
+            request = json_deserial(data)
+            action = request["action"]
+            if action == "subscribe":
+                await self.subscribe(id, request["facet"], request.get("devices"))
+            elif action == "unsubscribe":
+                await self.unsubscribe(id, request["facet"])
+            elif action == "snapshot":
+                await self.snapshot(id, request["facet"])
+            elif action == "ping":
+                await self.send_message([(id, json_serial({"status": "OK", "type": "pong"}))])
+            else:
+                raise ValueError("unknown action: {}".format(action))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.debug("Client #{} bad request {}: {}".format(id, data, repr(e)))
+            await self.send_message([(id, json_serial({"status": "ERROR", "type": "error", "message": str(e)}))])
+
+    async def disconnect(self, id) -> None:
+        for subscribers in self.subscriptions.values():
+            subscribers.pop(id, None)
+        if self.clients.pop(id, None) is not None:
+            logger.debug("Client #{} removed from manager".format(id))
+        WS_CLIENTS.set(len(self.clients))
+
+    async def send_delta(self, facet: str, devices: set) -> None:
+        # Subscribers with the same device filter share one serialized frame:
+        groups = {}
+        for id, selected in self.subscriptions.get(facet, {}).items():
+            groups.setdefault(selected, []).append(id)
+        messages = []
+        for selected, ids in groups.items():
+            if changed := (devices if selected is None else devices & selected):
+                message = self.prepare_delta(facet, changed)
+                messages.extend((id, message) for id in ids)
+        WS_FRAMES.labels(facet, "delta").inc(len(messages))
+        await self.send_message(messages)
+        if messages:
+            self.traced(facet, devices)
+
+    def traced(self, facet: str, devices: set) -> None:
+        sent = now_ms()
+        entries = self.onair.get(facet, {})
+        for device in devices:
+            if isinstance(entry := entries.get(device), dict) and isinstance(trace := entry.get("trace"), dict) \
+                    and "restapi_rx" in trace and "restapi_tx" not in trace:
+                trace["restapi_tx"] = sent
+                self.tracer.pushed(device, trace)
+
+    async def send_message(self, messages: list) -> None:
+        if clients := [(id, self.clients[id], message) for id, message in messages if id in self.clients]:
+            with WS_SEND_SECONDS.time():
+                results = await asyncio.gather(
+                    *[asyncio.wait_for(ws.send_text(message), self.SEND_TIMEOUT) for _, ws, message in clients],
+                    return_exceptions=True)
+            for (id, ws, _), result in zip(clients, results):
+                if isinstance(result, BaseException):
+                    logger.debug("Client #{} dropped while send: {}".format(id, repr(result)))
+                    await self.disconnect(id)
+                    asyncio.create_task(self.close(ws))
+
+    async def close(self, ws: WebSocket) -> None:
+        if ws.application_state == WebSocketState.CONNECTED:
+            try:
+                await asyncio.wait_for(ws.close(), self.SEND_TIMEOUT)
+            except Exception:
+                pass
 
     async def send_control_message(self, message: dict) -> None:
         topic = Topic.Device.format(message["name"], Topic.Device.Facility.control)
@@ -115,6 +272,26 @@ class HomeCtrlAPI(Routable):
     def __init__(self) -> None:
         super().__init__(prefix='/homectrl/v1')
         self.connection_manager = ConnectionManager()
+        self.chart_cache = ChartCache()
+
+    @websocket("/ws")
+    async def ws(self, ws: WebSocket):
+        # One socket for all facets: clients send {"action": "subscribe" | "unsubscribe" | "snapshot" | "ping", "facet": ...}
+        # and receive frames tagged with "facet". Clients silent for longer than ws_idle_timeout are dropped,
+        # a ping keeps an idle dashboard alive.
+        id = await self.connection_manager.connect(ws)
+        try:
+            while ws.application_state == WebSocketState.CONNECTED:
+                data = await asyncio.wait_for(ws.receive_text(), self.connection_manager.idle_timeout)
+                await self.connection_manager.receive(id, data)
+        except WebSocketDisconnect:
+            logger.debug("Client {} disconnected while recv".format(id))
+        except asyncio.TimeoutError:
+            logger.debug("Client {} silent for {}s, closing".format(id, self.connection_manager.idle_timeout))
+            await self.connection_manager.close(ws)
+        finally:
+            await self.connection_manager.disconnect(id)
+        logger.debug("Client {} has gone".format(id))
 
     async def ws_facet(self, ws: WebSocket, facet: str):
         id = await self.connection_manager.connect(ws, facet)
@@ -122,10 +299,12 @@ class HomeCtrlAPI(Routable):
             while ws.application_state == WebSocketState.CONNECTED:
                 data = await ws.receive_text()
                 logger.debug("Client {} recv data: {}".format(id, data))
-                await asyncio.sleep(1)
+                if data == "snapshot":
+                    await self.connection_manager.snapshot(id, facet)
         except WebSocketDisconnect:
             logger.debug("Client {} disconnected while recv".format(id))
-            await self.connection_manager.disconnect(id, facet)
+        finally:
+            await self.connection_manager.disconnect(id)
         logger.debug("Client {} has gone".format(id))
 
     @websocket("/ws/humidity")
@@ -185,11 +364,40 @@ class HomeCtrlAPI(Routable):
         await self.ws_facet(ws, "activity")
 
     @get("/chart/{period}/{facet}/{device}")
-    async def get_basic_chart(self, period: str, facet: str, device: str):
-        cache = Chart.get_last(facet[0].upper() + facet[1:], ChartPeriod.from_str(period), device)
-        if not cache:
+    async def get_basic_chart(self, period: str, facet: str, device: str, request: Request):
+        try:
+            chart_period = ChartPeriod(period)
+        except ValueError:
             return Response(status_code=status.HTTP_404_NOT_FOUND)
-        return Response(content=cache.getvalue(), media_type="image/png", status_code=status.HTTP_200_OK)
+        model = facet[0].upper() + facet[1:]
+        chart = Chart.get_create_at(model, chart_period, device)
+        if not chart:
+            return Response(status_code=status.HTTP_404_NOT_FOUND)
+
+        # Valid until the chart may be regenerated:
+        max_age = int(max(0.0, (chart.create_at + chart_period.refresh() - datetime.datetime.now()).total_seconds()))
+        last_modified = chart.create_at.astimezone().replace(microsecond=0)
+        headers = {
+            "ETag": '"{}"'.format(int(chart.create_at.timestamp() * 1_000_000)),
+            "Last-Modified": email.utils.format_datetime(last_modified.astimezone(datetime.timezone.utc), usegmt=True),
+            "Cache-Control": "max-age={}".format(max_age),
+        }
+
+        if (etags := request.headers.get("if-none-match")) is not None:
+            if headers["ETag"] in [etag.strip() for etag in etags.split(",")] or etags.strip() == "*":
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        elif (since := request.headers.get("if-modified-since")) is not None:
+            try:
+                if last_modified <= email.utils.parsedate_to_datetime(since):
+                    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            except (TypeError, ValueError):
+                pass
+
+        key = (model, chart_period, device, chart.create_at)
+        if (data := self.chart_cache.get(key)) is None:
+            data = Chart.select(Chart.data).where(Chart.id == chart.id).get().getvalue()
+            self.chart_cache.put(key, data)
+        return Response(content=data, media_type="image/png", status_code=status.HTTP_200_OK, headers=headers)
 
     @get("/dump", response_class=PrettyJSONResponse)
     async def dump(self):
@@ -207,6 +415,17 @@ class HomeCtrlAPI(Routable):
 
         return result
 
+    @get("/trace")
+    async def trace(self):
+        # Per device latency percentiles (ms) of the trace envelope stages and lost messages
+        return self.connection_manager.tracer.report()
+
+    @get("/trace/{device}")
+    async def trace_device(self, device: str):
+        if not (report := self.connection_manager.tracer.report(device)):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No trace of device {}".format(device))
+        return report
+
     @get("/capabilities")
     async def capabilities(self):
         return self.connection_manager.onair.get("capabilities")
@@ -264,6 +483,13 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan)
 
 app.include_router(api.router)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
 origins = [
     "http://localhost:3000",
     "http://localhost:8080",
@@ -316,6 +542,12 @@ UVICORN_LOG_CONFIG: dict[str, Any] = {
     },
 }
 
+# Protocol level pings and permessage-deflate are handled by uvicorn:
+UVICORN_WS_CONFIG: dict[str, Any] = {
+    key: value for key, value in Configuration.get_restapi_config().items()
+    if key in ("ws_ping_interval", "ws_ping_timeout", "ws_per_message_deflate")
+}
+
 
 if __name__ == "__main__":
 
@@ -328,4 +560,4 @@ if __name__ == "__main__":
     #     bind_to = 'localhost'
     bind_to = 'status.home'
 
-    uvicorn.run("__main__:app", host=bind_to, port=8000, workers=1, log_config=UVICORN_LOG_CONFIG)
+    uvicorn.run("__main__:app", host=bind_to, port=8000, workers=1, log_config=UVICORN_LOG_CONFIG, **UVICORN_WS_CONFIG)
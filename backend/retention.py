@@ -0,0 +1,164 @@
+import datetime
+import logging
+import time
+from typing import Type
+
+from peewee import BooleanField, DecimalField, IntegerField
+
+from backend import storage
+from backend.storage import database, HomeCtrlBaseModel, RollupMinute, RollupHour, RetentionMark
+from configuration import Configuration
+
+logger = logging.getLogger("storage.retention")
+
+ROLLUP_COLUMNS = "model, name_id, field, bucket_at, samples, min, max, avg, last, on_time"
+
+
+class Retention:
+    """
+    Rolls raw device history older than 'raw_days' into per-minute and per-hour
+    aggregates and drops the raw rows in batches. Per-minute aggregates are kept
+    'minute_days', per-hour ones forever. Driven by the 'retention' section of
+    homectrl-map.json, e.g.:
+
+        "retention": {"batch_size": 5000, "models": {"Radar": {"raw_days": 14, "minute_days": 90}}}
+    """
+
+    def __init__(self):
+        conf = Configuration.get_retention_config()
+        self.batch_size = conf.get("batch_size", 5000)
+        self.models = {getattr(storage, name): model_conf for name, model_conf in conf.get("models", {}).items()}
+
+    def run(self):
+        for model, conf in self.models.items():
+            start = time.monotonic()
+            try:
+                # A connection but no surrounding transaction ('with database' is one): every day of
+                # rollup and every delete batch is committed on its own
+                with database.connection_context():
+                    cutoff = (datetime.datetime.now() - datetime.timedelta(days=conf["raw_days"])).replace(minute=0, second=0, microsecond=0)
+                    rolled_until = self.rollup(model, cutoff)
+                    deleted = self.delete_raw(model, rolled_until)
+                    deleted_minutes = self.delete_minutes(model, datetime.datetime.now() - datetime.timedelta(days=conf.get("minute_days", 90)))
+                logger.info(f"Retention of {model.__name__}: rolled up until {rolled_until}, {deleted} raw rows "
+                            f"and {deleted_minutes} minute rollups dropped in {time.monotonic() - start:.1f}s")
+            except Exception as e:
+                logger.error(f"Retention of {model.__name__} failed: {e}")
+
+    @staticmethod
+    def fields(model: Type[HomeCtrlBaseModel]) -> list:
+        return [f for f in model._meta.sorted_fields
+                if isinstance(f, (IntegerField, DecimalField, BooleanField)) and f is not model._meta.primary_key]
+
+    def rollup(self, model: Type[HomeCtrlBaseModel], cutoff: datetime.datetime) -> datetime.datetime:
+        mark = RetentionMark.get_or_none(RetentionMark.model == model.__name__)
+        if mark is None:
+            first = model.select(model.create_at).order_by(model.create_at.asc()).limit(1).scalar()
+            if first is None:
+                return cutoff
+            mark = RetentionMark(model=model.__name__, rolled_until=first.replace(minute=0, second=0, microsecond=0))
+            mark.save(force_insert=True)
+
+        # One day at a time, so a long backlog does not end up in one huge transaction:
+        while mark.rolled_until < cutoff:
+            end = min(mark.rolled_until + datetime.timedelta(days=1), cutoff)
+            with database.atomic():
+                for field in self.fields(model):
+                    if isinstance(field, BooleanField):
+                        self._rollup_boolean(model, field, mark.rolled_until, end)
+                    else:
+                        self._rollup_numeric(model, field, mark.rolled_until, end)
+                self._rollup_hours(model, mark.rolled_until, end)
+                mark.rolled_until = end
+                mark.save()
+        return mark.rolled_until
+
+    @staticmethod
+    def _rollup_numeric(model, field, start, end):
+        table = model._meta.table_name
+        database.execute_sql(f"""
+            insert into {RollupMinute._meta.table_name} ({ROLLUP_COLUMNS})
+            select %(model)s, name_id, %(field)s, date_trunc('minute', create_at) as bucket, count(*),
+                   min({field.column_name}), max({field.column_name}), avg({field.column_name}),
+                   (array_agg({field.column_name} order by create_at desc))[1], null
+            from "{table}"
+            where create_at >= %(start)s and create_at < %(end)s and {field.column_name} is not null
+            group by name_id, bucket
+            on conflict do nothing""",
+            {"model": model.__name__, "field": field.name, "start": start, "end": end})
+
+    @staticmethod
+    def _rollup_boolean(model, field, start, end):
+        # State changes are turned into [since, until) intervals, split over the minutes they span.
+        # The state at 'start' is carried in from the last minute rolled up before.
+        table = model._meta.table_name
+        minute = RollupMinute._meta.table_name
+        database.execute_sql(f"""
+            insert into {minute} ({ROLLUP_COLUMNS})
+            with changes as (
+                select name_id, %(start)s::timestamp as since, last <> 0 as value, true as carried
+                from (select distinct on (name_id) name_id, last from {minute}
+                      where model = %(model)s and field = %(field)s and bucket_at < %(start)s
+                      order by name_id, bucket_at desc) c
+                union all
+                select name_id, create_at, {field.column_name}, false
+                from "{table}"
+                where create_at >= %(start)s and create_at < %(end)s
+            ), intervals as (
+                select name_id, since, value, carried,
+                       lead(since, 1, %(end)s::timestamp) over (partition by name_id order by since, carried desc) as until
+                from changes
+            ), parts as (
+                select name_id, since, value, carried, b.bucket,
+                       extract(epoch from least(until, b.bucket + interval '1 minute') - greatest(since, b.bucket)) as seconds
+                from intervals
+                cross join lateral generate_series(date_trunc('minute', since), until - interval '1 microsecond', interval '1 minute') as b(bucket)
+                where until > since
+            )
+            select %(model)s, name_id, %(field)s, bucket,
+                   count(*) filter (where not carried and since >= bucket),
+                   min(value::int), max(value::int),
+                   coalesce(sum(seconds) filter (where value), 0) / 60,
+                   (array_agg(value::int order by since desc))[1],
+                   coalesce(sum(seconds) filter (where value), 0)
+            from parts
+            group by name_id, bucket
+            on conflict do nothing""",
+            {"model": model.__name__, "field": field.name, "start": start, "end": end})
+
+    @staticmethod
+    def _rollup_hours(model, start, end):
+        database.execute_sql(f"""
+            insert into {RollupHour._meta.table_name} ({ROLLUP_COLUMNS})
+            select model, name_id, field, date_trunc('hour', bucket_at) as bucket, sum(samples),
+                   min(min), max(max),
+                   coalesce(sum(on_time) / 3600, sum(avg * samples) / nullif(sum(samples), 0)),
+                   (array_agg(last order by bucket_at desc))[1], sum(on_time)
+            from {RollupMinute._meta.table_name}
+            where model = %(model)s and bucket_at >= %(start)s and bucket_at < %(end)s
+            group by model, name_id, field, bucket
+            on conflict do nothing""",
+            {"model": model.__name__, "start": start, "end": end})
+
+    def delete_raw(self, model: Type[HomeCtrlBaseModel], until: datetime.datetime) -> int:
+        # The current entry of each name stays, it is what get_currents() and onair start from.
+        currents = [entry.id for entry in model.get_currents()]
+        subquery = (model.select(model.id)
+                    .where(model.create_at < until, model.id.not_in(currents) if currents else True)
+                    .limit(self.batch_size))
+        return self._delete_in_batches(lambda: model.delete().where(model.id.in_(subquery)).execute())
+
+    def delete_minutes(self, model: Type[HomeCtrlBaseModel], until: datetime.datetime) -> int:
+        subquery = (RollupMinute.select(RollupMinute.id)
+                    .where(RollupMinute.model == model.__name__, RollupMinute.bucket_at < until)
+                    .limit(self.batch_size))
+        return self._delete_in_batches(lambda: RollupMinute.delete().where(RollupMinute.id.in_(subquery)).execute())
+
+    def _delete_in_batches(self, delete) -> int:
+        result = 0
+        while True:
+            with database.atomic():
+                deleted = delete()
+            result += deleted
+            if deleted < self.batch_size:
+                return result
@@ -1,9 +1,9 @@
 import asyncio
 from datetime import date, time, datetime, timedelta
 
-import aiohttp
 import logging
 
+from backend.httpclient import http
 from backend.services.onairservice import OnAirService
 from configuration import Topic, Configuration
 from backend.tools import json_serial
@@ -44,55 +44,54 @@ class Astro(OnAirService):
 
         logger.debug(f"url: {url}")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                logger.debug(f"Response status: {response.status}")
-                if response.status == 200:
-                    data = await response.json()
-                    logger.debug(await response.text())
-
-                    astro_data = []
-                    for astro_day in data["days"]:
-                        astro_day_date = datetime.strptime(astro_day["datetime"], "%Y-%m-%d").date()
-                        logger.debug(f"Processing astro data for date: {astro_day_date}")
-
-                        moon_events = []
-                        if astro_day.get("moonrise", None) is not None:
-                            moon_events.append({'type': 'rise', 'time': time.fromisoformat(astro_day["moonrise"])})
-                        if astro_day.get("moonset", None) is not None:
-                            moon_events.append({'type': 'set', 'time': time.fromisoformat(astro_day["moonset"])})
-
-                        moon_events.sort(key=lambda e: e['time'])
-
-                        day_record = {
-                            'day': {
-                                'date': astro_day_date,
-                                'weekday': astro_day_date.strftime("%A"),
-                                'day_offset': (astro_day_date - day).days,
-                            },
-                            'sun': {
-                                'events': [
-                                    {'type': 'rise', 'time': time.fromisoformat(astro_day.get("sunrise", None))},
-                                    {'type': 'set', 'time': time.fromisoformat(astro_day.get("sunset", None))},
-                                ],
-                            },
-                            'moon': {
-                                'events': moon_events,
-                                'phase': astro_day.get("moonphase", None),
-                            },
-                        }
-                        astro_data.append(day_record)
-
-
-                    # just incase sort by date
-                    astro_data.sort(key=lambda d: d['day']['date'])
-
-                    return {
-                        'name': 'astro',
-                        'astro': astro_data,
-                    }
-                else:
-                    raise Exception(f"Error fetching astro data: {response.status}")
+        response = await http.get(url)
+        logger.debug(f"Response status: {response.status}")
+        if response.status == 200:
+            data = response.json()
+            logger.debug(response.text)
+
+            astro_data = []
+            for astro_day in data["days"]:
+                astro_day_date = datetime.strptime(astro_day["datetime"], "%Y-%m-%d").date()
+                logger.debug(f"Processing astro data for date: {astro_day_date}")
+
+                moon_events = []
+                if astro_day.get("moonrise", None) is not None:
+                    moon_events.append({'type': 'rise', 'time': time.fromisoformat(astro_day["moonrise"])})
+                if astro_day.get("moonset", None) is not None:
+                    moon_events.append({'type': 'set', 'time': time.fromisoformat(astro_day["moonset"])})
+
+                moon_events.sort(key=lambda e: e['time'])
+
+                day_record = {
+                    'day': {
+                        'date': astro_day_date,
+                        'weekday': astro_day_date.strftime("%A"),
+                        'day_offset': (astro_day_date - day).days,
+                    },
+                    'sun': {
+                        'events': [
+                            {'type': 'rise', 'time': time.fromisoformat(astro_day.get("sunrise", None))},
+                            {'type': 'set', 'time': time.fromisoformat(astro_day.get("sunset", None))},
+                        ],
+                    },
+                    'moon': {
+                        'events': moon_events,
+                        'phase': astro_day.get("moonphase", None),
+                    },
+                }
+                astro_data.append(day_record)
+
+
+            # just incase sort by date
+            astro_data.sort(key=lambda d: d['day']['date'])
+
+            return {
+                'name': 'astro',
+                'astro': astro_data,
+            }
+        else:
+            raise Exception(f"Error fetching astro data: {response.status}")
 
     @staticmethod
     async def _add_datetime(astro_data: dict) -> dict:
@@ -1,11 +1,18 @@
+import asyncio
 import traceback
 import logging
 import datetime
+import time
 
 from backend.services.onairservice import OnAirService
-from backend.tools import json_serial, json_deserial
+from backend.tracing import now_ms
+from backend.tools import json_serial
 from configuration import Topic
 from backend import storage
+from backend.writer import StorageWriter
+from backend.retention import Retention
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 
 logger = logging.getLogger("onair.devices")
 
@@ -22,65 +29,78 @@ class Devices(OnAirService):
         super().__init__()
         self.start_at = datetime.datetime.now()
         self.status = {}
+        self.writer = StorageWriter()
+
+    def on_start(self):
+        self.writer.start()
+
+    def on_stop(self):
+        self.writer.stop()
+
+    def stats(self) -> dict:
+        return {"writer": self.writer.stats(), "last_values": storage.last_values.stats(), "database": storage.database.stats()}
 
     def on_message(self, client, userdata, msg):
-        if Topic.Device.is_topic(msg.topic):
-            try:
-                logger.debug("[{}]{}".format(msg.topic, msg.payload.decode()))
-                data = json_deserial(msg.payload.decode())
-                device, facility_str = Topic.Device.parse(msg.topic)
-                facility = Topic.Device.Facility(facility_str)
-
-                if facility in [Topic.Device.Facility.live, Topic.Device.Facility.data]:
-                    if data.get("name") is None:
-                        data["name"] = device
-                    data["timestamp"] = datetime.datetime.now()
-
-                    for entry in self.data2entries(data):
-                        status_current = self.status.get(type(entry))
-                        logger.debug(f"ENTRY: {entry}, current status: {status_current}")
-                        if status_current is not None:
-
-                            try :
-                                the_name = entry.name.value
-                            except Exception:
-                                the_name = None
-
-                            if the_name:
-                                current = status_current.get(the_name)
-                                if not entry.equals(current):
-                                    logger.debug("SWITCH {} for {}".format(type(entry), entry.name.value))
-                                    self.process_entry(entry)
-
-                    # Some additional data, passed OnAir, but not saved in the database:
-                    for key, value in data.items():
-                        if key.startswith("transient_"):
-                            msg = {
-                                "name": {"value": device},
-                                "create_at": data["timestamp"],
-                                "value": value
-                            }
-                            self.mqtt.publish(Topic.OnAir.format(key.split('_')[1], device), json_serial(msg), retain=False)
-
-                elif facility in [Topic.Device.Facility.capabilities, Topic.Device.Facility.state]:
-                    self.mqtt.publish(Topic.OnAir.format(facility, device),
-                                      json_serial(data), retain=True)
-
-                else:
-                    pass
-                    # logger.error("ERROR! Topic not recognized: {}".format(msg.topic))
-
-            except UnicodeError as e:
-                logger.fatal("Unicode error caught! {}".format(e))
-                logger.fatal("On message: [{}]{}".format(msg.topic, msg.payload))
-                traceback.print_exc()
-
-            except Exception as e:
-                logger.fatal("Exception caught! {}".format(e))
-                logger.fatal("On message: [{}]{}".format(msg.topic, msg.payload.decode()))
-                traceback.print_exc()
-                # for line in traceback.format_stack():
-                #     print(line.strip())
+        try:
+            # homectrl/device/<name>/<facility>; the decoded data is shared with other services, copy before changes:
+            data = dict(msg.data)
+            device, facility_str = msg.parts[2:4]
+            facility = Topic.Device.Facility(facility_str)
+            # Optional trace envelope (BoardApplication.publish), forwarded on the trace facet, see backend.tracing:
+            if isinstance(trace := data.pop("trace", None), dict):
+                trace = trace | {"onair_rx": msg.received_at * 1000}
+            else:
+                trace = None
+
+            if facility in [Topic.Device.Facility.live, Topic.Device.Facility.data]:
+                if data.get("name") is None:
+                    data["name"] = device
+                data["timestamp"] = datetime.datetime.now()
+
+                for entry in self.data2entries(data):
+                    status_current = self.status.get(type(entry))
+                    logger.debug(f"ENTRY: {entry}, current status: {status_current}")
+                    if status_current is not None:
+
+                        try :
+                            the_name = entry.name.value
+                        except Exception:
+                            the_name = None
+
+                        if the_name:
+                            current = status_current.get(the_name)
+                            if not entry.equals(current):
+                                logger.debug("SWITCH {} for {}".format(type(entry), entry.name.value))
+                                self.process_entry(entry, trace=trace)
+
+                # Some additional data, passed OnAir, but not saved in the database:
+                for key, value in data.items():
+                    if key.startswith("transient_"):
+                        transient = {
+                            "name": {"value": device},
+                            "create_at": data["timestamp"],
+                            "value": value
+                        }
+                        self.mqtt.publish(Topic.OnAir.format(key.split('_')[1], device), json_serial(transient), retain=False)
+
+            elif facility in [Topic.Device.Facility.capabilities, Topic.Device.Facility.state]:
+                self.mqtt.publish(Topic.OnAir.format(facility, device),
+                                  json_serial(data), retain=True)
+
+            else:
+                pass
+                # logger.error("ERROR! Topic not recognized: {}".format(msg.topic))
+
+            if trace is not None:
+                trace.setdefault("onair_tx", now_ms())
+                self.mqtt.publish(Topic.OnAir.format("trace", device), json_serial(trace), retain=False)
+
+        except Exception as e:
+            logger.fatal("Exception caught! {}".format(e))
+            logger.fatal("On message: [{}]{}".format(msg.topic, msg.text))
+            traceback.print_exc()
+            # for line in traceback.format_stack():
+            #     print(line.strip())
 
     @staticmethod
     def data2entries(data: dict) -> list:
@@ -111,25 +131,56 @@ class Devices(OnAirService):
                                           value=value.get('value'), voltage=value.get('voltage')))
         return result
 
-    def process_entry(self, entry: storage.HomeCtrlBaseModel, db_save=True):
+    def process_entry(self, entry: storage.HomeCtrlBaseModel, db_save=True, trace: dict = None):
         self.status[type(entry)][entry.name.value] = entry
         subject = Topic.OnAir.format(type(entry).__name__.lower(), entry.name.value)
         logger.debug("PUBLISH {} -> {}".format(subject, storage.model_to_dict(entry)))
         if db_save:
-            entry.save_new_value()
+            self.writer.submit(entry)
+        message = storage.model_to_dict(entry)
+        if trace is not None:
+            message["trace"] = trace | {"onair_tx": now_ms()}
         self.mqtt.publish(
             subject,
-            json_serial(storage.model_to_dict(entry)),
+            json_serial(message),
             retain=True)
 
+    async def maintain_partitions(self) -> None:
+        await asyncio.to_thread(storage.maintain_partitions)
+
+    async def retention(self) -> None:
+        await asyncio.to_thread(Retention().run)
+
+    async def run(self) -> None:
+        scheduler = AsyncIOScheduler()
+
+        # at start and every day, so next months' partitions are always in place:
+        scheduler.add_job(self.maintain_partitions, CronTrigger.from_crontab("20 0 * * *"), misfire_grace_time=82800,
+                          next_run_time=datetime.datetime.now())
+        # every night, roll up and drop old raw history:
+        scheduler.add_job(self.retention, CronTrigger.from_crontab("40 2 * * *"), misfire_grace_time=82800)
+
+        scheduler.start()
+        await asyncio.Event().wait()
+        scheduler.shutdown()
+
     def on_connect(self, client, userdata, flags, reason_code, properties):
         logger.info(f"Connected with result code: {reason_code}, flags: {flags}, userdata: {userdata}")
-        for topic in self.MQTT_SUBSCRIPTIONS:
-            client.subscribe(topic)
-        for entity in storage.device_entities():
+        start = time.monotonic()
+        if self.status:
+            # A reconnect: the in-memory status is current, only republish it
+            source = "memory"
+            currents = {entity: list(entries.values()) for entity, entries in self.status.items()}
+        else:
+            source = "database"
+            currents = storage.last_values.warm_all(storage.device_entities())
+        for entity, entries in currents.items():
             self.status[entity] = {}
-            for entry in entity.get_currents():
-                self.process_entry(entry, False)
+            for entry in entries:
+                if entry is not None:
+                    self.process_entry(entry, False)
+        logger.info(f"Warm start from {source}: {sum(len(entries) for entries in currents.values())} entries "
+                    f"in {(time.monotonic() - start) * 1000:.0f}ms")
 
     def on_disconnect(self, *args, **kwargs):
         logger.info("MQTT disconnected!")
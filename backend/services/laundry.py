@@ -7,7 +7,7 @@ import human_readable as hr
 
 from backend.sms import SMS
 from backend.storage import Laundry, model_to_dict, device_entities
-from backend.tools import json_serial, json_deserial
+from backend.tools import json_serial
 from configuration import Topic
 
 
@@ -17,6 +17,7 @@ class LaundryOnAir(OnAirService):
 
     INPUT_TOPIC = Topic.OnAir.format("electricity", "bathroom")
     OUTPUT_TOPIC = Topic.OnAir.format(Topic.OnAir.Facet.activity, "laundry")
+    MQTT_SUBSCRIPTIONS = [INPUT_TOPIC]
 
     def __init__(self):
         super().__init__()
@@ -29,7 +30,6 @@ class LaundryOnAir(OnAirService):
 
     def on_connect(self, client, userdata, flags, reason_code, properties):
         logger.info("Laundry service connected to MQTT broker.")
-        client.subscribe(LaundryOnAir.INPUT_TOPIC)
         self.laundry = Laundry.get_last()
         if self.laundry is None:
             self.laundry = Laundry()
@@ -40,9 +40,8 @@ class LaundryOnAir(OnAirService):
         return (sum(l)/len(l)) >= 3
 
     def on_message(self, client, userdata, msg):
-        msg_dec = msg.payload.decode()
-        logger.debug("[{}]{}".format(msg.topic, msg_dec))
-        data = json_deserial(msg_dec)
+        logger.debug("[{}]{}".format(msg.topic, msg.text))
+        data = msg.data
         if msg.topic == self.INPUT_TOPIC:
             self.active_power_queue.append(data["active_power"])
 
@@ -1,6 +1,7 @@
 import asyncio
 import datetime
 import logging
+import time
 
 from backend.services.meteoproviders.icm import ICMProvider
 from backend.services.meteoproviders.imgw import IMGWProvider
@@ -10,6 +11,7 @@ from backend.services.meteoproviders.visualcrossing import VisualCrossingProvide
 from backend.services.onairservice import OnAirService, noexception
 from configuration import Topic, Configuration
 from backend.tools import json_serial
+from backend.metrics import registry
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
@@ -18,6 +20,8 @@ logger = logging.getLogger("onair.meteo")
 
 logging.getLogger('apscheduler.executors.default').setLevel(logging.WARNING)
 
+FETCH_SECONDS = registry.histogram("meteo_fetch_seconds", "Meteo provider fetch time, retries included", ("type", "provider", "result"))
+
 
 class Meteo(OnAirService):
 
@@ -30,41 +34,82 @@ class Meteo(OnAirService):
             IMGWProvider(*Configuration.location()),
             ICMProvider(*Configuration.location()),
             VisualCrossingProvider(*Configuration.location(), Configuration.MAP['visualcrossing']['api_key'])]
+        conf = Configuration.get_meteo_config()
+        self.timeout = conf.get("timeout", 20)
+        self.retries = conf.get("retries", 2)
+        self.backoff = conf.get("backoff", 2.0)
+        self.budget = conf.get("budget", 60)
+        self.diagnostics = {}
 
-    @noexception(logger=logger)
-    async def _meteo(self, type: str, get_meteo_callback):
-        first_meteo = None
-        logger.debug(f"Fetching meteo {type}")
-        for name in Configuration.meteo_providers()[type]:
-            message = None
+    async def _fetch(self, type: str, provider, get_meteo_callback) -> str | None:
+        # One provider: a timeout per attempt, retries with backoff, all within the provider's budget.
+        stats = self.diagnostics.setdefault(type, {}).setdefault(provider.name, {"latency_last": None, "error": None})
+        start = time.monotonic()
+        deadline = start + self.budget
+        error = None
+        for attempt in range(self.retries + 1):
             try:
-                logger.debug(f"Fetching meteo {type} from provider {name}")
-                provider = [p for p in self.providers if p.name == name][0]
-                weather = await get_meteo_callback(provider)
+                weather = await asyncio.wait_for(get_meteo_callback(provider), max(0.0, min(self.timeout, deadline - time.monotonic())))
                 if not weather:
                     raise Exception(f"Empty response when fetching meteo {type} from provider {provider.name}")
-                message = json_serial({
-                    'source': name,
-                    'error': None,
-                    'create_at': datetime.datetime.now(),
-                    'data': weather,
-                    })
-                if first_meteo is None:
-                    first_meteo = message
+                error = None
+                break
             except Exception as e:
-                logger.error(f"Error fetching meteo {type} from provider {provider.name}: {e}")
-                message = json_serial({
-                    "error": f"{e}",
-                    "source": provider.name,
-                    "create_at": datetime.datetime.now(),
+                error = e if not isinstance(e, asyncio.TimeoutError) else Exception(f"timeout after {time.monotonic() - start:.0f}s")
+                delay = self.backoff * 2 ** attempt
+                if attempt == self.retries or time.monotonic() + delay >= deadline:
+                    break
+                logger.debug(f"Retrying meteo {type} from provider {provider.name} in {delay}s: {error}")
+                await asyncio.sleep(delay)
+
+        latency = round(time.monotonic() - start, 3)
+        FETCH_SECONDS.labels(type, provider.name, "ok" if error is None else "error").observe(latency)
+        stats["latency_last"] = latency
+        if error is None:
+            stats["error"] = None
+            message = json_serial({
+                'source': provider.name,
+                'error': None,
+                'create_at': datetime.datetime.now(),
+                'data': weather,
                 })
-            if message:
-                logger.debug(message)
-                self.mqtt.publish(
-                    Topic.OnAir.format(Topic.OnAir.Facet.meteo, f"{type}/{provider.name}"),
-                    message, retain=True)
-        if first_meteo:
+        else:
+            stats["error"] = f"{error}"
+            logger.error(f"Error fetching meteo {type} from provider {provider.name}: {error}")
+            message = json_serial({
+                "error": f"{error}",
+                "source": provider.name,
+                "create_at": datetime.datetime.now(),
+            })
+        logger.debug(message)
+        self.mqtt.publish(
+            Topic.OnAir.format(Topic.OnAir.Facet.meteo, f"{type}/{provider.name}"),
+            message, retain=True)
+        return message if error is None else None
+
+    @noexception(logger=logger)
+    async def _meteo(self, type: str, get_meteo_callback):
+        logger.debug(f"Fetching meteo {type}")
+        providers = [p for name in Configuration.meteo_providers()[type] for p in self.providers if p.name == name]
+        messages = await asyncio.gather(*[self._fetch(type, provider, get_meteo_callback) for provider in providers])
+
+        # The first successful one in the configured priority order:
+        if first_meteo := next((message for message in messages if message is not None), None):
             self.mqtt.publish(Topic.OnAir.format(Topic.OnAir.Facet.meteo, f"{type}"), first_meteo, retain=True)
+        self.mqtt.publish(Topic.OnAir.format(Topic.OnAir.Facet.meteo, "diagnostics"), json_serial(self.stats()["providers"]), retain=True)
+
+    def stats(self) -> dict:
+        # Call counts and latencies from the fetch histogram, the last latency and error per provider kept here
+        providers = {}
+        for type, by_provider in self.diagnostics.items():
+            for name, last in by_provider.items():
+                ok, failed = FETCH_SECONDS.labels(type, name, "ok"), FETCH_SECONDS.labels(type, name, "error")
+                calls = ok.count + failed.count
+                providers.setdefault(type, {})[name] = {
+                    "calls": calls, "successes": ok.count, "failures": failed.count,
+                    "success_rate": round(ok.count / calls, 3) if calls else None,
+                    "latency_avg": round((ok.sum + failed.sum) / calls, 3) if calls else None} | last
+        return {"providers": providers}
 
     @noexception(logger=logger)
     async def current(self) -> None:
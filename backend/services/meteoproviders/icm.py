@@ -1,10 +1,12 @@
 import logging
-import aiohttp
+from backend.httpclient import http
 from backend.services.meteoproviders.provider import MeteoProvider, MeteoForecastProvider
 
 logger = logging.getLogger("onair.icm")
 
 class ICMProvider(MeteoProvider):
+    # Meteorograms are computed a few times a day:
+    CACHE_TTL = 600
 
     def __init__(self, latitude: float, longitude: float, *args, **kwargs):
         super().__init__("icm")
@@ -13,24 +15,22 @@ class ICMProvider(MeteoProvider):
         self.post = {"date":0,"point":{"lat":latitude,"lon":longitude}}
 
     async def data(self) -> dict:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.available_url) as response:
-                if response.status == 200:
-                    json_resp = await response.json()
-                    logger.debug(f"{json_resp}")
-                    self.post["date"] = json_resp["um4_60"][-1]
-                else:
-                    raise Exception(f"Error fetching available meteorograms: {response.status}")
+        response = await http.post(self.available_url, ttl=self.CACHE_TTL)
+        if response.status == 200:
+            json_resp = response.json()
+            logger.debug(f"{json_resp}")
+            self.post["date"] = json_resp["um4_60"][-1]
+        else:
+            raise Exception(f"Error fetching available meteorograms: {response.status}")
 
         logger.debug(f"Fetching meteo forecast data with post: {self.post}")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.um4_60_url, json=self.post) as response:
-                if response.status == 200:
-                    json_resp = await response.json()
-                    logger.debug(f"{await response.text()}")
-                    return json_resp
-                else:
-                    raise Exception(f"Error fetching data: {response.status}")
+        response = await http.post(self.um4_60_url, json=self.post, ttl=self.CACHE_TTL)
+        if response.status == 200:
+            json_resp = response.json()
+            logger.debug(f"{response.text}")
+            return json_resp
+        else:
+            raise Exception(f"Error fetching data: {response.status}")
 
     async def forecast(self) -> dict:
         data = await self.data()
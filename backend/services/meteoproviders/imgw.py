@@ -2,8 +2,8 @@ import json
 import logging
 import datetime
 import re
-import aiohttp
 
+from backend.httpclient import http
 from backend.services.meteoproviders.provider import MeteoProvider
 
 logger = logging.getLogger("onair.imgw")
@@ -160,39 +160,50 @@ iconmap = {
 
 
 class IMGWProvider(MeteoProvider):
+    TOKEN_URL = "https://meteo.imgw.pl/shared/web-components/serwisy-imgw/serwisy-imgw.js"
+    # current() and forecast() are both served from one fetch:
+    CACHE_TTL = 240
 
     def __init__(self, latitude: float, longitude: float, *args, **kwargs):
         super().__init__("imgw")
         self.latitude = latitude
         self.longitude = longitude
         self.recent_data = None
+        self.api_token = None
 
     def mapicon(self, value):
         if value in iconmap:
             return iconmap[value]
         return None
 
+    async def token(self) -> str:
+        # Scraped from the IMGW web components bundle, kept until the API rejects it:
+        if self.api_token is None:
+            response = await http.get(self.TOKEN_URL)
+            if response.status != 200:
+                raise Exception(f"[weather] Error fetching API token from IMGW: {response.status}")
+            match = re.search(r'apiToken:"([^"]+)"', response.text)
+            if not match:
+                raise Exception("[weather] API token not found in the IMGW page")
+            self.api_token = match.group(1)
+        return self.api_token
+
     async def data(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://meteo.imgw.pl/shared/web-components/serwisy-imgw/serwisy-imgw.js") as response:
-                text = await response.text()
-                match = re.search(r'apiToken:"([^"]+)"', text)
-                api_token = match.group(1) if match else None
-
-            if api_token:
-                async with session.get("https://meteo.imgw.pl/api/v1/forecast/fcapi"
-                                       f"?token={api_token}"
-                                       f"&lat={self.latitude}"
-                                       f"&lon={self.longitude}") as response:
-                    if response.status == 200:
-                        self.recent_data = await response.json()
-                        logger.debug(await response.text())
-                        return self.recent_data
-
-                    else:
-                        raise Exception(f"[weather] Error fetching data: {response.status}")
+        for attempt in range(2):
+            token = await self.token()
+            response = await http.get("https://meteo.imgw.pl/api/v1/forecast/fcapi"
+                                      f"?token={token}"
+                                      f"&lat={self.latitude}"
+                                      f"&lon={self.longitude}", ttl=self.CACHE_TTL)
+            if response.status == 200:
+                self.recent_data = response.json()
+                logger.debug(response.text)
+                return self.recent_data
+            elif response.status in (400, 401, 403) and attempt == 0:
+                logger.info(f"IMGW API token rejected ({response.status}), fetching a new one")
+                self.api_token = None
             else:
-                raise Exception("[weather] Error fetching API token from IMGW")
+                raise Exception(f"[weather] Error fetching data: {response.status}")
 
     async def current(self):
         cond = (await self.data())['data']['Data'][0]
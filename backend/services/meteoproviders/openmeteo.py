@@ -1,13 +1,14 @@
 import datetime
 
-import aiohttp
 import logging
 
+from backend.httpclient import http
 from backend.services.meteoproviders.provider import MeteoProvider
 
 logger = logging.getLogger("onair.openmeteo")
 
 class OpenMeteoProvider(MeteoProvider):
+    CACHE_TTL = 60
 
     def __init__(self, latitude: float, longitude: float, *args, **kwargs):
         super().__init__("openmeteo")
@@ -22,36 +23,35 @@ class OpenMeteoProvider(MeteoProvider):
                             "&timezone=Europe%2FBerlin&forecast_days=0&format=json")
 
     async def current(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.weather_url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.debug(await response.text())
-                    return {
-                        'temperature': round(float(data['current']['temperature_2m']), 1),
-                        'humidity': round(float(data['current']['relative_humidity_2m']), 1),
-                        'pressure': {
-                            'real': round(float(data['current']['surface_pressure']), 1),
-                            'sea_level': None,
-                        },
-                        'precipitation': round(float(data['current']['precipitation']), 1),
-                        'wind': {
-                            'speed': round(float(data['current']['wind_speed_10m']), 1),
-                            'direction': int(data['current']['wind_direction_10m']),
-                            'direction_desc': self.desc_direction(int(data['current']['wind_direction_10m'])),
-                            'max': {
-                                'speed': round(float(data['current']['wind_gusts_10m']), 1),
-                                'direction': None,
-                                'direction_desc': None,
-                            }
-                        },
-                        'solar_radiation': None,
-                        'date': datetime.datetime.fromisoformat(data['current']['time']).astimezone(),
-                        'create_at': datetime.datetime.now(),
-                        'source': self.name,
+        response = await http.get(self.weather_url, ttl=self.CACHE_TTL)
+        if response.status == 200:
+            data = response.json()
+            logger.debug(response.text)
+            return {
+                'temperature': round(float(data['current']['temperature_2m']), 1),
+                'humidity': round(float(data['current']['relative_humidity_2m']), 1),
+                'pressure': {
+                    'real': round(float(data['current']['surface_pressure']), 1),
+                    'sea_level': None,
+                },
+                'precipitation': round(float(data['current']['precipitation']), 1),
+                'wind': {
+                    'speed': round(float(data['current']['wind_speed_10m']), 1),
+                    'direction': int(data['current']['wind_direction_10m']),
+                    'direction_desc': self.desc_direction(int(data['current']['wind_direction_10m'])),
+                    'max': {
+                        'speed': round(float(data['current']['wind_gusts_10m']), 1),
+                        'direction': None,
+                        'direction_desc': None,
                     }
-                else:
-                    raise Exception(f"[weather] Error fetching data: {response.status}")
+                },
+                'solar_radiation': None,
+                'date': datetime.datetime.fromisoformat(data['current']['time']).astimezone(),
+                'create_at': datetime.datetime.now(),
+                'source': self.name,
+            }
+        else:
+            raise Exception(f"[weather] Error fetching data: {response.status}")
 
 
 if __name__ == "__main__":
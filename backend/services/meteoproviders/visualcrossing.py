@@ -1,12 +1,13 @@
 import datetime
-import aiohttp
 import logging
 
+from backend.httpclient import http
 from backend.services.meteoproviders.provider import MeteoProvider
 
 logger = logging.getLogger("onair.visualcrossing")
 
 class VisualCrossingProvider(MeteoProvider):
+    CACHE_TTL = 60
 
     def __init__(self, latitude: float, longitude: float, apikey: str, *args, **kwargs):
         super().__init__("visualcrossing")
@@ -19,40 +20,39 @@ class VisualCrossingProvider(MeteoProvider):
             "&contentType=json")
 
     async def current(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.weather_url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.debug(await response.text())
-                    cond = data['currentConditions']
+        response = await http.get(self.weather_url, ttl=self.CACHE_TTL)
+        if response.status == 200:
+            data = response.json()
+            logger.debug(response.text)
+            cond = data['currentConditions']
 
-                    return {
-                        'temperature': round(float(cond['temp']), 1),
-                        'humidity': round(float(cond['humidity']), 1),
-                        'pressure': {
-                            'real': round(float(cond['pressure']), 1),
-                            'sea_level': None,
-                        },
-                        'precipitation': round(float(cond['precip'] if cond['precip'] else 0), 1),
-                        'wind': {
-                            'speed': self.kmh_to_ms(cond['windspeed']),
-                            'direction': int(cond['winddir']),
-                            'direction_desc': self.desc_direction(int(cond['winddir'])),
-                            'max': {
-                                'speed': round(float(cond['windgust']), 1) if cond['windgust'] else None,
-                                'direction': None,
-                                'direction_desc': None,
-                            }
-                        },
-                        'solar_radiation': int(cond['solarradiation']),
-                        'date': datetime.datetime.fromisoformat(
-                            data['days'][0]['datetime'] + " " + cond['datetime']
-                        ).astimezone(),
-                        'create_at': datetime.datetime.now(),
-                        'source': self.name,
+            return {
+                'temperature': round(float(cond['temp']), 1),
+                'humidity': round(float(cond['humidity']), 1),
+                'pressure': {
+                    'real': round(float(cond['pressure']), 1),
+                    'sea_level': None,
+                },
+                'precipitation': round(float(cond['precip'] if cond['precip'] else 0), 1),
+                'wind': {
+                    'speed': self.kmh_to_ms(cond['windspeed']),
+                    'direction': int(cond['winddir']),
+                    'direction_desc': self.desc_direction(int(cond['winddir'])),
+                    'max': {
+                        'speed': round(float(cond['windgust']), 1) if cond['windgust'] else None,
+                        'direction': None,
+                        'direction_desc': None,
                     }
-                else:
-                    raise Exception(f"[weather] Error fetching data: {response.status}")
+                },
+                'solar_radiation': int(cond['solarradiation']),
+                'date': datetime.datetime.fromisoformat(
+                    data['days'][0]['datetime'] + " " + cond['datetime']
+                ).astimezone(),
+                'create_at': datetime.datetime.now(),
+                'source': self.name,
+            }
+        else:
+            raise Exception(f"[weather] Error fetching data: {response.status}")
 
 
 if __name__ == "__main__":
@@ -2,9 +2,10 @@ import asyncio
 import functools
 import logging
 import inspect
+import time
 from typing import Optional, Callable
 
-from backend.tools import MQTTClient
+from backend.tools import MQTTClient, json_deserial
 
 def noexception(_fn: Optional[Callable] = None, *, logger: Optional[logging.Logger] = None):
     """Decorator usable as @noexception or @noexception(logger=...)."""
@@ -36,7 +37,32 @@ def noexception(_fn: Optional[Callable] = None, *, logger: Optional[logging.Logg
     return decorator
 
 
+class OnAirMessage:
+    """
+    MQTT message as delivered to services: decoded once by OnAir and shared by
+    all services subscribed to its topic, so 'data' must not be modified in place.
+    """
+
+    def __init__(self, msg):
+        self.topic: str = msg.topic
+        self.payload: bytes = msg.payload
+        self.qos = msg.qos
+        self.retain = msg.retain
+        self.text: str = msg.payload.decode()
+        self.parts: tuple = tuple(msg.topic.split("/"))
+        # Wall clock, epoch seconds, before any dispatch queueing:
+        self.received_at: float = time.time()
+
+    @functools.cached_property
+    def data(self):
+        return json_deserial(self.text)
+
+
 class OnAirService:
+    # Topic filters (with + and # wildcards) of messages delivered to on_message;
+    # OnAir subscribes them on connect.
+    MQTT_SUBSCRIPTIONS: list = []
+
     def __init__(self):
         self.exit = False
         self.mqtt: MQTTClient = None
@@ -44,7 +70,7 @@ class OnAirService:
     def on_connect(self, client, userdata, flags, reason_code, properties):
         pass
 
-    def on_message(self, client, userdata, msg):
+    def on_message(self, client, userdata, msg: OnAirMessage):
         pass
 
     def on_disconnect(self, *args, **kwargs):
@@ -56,6 +82,10 @@ class OnAirService:
     def on_stop(self):
         pass
 
+    def stats(self) -> dict:
+        # Service specific health/metrics, reported by OnAir
+        return {}
+
     async def run(self) -> None:
         while not self.exit:
             await asyncio.sleep(1)
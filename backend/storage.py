@@ -1,21 +1,139 @@
 import datetime
+import decimal
+import json
+import logging
+import threading
+import time
 from enum import Enum
 from typing import Any, Type, Self
 
 from io import BytesIO
 
 import peewee
-from peewee import Model, CharField, DateTimeField, DecimalField, BooleanField, IntegerField, TextField, ForeignKeyField, BlobField
+from peewee import Model, CharField, DateTimeField, BooleanField, IntegerField, TextField, ForeignKeyField, BlobField, DoubleField
 
 # Do not remove - it is used by other service as:
 # from storage import model_to_dict
 from playhouse.shortcuts import model_to_dict
+from playhouse.pool import PooledPostgresqlDatabase, MaxConnectionsExceeded
 
+from backend.metrics import registry
 from configuration import Configuration
 
+logger = logging.getLogger("storage")
+
+LAST_VALUES = registry.counter("storage_last_values_total", "Last value cache lookups, by result", ("result",))
+POOL_CONNECTIONS = registry.counter("storage_pool_connections_total", "Pooled database connections, by event", ("event",))
+POOL_WAIT_SECONDS = registry.histogram("storage_pool_wait_seconds", "Time waited for a free pooled connection")
+POOL_WAIT_MAX = registry.gauge("storage_pool_wait_max_seconds", "Longest wait for a free pooled connection")
+
+POOL_EVENTS = ("checkouts", "opened", "closed", "unhealthy")
+
+
+class PooledDatabase(PooledPostgresqlDatabase):
+    """
+    Connection pool shared by everything in the process. Connections stay per
+    thread (peewee keeps the connection state thread local); close() and the
+    end of 'with database:' hand them back to the pool instead of closing them.
+    Idle connections are checked with 'select 1' before reuse when they have
+    been idle longer than health_check seconds.
+    """
+
+    def __init__(self, *args, health_check: float = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check = health_check
+        self.lock = threading.Lock()
+        self.returned = {}
+        self.waiting = threading.local()
+
+    def connect(self, reuse_if_open=False):
+        # peewee retries _connect every 0.1s while the pool is full: one wait per connect
+        start = time.monotonic()
+        self.waiting.value = False
+        try:
+            return super().connect(reuse_if_open)
+        finally:
+            if self.waiting.value:
+                waited = time.monotonic() - start
+                POOL_WAIT_SECONDS.observe(waited)
+                POOL_WAIT_MAX.set_max(waited)
+                logger.debug(f"Waited {waited * 1000:.0f}ms for a pooled connection")
+
+    def _connect(self):
+        try:
+            conn = super()._connect()
+        except MaxConnectionsExceeded:
+            self.waiting.value = True
+            raise
+        key = self.conn_key(conn)
+        POOL_CONNECTIONS.labels("checkouts").inc()
+        with self.lock:
+            reused = self.returned.pop(key, None) is not None
+        if not reused:
+            POOL_CONNECTIONS.labels("opened").inc()
+        return conn
+
+    def _close(self, conn, close_conn=False):
+        key = self.conn_key(conn)
+        super()._close(conn, close_conn)
+        with self.lock:
+            if close_conn:
+                self.returned.pop(key, None)
+            else:
+                self.returned[key] = time.monotonic()
+        if close_conn:
+            POOL_CONNECTIONS.labels("closed").inc()
+
+    def _is_closed(self, conn):
+        if super()._is_closed(conn):
+            return True
+        idle_since = self.returned.get(self.conn_key(conn))
+        if self.health_check is not None and idle_since is not None and time.monotonic() - idle_since > self.health_check:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("select 1")
+            except Exception as e:
+                logger.warning(f"Pooled connection failed health check: {e}")
+                # peewee only drops it from the pool, closed here so that its socket is released:
+                with self.lock:
+                    self.returned.pop(self.conn_key(conn), None)
+                POOL_CONNECTIONS.labels("unhealthy").inc()
+                POOL_CONNECTIONS.labels("closed").inc()
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                return True
+        return False
+
+    def stats(self) -> dict:
+        waits = POOL_WAIT_SECONDS.labels()
+        return ({event: int(POOL_CONNECTIONS.get(event)) for event in POOL_EVENTS}
+                | {"waits": waits.count, "wait_time": round(waits.sum, 3), "wait_max": round(POOL_WAIT_MAX.get(), 3),
+                   "in_use": len(self._in_use), "idle": len(self._connections), "max_connections": self._max_connections})
+
+
 db = Configuration.get_database_config()
-database = peewee.PostgresqlDatabase(db["db"], user=db["username"], password=db["password"], host=db["host"], port=db["port"],
-                                     autorollback=True)
+pool = db.get("pool", {})
+database = PooledDatabase(db["db"], user=db["username"], password=db["password"], host=db["host"], port=db["port"],
+                          autorollback=True,
+                          max_connections=pool.get("max_connections", 8),
+                          stale_timeout=pool.get("stale_timeout", 300),
+                          timeout=pool.get("timeout", 10),
+                          health_check=pool.get("health_check", 60))
+
+
+class DecimalAccessor(peewee.FieldAccessor):
+    # JSON payloads are decoded with plain floats; they become Decimals once assigned
+    # to a model, so that comparing with stored values (see equals) holds.
+    def __set__(self, instance, value):
+        if isinstance(value, float):
+            value = decimal.Decimal(repr(value))
+        super().__set__(instance, value)
+
+
+class DecimalField(peewee.DecimalField):
+    accessor_class = DecimalAccessor
 
 
 def on_start():
@@ -30,6 +148,106 @@ def on_start():
                 pass
 
 
+def _next_month(day: datetime.date) -> datetime.date:
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def _is_partitioned(table: str) -> bool:
+    return database.execute_sql(
+        "select 1 from pg_partitioned_table p join pg_class c on c.oid = p.partrelid where c.relname = %s",
+        (table,)).fetchone() is not None
+
+
+def _create_partition(table: str, month: datetime.date):
+    partition = f"{table}_y{month:%Y}m{month:%m}"
+    if database.table_exists(partition):
+        return
+    start, end = month.isoformat(), _next_month(month).isoformat()
+    create = f"""
+        create table "{partition}" partition of "{table}"
+        for values from ('{start}') to ('{end}')"""
+    default = f"{table}_default"
+    within = "where create_at >= %s and create_at < %s"
+    rows = database.execute_sql(f'select count(*) from "{default}" {within}', (start, end)).fetchone()[0] \
+        if database.table_exists(default) else 0
+    if not rows:
+        database.execute_sql(create)
+        return
+    # Rows of the month already in the default partition forbid creating it: moved into the new one
+    logger.warning(f"Moving {rows} rows of {table} from the default partition to the new {partition}")
+    database.execute_sql(f'alter table "{table}" detach partition "{default}"')
+    database.execute_sql(create)
+    database.execute_sql(f'insert into "{table}" select * from "{default}" {within}', (start, end))
+    database.execute_sql(f'delete from "{default}" {within}', (start, end))
+    database.execute_sql(f'alter table "{table}" attach partition "{default}" default')
+
+
+def _partition_table(model) -> None:
+    # Re-creates the (unpartitioned) history table as partitioned by month on create_at.
+    # Primary key of a partitioned table must contain the partition key, hence (id, create_at).
+    table = model._meta.table_name
+    legacy = f"{table}_legacy"
+    logger.info(f"Converting table {table} to monthly partitions...")
+    with database.atomic():
+        sequence = database.execute_sql("select pg_get_serial_sequence(%s, 'id')", (table,)).fetchone()[0]
+        database.execute_sql(f'alter table "{table}" rename to "{legacy}"')
+        database.execute_sql(f'alter table "{legacy}" rename constraint "{table}_pkey" to "{legacy}_pkey"')
+        database.execute_sql(f'alter sequence {sequence} owned by none')
+        database.execute_sql(f"""
+            create table "{table}" (like "{legacy}" including defaults, primary key (id, create_at))
+            partition by range (create_at)""")
+        database.execute_sql(f"""
+            alter table "{table}" add foreign key ({model.name.column_name})
+            references "{Name._meta.table_name}" ({Name.value.column_name}) on update cascade""")
+        database.execute_sql(f'create table "{table}_default" partition of "{table}" default')
+
+        first, last = database.execute_sql(f'select min(create_at), max(create_at) from "{legacy}"').fetchone()
+        if first is not None:
+            month = first.date().replace(day=1)
+            while month <= last.date():
+                _create_partition(table, month)
+                month = _next_month(month)
+        database.execute_sql(f'insert into "{table}" select * from "{legacy}"')
+        database.execute_sql(f'drop table "{legacy}"')
+        database.execute_sql(f'alter sequence {sequence} owned by "{table}".id')
+    logger.info(f"Converting table {table} to monthly partitions DONE")
+
+
+def maintain_partitions(convert: bool = False):
+    """
+    Keeps history tables partitioned by month on create_at, with partitions created
+    'months_ahead' in advance, and indexed by (name_id, create_at desc).
+    Partitioning is enabled with database.partitioning.enabled in homectrl-map.json;
+    unpartitioned tables are converted (all rows copied) only when 'convert' is set,
+    by the one-off 'homectrl db partition', and are left alone otherwise.
+    """
+    conf = db.get("partitioning", {})
+    today = datetime.date.today().replace(day=1)
+    # One transaction per table: a failing table does not abort (or roll back the conversion of) the others
+    with database.connection_context():
+        for model in device_entities():
+            table = model._meta.table_name
+            try:
+                with database.atomic():
+                    partitioned = conf.get("enabled", False) and _is_partitioned(table)
+                    if conf.get("enabled", False) and not partitioned:
+                        if convert:
+                            _partition_table(model)
+                            partitioned = True
+                        else:
+                            logger.warning(f"Table {table} is not partitioned yet, run: homectrl db partition")
+                    if partitioned:
+                        month = today
+                        for _ in range(conf.get("months_ahead", 2) + 1):
+                            _create_partition(table, month)
+                            month = _next_month(month)
+                    database.execute_sql(f"""
+                        create index if not exists "{table}_name_id_create_at"
+                        on "{table}" ({model.name.column_name}, create_at desc)""")
+            except Exception as e:
+                logger.error(f"Partition maintenance of table {table} failed: {e}")
+
+
 class EnumField(CharField):
 
     def __init__(self, enum: type[Enum], *args, **kwargs) -> None:
@@ -121,9 +339,11 @@ class HomeCtrlBaseModel(BaseModel):
     create_at = DateTimeField()
 
     def save_new_value(self) -> Self:
-        previous = self.get_last(self.name.value)
+        previous = last_values.get(type(self), self.name_id)
         if not self.equals(previous):
-            return self.save(force_insert=True)
+            result = self.save(force_insert=True)
+            last_values.put(self)
+            return result
         return None
 
     @classmethod
@@ -133,6 +353,40 @@ class HomeCtrlBaseModel(BaseModel):
         else:
             return cls.select().where(cls.name == name).order_by(cls.create_at.desc()).limit(1).get_or_none()
 
+    @classmethod
+    def get_currents(cls):
+        # One index lookup on (name_id, create_at desc) per name, instead of a window over the whole table:
+        with database:
+            return list(cls.raw(f"""
+                select t.* from "{Name._meta.table_name}" n
+                cross join lateral (
+                    select * from "{cls._meta.table_name}"
+                    where {cls.name.column_name} = n.{Name.value.column_name}
+                    order by create_at desc limit 1) t"""))
+
+    @classmethod
+    def _currents_sql(cls) -> str:
+        return f"""
+                select '{cls.__name__}', row_to_json(t)::text from "{Name._meta.table_name}" n
+                cross join lateral (
+                    select * from "{cls._meta.table_name}"
+                    where {cls.name.column_name} = n.{Name.value.column_name}
+                    order by create_at desc limit 1) t"""
+
+    @classmethod
+    def from_json_row(cls, text: str) -> Self:
+        # A row as given by row_to_json(): timestamps in ISO format, numerics kept exact
+        row = json.loads(text, parse_float=decimal.Decimal)
+        data = {}
+        for field in cls._meta.sorted_fields:
+            value = row.get(field.column_name)
+            if value is not None and isinstance(field, DateTimeField):
+                value = datetime.datetime.fromisoformat(value)
+            data[field.name] = field.python_value(value)
+        instance = cls(__no_default__=1, **data)
+        instance._dirty.clear()
+        return instance
+
     @classmethod
     def get_lasts(cls, name: str, from_date: datetime.datetime = None, to_date: datetime.datetime = None):
         return (cls.select()
@@ -142,17 +396,6 @@ class HomeCtrlBaseModel(BaseModel):
 
 class HomeCtrlValueBaseModel(HomeCtrlBaseModel):
 
-    @classmethod
-    def get_currents(cls):
-        with database:
-            subq = (
-                cls.select(peewee.fn.row_number().over(partition_by=cls.name_id, order_by=[cls.create_at.desc()]).alias("row_num"), cls))
-            query = (peewee.Select(columns=[subq.c.id, subq.c.create_at, subq.c.name_id, subq.c.value])
-                     .from_(subq)
-                     .where(subq.c.row_num == 1)
-                     .bind(database))
-            return list(map(lambda r: cls(**r), query))
-
     def equals(self, other: Self) -> bool:
         return other and type(other) is type(self) and self.value == other.value
 
@@ -212,18 +455,6 @@ class Battery(HomeCtrlBaseModel):
                 and self.value == other.value
                 and self.name.value == other.name.value)
 
-    @classmethod
-    def get_currents(cls):
-        with database:
-            subq = (
-                cls.select(peewee.fn.row_number().over(partition_by=cls.name_id, order_by=[cls.create_at.desc()]).alias("row_num"), cls))
-            query = (peewee.Select(columns=[subq.c.id, subq.c.create_at, subq.c.name_id,
-                                            subq.c.value, subq.c.voltage])
-                     .from_(subq)
-                     .where(subq.c.row_num == 1)
-                     .bind(database))
-            return list(map(lambda r: cls(**r), query))
-
 
 class Radio(HomeCtrlBaseModel):
     station_name = TextField()
@@ -238,19 +469,6 @@ class Radio(HomeCtrlBaseModel):
                 and other.volume == self.volume and other.muted == self.muted
                 and other.playinfo == self.playinfo)
 
-    @classmethod
-    def get_currents(cls):
-        with database:
-            subq = (
-                cls.select(peewee.fn.row_number().over(partition_by=cls.name_id, order_by=[cls.create_at.desc()]).alias("row_num"), cls))
-            query = (peewee.Select(columns=[subq.c.id, subq.c.create_at, subq.c.name_id,
-                                            subq.c.station_name, subq.c.station_code, subq.c.volume,
-                                            subq.c.muted, subq.c.playinfo])
-                     .from_(subq)
-                     .where(subq.c.row_num == 1)
-                     .bind(database))
-            return list(map(lambda r: cls(**r), query))
-
 
 class Radar(HomeCtrlBaseModel):
     presence = BooleanField()
@@ -263,27 +481,15 @@ class Radar(HomeCtrlBaseModel):
     static_distance = IntegerField()
     static_energy = IntegerField()
 
-    # Equals by id:
+    # Equals by id (not saved entries are never equal):
     def equals(self, other: Self) -> bool:
         return (other and type(other) is type(self)
-                and self.id == other.id)
+                and self.id is not None and self.id == other.id)
 
     # def equals(self, other: Self) -> bool:
     #     return (other and type(other) is type(self)
     #             and other.presence == self.presence and other.target_state == self.target_state and other.distance == self.distance)
 
-    @classmethod
-    def get_currents(cls):
-        with database:
-            subq = (
-                cls.select(peewee.fn.row_number().over(partition_by=cls.name_id, order_by=[cls.create_at.desc()]).alias("row_num"), cls))
-            query = (peewee.Select(columns=[subq.c.id, subq.c.create_at, subq.c.name_id,
-                                            subq.c.presence, subq.c.target_state, subq.c.distance])
-                     .from_(subq)
-                     .where(subq.c.row_num == 1)
-                     .bind(database))
-            return list(map(lambda r: cls(**r), query))
-
 
 class Electricity(HomeCtrlBaseModel):
     voltage = DecimalField(decimal_places=2)
@@ -297,18 +503,40 @@ class Electricity(HomeCtrlBaseModel):
                 and other.voltage == self.voltage and other.current == self.current and other.active_power == self.active_power
                 and other.active_energy == self.active_energy and other.power_factor == self.power_factor)
 
-    @classmethod
-    def get_currents(cls):
-        with database:
-            subq = (
-                cls.select(peewee.fn.row_number().over(partition_by=cls.name_id, order_by=[cls.create_at.desc()]).alias("row_num"), cls))
-            query = (peewee.Select(columns=[subq.c.id, subq.c.create_at, subq.c.name_id,
-                                            subq.c.voltage, subq.c.current, subq.c.active_power,
-                                            subq.c.active_energy, subq.c.power_factor])
-                     .from_(subq)
-                     .where(subq.c.row_num == 1)
-                     .bind(database))
-            return list(map(lambda r: cls(**r), query))
+
+class RollupBaseModel(BaseModel):
+    # Aggregates of one field of a device model (Radar.distance, Electricity.active_power, ...) per time bucket.
+    # For BooleanField models 'avg' is the time-weighted share of the bucket the value was true,
+    # and 'on_time' is that time in seconds.
+    model = TextField()
+    name = ForeignKeyField(Name, on_update='CASCADE')
+    field = TextField()
+    bucket_at = DateTimeField()
+    samples = IntegerField()
+    min = DoubleField(null=True)
+    max = DoubleField(null=True)
+    avg = DoubleField(null=True)
+    last = DoubleField(null=True)
+    on_time = DoubleField(null=True)
+
+    class Meta:
+        indexes = (
+            (('model', 'name', 'field', 'bucket_at'), True),
+        )
+
+
+class RollupMinute(RollupBaseModel):
+    pass
+
+
+class RollupHour(RollupBaseModel):
+    pass
+
+
+class RetentionMark(BaseModel):
+    # Raw rows of the model older than rolled_until are already aggregated into the rollup tables
+    model = TextField(primary_key=True)
+    rolled_until = DateTimeField()
 
 
 class ChartPeriod(Enum):
@@ -316,6 +544,13 @@ class ChartPeriod(Enum):
     days7 = 'days7'
     month1 = 'month1'
 
+    def refresh(self) -> datetime.timedelta:
+        # Minimal interval between regenerations of the period's charts
+        return {
+            ChartPeriod.hours24: datetime.timedelta(minutes=1),
+            ChartPeriod.days7: datetime.timedelta(minutes=15),
+        }.get(self, datetime.timedelta(hours=1))
+
 class ChartStatus(Enum):
     pending = 'pending'
     ready = 'ready'
@@ -338,6 +573,16 @@ class Chart(BaseModel):
                 .where(Chart.model == model, Chart.period == period, Chart.name == name)
                 .get_or_none())
 
+    @classmethod
+    def get_create_at(cls, model: Any, period: ChartPeriod, name: str):
+        # Without the image itself
+        if not isinstance(model, str):
+            model = model.__name__
+        return (Chart
+                .select(Chart.id, Chart.create_at)
+                .where(Chart.model == model, Chart.period == period, Chart.name == name)
+                .get_or_none())
+
     def getvalue(self):
         result = BytesIO()
         result.write(self.data)
@@ -382,6 +627,186 @@ class Chart(BaseModel):
 #         raise StorageError(f"Following error:\"{error}\" occurred while saving data: {data}")
 
 
+def get_all_currents(models: list[Type[HomeCtrlBaseModel]]) -> dict:
+    """
+    get_currents() of all the given models in one round trip: the per model
+    queries are joined with 'union all', each row returned as JSON.
+    """
+    result = {model: [] for model in models}
+    if not models:
+        return result
+    by_name = {model.__name__: model for model in models}
+    with database:
+        cursor = database.execute_sql(" union all ".join(model._currents_sql() for model in models))
+        for model_name, row in cursor.fetchall():
+            model = by_name[model_name]
+            result[model].append(model.from_json_row(row))
+    return result
+
+
+class LastValueCache:
+    """
+    The most recent stored entry per (model, name).
+
+    Warmed from the model's get_currents() on first use, so the common
+    "value unchanged" check in save_new_value() costs no database round trip.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.warmed = set()
+        self.lock = threading.RLock()
+
+    def warm(self, model: Type[HomeCtrlBaseModel]) -> list:
+        entries = model.get_currents() if hasattr(model, "get_currents") else []
+        with self.lock:
+            for entry in entries:
+                self.values[(model, entry.name_id)] = entry
+            self.warmed.add(model)
+        return entries
+
+    def warm_all(self, models: list[Type[HomeCtrlBaseModel]]) -> dict:
+        currents = get_all_currents(models)
+        with self.lock:
+            for model, entries in currents.items():
+                for entry in entries:
+                    self.values[(model, entry.name_id)] = entry
+                self.warmed.add(model)
+        return currents
+
+    def get(self, model: Type[HomeCtrlBaseModel], name: str):
+        with self.lock:
+            if model not in self.warmed:
+                self.warm(model)
+            if (model, name) in self.values:
+                LAST_VALUES.labels("hit").inc()
+                return self.values[(model, name)]
+        LAST_VALUES.labels("miss").inc()
+        entry = model.get_last(name)
+        with self.lock:
+            self.values[(model, name)] = entry
+        return entry
+
+    def put(self, entry: HomeCtrlBaseModel):
+        with self.lock:
+            self.values[(type(entry), entry.name_id)] = entry
+
+    def invalidate(self, model: Type[HomeCtrlBaseModel] = None, name: str = None):
+        with self.lock:
+            if model is None:
+                self.values.clear()
+                self.warmed.clear()
+            elif name is None:
+                self.values = {k: v for k, v in self.values.items() if k[0] is not model}
+                self.warmed.discard(model)
+            else:
+                self.values.pop((model, name), None)
+
+    def stats(self) -> dict:
+        return {"hits": int(LAST_VALUES.get("hit")), "misses": int(LAST_VALUES.get("miss")), "size": len(self.values)}
+
+
+last_values = LastValueCache()
+
+
+def get_history(model: Type[HomeCtrlBaseModel], name: str, field: str = "value",
+                from_date: datetime.datetime = None, to_date: datetime.datetime = None) -> list[dict]:
+    """
+    History of a model's field as [{'create_at': ..., <field>: ...}], ascending.
+
+    For models under retention, the part of the period whose raw rows are already dropped is read
+    from the coarsest rollup table still holding it (minute, then hour): 'avg' for numeric fields,
+    'max' (any 'true' in the bucket) for boolean ones. The rest is read from the raw table.
+    """
+    to_date = to_date or datetime.datetime.now()
+    column = getattr(model, field)
+    result = []
+    raw_from = from_date
+    conf = Configuration.get_retention_config().get("models", {}).get(model.__name__)
+    mark = RetentionMark.get_or_none(RetentionMark.model == model.__name__) if conf else None
+    if mark and (from_date is None or from_date < mark.rolled_until):
+        minute_from = datetime.datetime.now() - datetime.timedelta(days=conf.get("minute_days", 90))
+        rollup = RollupMinute if from_date is not None and from_date >= minute_from else RollupHour
+        value = rollup.max if isinstance(column, BooleanField) else rollup.avg
+        query = (rollup.select(rollup.bucket_at.alias("create_at"), value.alias(field))
+                 .where(rollup.model == model.__name__, rollup.name == name, rollup.field == field,
+                        from_date is None or rollup.bucket_at >= from_date,
+                        rollup.bucket_at < min(mark.rolled_until, to_date))
+                 .order_by(rollup.bucket_at.asc()))
+        result = list(query.dicts())
+        raw_from = mark.rolled_until
+    if raw_from is None or raw_from <= to_date:
+        query = (model.select(model.create_at, column)
+                 .where(model.name == name, raw_from is None or model.create_at >= raw_from, model.create_at <= to_date)
+                 .order_by(model.create_at.asc()))
+        result += list(query.dicts())
+    return result
+
+
+def get_series(model: Type[HomeCtrlBaseModel], name: str, start: datetime.datetime, end: datetime.datetime,
+               bucket: datetime.timedelta, field: str = "value") -> dict:
+    """
+    History of a model's field bucketed by PostgreSQL, as column arrays: {'create_at': [...], <field>: [...]}.
+
+    Numeric fields give the average of each bucket having data. Boolean fields give 1 when the value was
+    true anywhere in the bucket, and are forward-filled, so every bucket of [start, end) is present.
+    Periods already rolled up by retention are read from the rollup tables (see get_history).
+    """
+    column = getattr(model, field)
+    boolean = isinstance(column, BooleanField)
+    rolled_until = datetime.datetime.min
+    rollup = RollupHour
+    conf = Configuration.get_retention_config().get("models", {}).get(model.__name__)
+    if conf and (mark := RetentionMark.get_or_none(RetentionMark.model == model.__name__)):
+        rolled_until = mark.rolled_until
+        if start >= datetime.datetime.now() - datetime.timedelta(days=conf.get("minute_days", 90)):
+            rollup = RollupMinute
+
+    params = {"model": model.__name__, "name": name, "field": field, "start": start, "end": end,
+              "bucket": bucket, "origin": datetime.datetime(2000, 1, 1), "rolled_until": rolled_until}
+    value = f"{column.column_name}::int" if boolean else f"{column.column_name}::float8"
+    rows = f"""
+        select bucket_at as at, {"max" if boolean else "avg"} as value, samples as weight, last
+        from {rollup._meta.table_name}
+        where model = %(model)s and name_id = %(name)s and field = %(field)s and bucket_at < %(rolled_until)s
+        union all
+        select create_at, {value}, 1, {value}
+        from "{model._meta.table_name}"
+        where {model.name.column_name} = %(name)s and create_at >= %(rolled_until)s"""
+
+    if boolean:
+        sql = f"""
+            with rows as ({rows}
+            ), initial as (
+                select last from rows where at < %(start)s order by at desc limit 1
+            ), agg as (
+                select date_bin(%(bucket)s, at, %(origin)s) as bucket, max(value) as value,
+                       (array_agg(last order by at desc))[1] as last
+                from rows where at >= %(start)s and at < %(end)s
+                group by 1
+            ), joined as (
+                select b.bucket, agg.value, agg.last, count(agg.last) over (order by b.bucket) as grp
+                from generate_series(date_bin(%(bucket)s, %(start)s, %(origin)s), %(end)s, %(bucket)s) as b(bucket)
+                left join agg on agg.bucket = b.bucket
+                where b.bucket < %(end)s
+            )
+            select bucket, coalesce(value, first_value(last) over (partition by grp order by bucket), (select last from initial))
+            from joined order by bucket"""
+    else:
+        sql = f"""
+            with rows as ({rows}
+            )
+            select date_bin(%(bucket)s, at, %(origin)s) as bucket, sum(value * weight) / nullif(sum(weight), 0)
+            from rows where at >= %(start)s and at < %(end)s
+            group by 1 order by 1"""
+
+    result = {"create_at": [], field: []}
+    for at, value in database.execute_sql(sql, params):
+        result["create_at"].append(at)
+        result[field].append(value)
+    return result
+
+
 def subclasses(cls):
     result = []
     for subclass in cls.__subclasses__():
@@ -0,0 +1,177 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from backend.tools import MQTTClient, json_serial
+from configuration import Configuration, Topic
+
+logger = logging.getLogger("onair.supervisor")
+
+
+def run_worker(name: str, services: list, exclude: list, reports, metrics_port: int = None) -> None:
+    # Entry point of a worker process (spawned, so it opens its own MQTT and database connections):
+    logging.basicConfig(level=logging.INFO)
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f"[%(asctime)s][%(levelname)s][%(name)s][{name}] %(message)s"))
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    from backend.onair import OnAir
+    onair = OnAir(services=services, exclude=exclude, reporter=lambda stats: reports.put((name, os.getpid(), stats)),
+                  metrics_port=metrics_port, name=f"onair-{name}")
+    try:
+        onair.start()
+    except KeyboardInterrupt:
+        onair.stop()
+
+
+class Worker:
+
+    def __init__(self, name: str, services: list, metrics_port: int = None):
+        self.name = name
+        self.services = services
+        self.metrics_port = metrics_port
+        self.process = None
+        self.started_at = None
+        self.restart_at = 0.0
+        self.restarts = 0
+        self.backoff = 0.0
+        self.reported_at = None
+        self.stats = {}
+
+    def status(self, now: float, stale_after: float) -> dict:
+        alive = self.process is not None and self.process.is_alive()
+        return {
+            "pid": self.process.pid if alive else None,
+            "services": self.services,
+            "healthy": alive and self.reported_at is not None and now - self.reported_at < stale_after,
+            "uptime": round(now - self.started_at) if alive else 0,
+            "restarts": self.restarts,
+            "exitcode": None if alive or self.process is None else self.process.exitcode,
+            "stats": self.stats,
+        }
+
+
+class Supervisor:
+    """
+    Runs OnAir services in separate worker processes, one per group configured in
+    'onair.supervisor.processes' (service class names, "*" for all the others).
+    Crashed workers are restarted with exponential backoff; worker health and
+    service stats are published, aggregated, on one retained topic.
+    """
+
+    def __init__(self):
+        conf = Configuration.get_onair_config().get("supervisor", {})
+        self.status_interval = conf.get("status_interval", 30)
+        self.backoff_min = conf.get("backoff_min", 1.0)
+        self.backoff_max = conf.get("backoff_max", 60.0)
+        # A worker that ran this long before it died is restarted without delay:
+        self.stable_after = conf.get("stable_after", 300)
+        self.topic = Topic.OnAir.format(Topic.OnAir.Facet.supervisor, "onair")
+
+        groups = conf.get("processes", {"all": ["*"]})
+        named = [service for services in groups.values() for service in services if service != "*"]
+        # Each worker serves its own metrics, on the ports following metrics.onair_port:
+        port = Configuration.get_metrics_config().get("onair_port")
+        self.workers = [Worker(name, services, port + 1 + index if port else None)
+                        for index, (name, services) in enumerate(groups.items())]
+        self.exclude = {worker.name: named if "*" in worker.services else [] for worker in self.workers}
+
+        self.context = multiprocessing.get_context("spawn")
+        self.reports = self.context.Queue()
+        self.exit = False
+        self.mqtt = None
+
+    def spawn(self, worker: Worker):
+        services = None if "*" in worker.services else worker.services
+        worker.process = self.context.Process(target=run_worker, name=f"onair-{worker.name}", daemon=False,
+                                              args=(worker.name, services, self.exclude[worker.name], self.reports, worker.metrics_port))
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.reported_at = None
+        logger.info(f"Worker {worker.name} started, pid: {worker.process.pid}, services: {worker.services}")
+
+    def supervise(self, worker: Worker, now: float):
+        if worker.process.is_alive():
+            return
+        if worker.restart_at == 0.0:
+            if now - worker.started_at >= self.stable_after:
+                worker.backoff = 0.0
+            else:
+                worker.backoff = min(self.backoff_max, max(self.backoff_min, worker.backoff * 2))
+            worker.restart_at = now + worker.backoff
+            logger.error(f"Worker {worker.name} died, exit code: {worker.process.exitcode}, restart in {worker.backoff:.0f}s")
+        elif now >= worker.restart_at:
+            worker.restart_at = 0.0
+            worker.restarts += 1
+            self.spawn(worker)
+
+    def collect(self):
+        while True:
+            try:
+                name, pid, stats = self.reports.get_nowait()
+            except queue.Empty:
+                return
+            for worker in self.workers:
+                if worker.name == name and worker.process is not None and worker.process.pid == pid:
+                    worker.stats = stats
+                    worker.reported_at = time.monotonic()
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        workers = {worker.name: worker.status(now, 3 * self.status_interval) for worker in self.workers}
+        return {
+            "healthy": all(worker["healthy"] for worker in workers.values()),
+            "workers": workers,
+        }
+
+    def publish(self):
+        try:
+            self.mqtt.publish(self.topic, json_serial(self.status()), retain=True)
+        except Exception as e:
+            logger.error(f"Status publish failed: {e}")
+
+    def signal_workers(self, signum, frame):
+        # SIGUSR1 toggles profiling in every worker (see OnAir.toggle_profiling)
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signum)
+
+    def start(self):
+        signal.signal(signal.SIGUSR1, self.signal_workers)
+        self.mqtt = MQTTClient()
+        self.mqtt.loop_start()
+        for worker in self.workers:
+            self.spawn(worker)
+        published_at = time.monotonic()
+        try:
+            while not self.exit:
+                time.sleep(1)
+                self.collect()
+                now = time.monotonic()
+                for worker in self.workers:
+                    self.supervise(worker, now)
+                if now - published_at >= self.status_interval:
+                    self.publish()
+                    published_at = now
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self.exit = True
+
+    def shutdown(self, timeout: float = 15):
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    logger.error(f"Worker {worker.name} did not stop, killing")
+                    worker.process.kill()
+        self.mqtt.disconnect()
+        self.mqtt.loop_stop()
@@ -0,0 +1,43 @@
+import datetime
+
+import pytest
+
+# Backend unit tests: python -m pytest backend/tests
+# Tests taking the 'storage' fixture run against a throwaway PostgreSQL database
+# ('tests.database', created on the configured server when missing, never the
+# configured database) and are skipped when it cannot be reached.
+
+NAME = "test"
+
+
+@pytest.fixture(scope="session")
+def storage():
+    try:
+        from configuration import Configuration
+        from benchmarks.run import prepare_database
+        prepare_database(Configuration.MAP.get("tests", {}).get("database", "homectrl_test"), [NAME])
+        from backend import storage
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except BaseException as e:
+        # configuration raises a BaseException without secrets.json
+        pytest.skip(f"No test database: {e}")
+    return storage
+
+
+@pytest.fixture
+def db(storage):
+    # Clean history of the test device and last values cache around each test
+    def clean():
+        with storage.database:
+            for model in storage.device_entities():
+                model.delete().where(model.name == NAME).execute()
+        storage.last_values.invalidate()
+    clean()
+    yield storage
+    clean()
+
+
+@pytest.fixture
+def now() -> datetime.datetime:
+    return datetime.datetime.now().replace(microsecond=0)
@@ -0,0 +1,36 @@
+import datetime
+import decimal
+import json
+
+import pytest
+
+from backend import jsoncodec
+
+ENTRY = {"id": 1, "name": {"value": "kitchen", "description": "Kuchnia"}, "create_at": datetime.datetime(2024, 5, 1, 12, 30, 5),
+         "value": decimal.Decimal("21.35"), "live": True, "error": None, "list": [1, 2.5, "ż"]}
+
+
+def test_stdlib_output():
+    assert jsoncodec.dumps_stdlib(ENTRY) == ('{"id":1,"name":{"value":"kitchen","description":"Kuchnia"},'
+                                             '"create_at":"2024-05-01T12:30:05","value":21.35,"live":true,"error":null,"list":[1,2.5,"ż"]}')
+
+
+@pytest.mark.skipif(jsoncodec.orjson is None, reason="orjson not installed")
+@pytest.mark.parametrize("indent, sort_keys", [(None, False), (None, True), (2, False)])
+def test_orjson_and_stdlib_give_the_same_output(indent, sort_keys):
+    assert jsoncodec.dumps(ENTRY, indent=indent, sort_keys=sort_keys) == jsoncodec.dumps_stdlib(ENTRY, indent=indent, sort_keys=sort_keys)
+
+
+@pytest.mark.parametrize("value", [1e16, 1e-7, -2.5e-12, 6.02e23, decimal.Decimal("1E+16")])
+def test_exponent_notation_decodes_to_the_same_value(value):
+    assert json.loads(jsoncodec.dumps({"value": value})) == json.loads(jsoncodec.dumps_stdlib({"value": value})) == {"value": float(value)}
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), -float("inf"), decimal.Decimal("NaN")])
+def test_non_finite_floats_are_null(value):
+    assert jsoncodec.dumps({"value": [value, 1.5]}) == jsoncodec.dumps_stdlib({"value": [value, 1.5]}) == '{"value":[null,1.5]}'
+
+
+def test_loads_accepts_non_finite_literals():
+    assert jsoncodec.loads('{"value": 1.5}') == {"value": 1.5}
+    assert jsoncodec.loads('{"value": Infinity}') == {"value": float("inf")}
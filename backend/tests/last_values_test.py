@@ -0,0 +1,46 @@
+import datetime
+
+from backend.tests.conftest import NAME
+
+
+def test_get_reads_the_stored_value_once(db, now):
+    with db.database:
+        db.Temperature.create(name=NAME, create_at=now, value=21.5)
+        cache = db.LastValueCache()
+        misses = db.LAST_VALUES.get("miss")
+
+        first = cache.get(db.Temperature, NAME)
+        second = cache.get(db.Temperature, NAME)
+
+    assert first.value == second.value == 21.5
+    assert first is second
+    assert db.LAST_VALUES.get("miss") == misses
+
+
+def test_get_of_an_unknown_name_is_cached_as_none(db):
+    with db.database:
+        cache = db.LastValueCache()
+        misses = db.LAST_VALUES.get("miss")
+        assert cache.get(db.Temperature, NAME) is None
+        assert cache.get(db.Temperature, NAME) is None
+    assert db.LAST_VALUES.get("miss") == misses + 1
+
+
+def test_save_new_value_skips_unchanged_values(db, now):
+    with db.database:
+        for i, value in enumerate((20.0, 20.0, 20.5)):
+            db.Temperature(name=NAME, create_at=now + datetime.timedelta(seconds=i), value=value).save_new_value()
+        assert db.Temperature.select().where(db.Temperature.name == NAME).count() == 2
+        assert db.last_values.get(db.Temperature, NAME).value == 20.5
+
+
+def test_invalidate_reloads_from_the_database(db, now):
+    with db.database:
+        cache = db.LastValueCache()
+        cache.put(db.Temperature(name=NAME, create_at=now, value=30.0))
+        cache.put(db.Humidity(name=NAME, create_at=now, value=50.0))
+
+        cache.invalidate(db.Temperature, NAME)
+
+        assert cache.get(db.Temperature, NAME) is None
+        assert cache.get(db.Humidity, NAME).value == 50.0
@@ -0,0 +1,37 @@
+import datetime
+
+import pytest
+
+TABLE = "test_partitioned"
+
+
+@pytest.fixture
+def table(storage):
+    with storage.database.connection_context():
+        storage.database.execute_sql(f'drop table if exists "{TABLE}" cascade')
+        storage.database.execute_sql(f'create table "{TABLE}" (id serial, create_at timestamp not null) partition by range (create_at)')
+        storage.database.execute_sql(f'create table "{TABLE}_default" partition of "{TABLE}" default')
+        yield storage
+        storage.database.execute_sql(f'drop table if exists "{TABLE}" cascade')
+
+
+def test_create_partition_moves_rows_out_of_the_default_partition(table):
+    month = datetime.date(2031, 5, 1)
+    db = table.database
+    db.execute_sql(f'insert into "{TABLE}" (create_at) values (%s), (%s), (%s)',
+                   (datetime.datetime(2031, 5, 1), datetime.datetime(2031, 5, 31, 23, 59), datetime.datetime(2031, 6, 1)))
+
+    with db.atomic():
+        table._create_partition(TABLE, month)
+        # Already there, nothing to do:
+        table._create_partition(TABLE, month)
+
+    assert db.execute_sql(f'select count(*) from "{TABLE}_y2031m05"').fetchone()[0] == 2
+    assert db.execute_sql(f'select count(*) from "{TABLE}_default"').fetchone()[0] == 1
+    assert db.execute_sql(f'select count(*) from "{TABLE}"').fetchone()[0] == 3
+
+
+def test_create_partition_of_an_empty_month(table):
+    table._create_partition(TABLE, datetime.date(2031, 12, 1))
+    assert table._is_partitioned(TABLE)
+    assert table.database.table_exists(f"{TABLE}_y2031m12")
@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+
+from backend.tests.conftest import NAME
+
+DAY = datetime.datetime(2001, 2, 3)
+
+
+def at(minute: int, second: int = 0) -> datetime.datetime:
+    return DAY + datetime.timedelta(minutes=minute, seconds=second)
+
+
+@pytest.fixture
+def rollups(db):
+    def clean():
+        with db.database:
+            for model in (db.RollupMinute, db.RollupHour):
+                model.delete().where(model.name == NAME).execute()
+    clean()
+    yield db
+    clean()
+
+
+def minutes(storage, field: str = "value") -> dict:
+    query = (storage.RollupMinute.select()
+             .where(storage.RollupMinute.name == NAME, storage.RollupMinute.field == field)
+             .order_by(storage.RollupMinute.bucket_at))
+    return {row.bucket_at: row for row in query}
+
+
+def test_boolean_intervals_are_split_on_minute_boundaries(rollups):
+    from backend.retention import Retention
+    storage = rollups
+    with storage.database:
+        storage.Presence.create(name=NAME, create_at=at(0, 30), value=True)
+        storage.Presence.create(name=NAME, create_at=at(1, 15), value=False)
+
+        Retention._rollup_boolean(storage.Presence, storage.Presence.value, at(0), at(2))
+        result = minutes(storage)
+
+    assert list(result) == [at(0), at(1)]
+    first, second = result[at(0)], result[at(1)]
+    assert (first.samples, first.on_time, first.avg, first.last) == (1, 30, 0.5, 1)
+    assert (second.samples, second.on_time, second.avg, second.last) == (1, 15, 0.25, 0)
+    assert (second.min, second.max) == (0, 1)
+
+
+def test_boolean_state_is_carried_into_the_next_rollup(rollups):
+    from backend.retention import Retention
+    storage = rollups
+    with storage.database:
+        storage.Presence.create(name=NAME, create_at=at(0, 30), value=True)
+        Retention._rollup_boolean(storage.Presence, storage.Presence.value, at(0), at(1))
+        # Nothing changes during the next two minutes, the state is still true:
+        Retention._rollup_boolean(storage.Presence, storage.Presence.value, at(1), at(3))
+        result = minutes(storage)
+
+    assert list(result) == [at(0), at(1), at(2)]
+    assert [row.on_time for row in result.values()] == [30, 60, 60]
+    assert [row.samples for row in result.values()] == [1, 0, 0]
+
+
+def test_numeric_rollup_per_minute(rollups):
+    from backend.retention import Retention
+    storage = rollups
+    with storage.database:
+        for second, value in ((0, 20.0), (20, 22.0), (40, 21.0), (65, 25.0)):
+            storage.Temperature.create(name=NAME, create_at=at(0, second), value=value)
+        Retention._rollup_numeric(storage.Temperature, storage.Temperature.value, at(0), at(2))
+        result = minutes(storage)
+
+    first, second = result[at(0)], result[at(1)]
+    assert (first.samples, first.min, first.max, first.avg, first.last) == (3, 20, 22, 21, 21)
+    assert (second.samples, second.last) == (1, 25)
@@ -0,0 +1,52 @@
+import datetime
+
+import numpy as np
+
+from backend.timeline import state_changes, minute_occupancy
+
+START = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def epoch(minute: int, second: int = 0) -> int:
+    return int(np.datetime64(START, "s").astype(np.int64)) + minute * 60 + second
+
+
+def occupancy(changes: list, end_minute: int) -> list:
+    create_at = [START + datetime.timedelta(seconds=second) for second, _ in changes]
+    seconds, values = state_changes(create_at, [value for _, value in changes], START, START + datetime.timedelta(minutes=end_minute))
+    minutes, occupied = minute_occupancy(seconds, values)
+    assert minutes[0] == epoch(0)
+    return occupied.tolist()
+
+
+def test_state_changes_opposite_start_and_held_end():
+    create_at = [START + datetime.timedelta(seconds=90)]
+    seconds, values = state_changes(create_at, [True], START, START + datetime.timedelta(minutes=5))
+    assert seconds.tolist() == [epoch(0), epoch(1, 30), epoch(5)]
+    assert values.tolist() == [0, 1, 1]
+
+
+def test_state_changes_same_second_off_wins():
+    create_at = [START + datetime.timedelta(seconds=5), START + datetime.timedelta(seconds=10),
+                 START + datetime.timedelta(seconds=10, milliseconds=500)]
+    seconds, values = state_changes(create_at, [True, True, False], START, START + datetime.timedelta(minutes=1))
+    assert seconds.tolist() == [epoch(0), epoch(0, 5), epoch(0, 10), epoch(1)]
+    assert values.tolist() == [0, 1, 0, 0]
+
+
+def test_interval_spanning_minutes_occupies_each_of_them():
+    # On at 00:30, off at 03:10: minutes 0, 1, 2 and 3
+    assert occupancy([(30, True), (190, False)], 6) == [1, 1, 1, 1, 0, 0, 0]
+
+
+def test_change_on_a_minute_boundary():
+    # Off exactly at 02:00: minute 2 not occupied, the state was on until 01:59
+    assert occupancy([(60, True), (120, False)], 4) == [0, 1, 0, 0, 0]
+
+
+def test_short_presence_within_a_minute():
+    assert occupancy([(125, True), (126, False)], 3) == [0, 0, 1, 0]
+
+
+def test_state_on_until_the_end():
+    assert occupancy([(150, True)], 3) == [0, 0, 1, 1]
@@ -0,0 +1,53 @@
+import pytest
+
+from backend.topictrie import TopicTrie
+
+
+def trie(*filters) -> TopicTrie:
+    result = TopicTrie()
+    for topic_filter in filters:
+        result.add(topic_filter, topic_filter)
+    return result
+
+
+@pytest.mark.parametrize("topic_filter, topic, matches", [
+    ("homectrl/device/kitchen/data", "homectrl/device/kitchen/data", True),
+    ("homectrl/device/kitchen/data", "homectrl/device/kitchen", False),
+    ("homectrl/device/+/data", "homectrl/device/kitchen/data", True),
+    ("homectrl/device/+/data", "homectrl/device/kitchen/live", False),
+    ("homectrl/device/+/data", "homectrl/device/kitchen/data/extra", False),
+    ("homectrl/device/+", "homectrl/device/", True),
+    ("+/+", "homectrl/device", True),
+    ("+", "homectrl/device", False),
+    ("homectrl/#", "homectrl", True),
+    ("homectrl/#", "homectrl/onair/temperature/kitchen", True),
+    ("homectrl/#", "homectrlx/onair", False),
+    ("homectrl/+/temperature/#", "homectrl/onair/temperature/kitchen", True),
+    ("#", "homectrl/device/kitchen/data", True),
+    ("#", "$SYS/broker/uptime", False),
+    ("+/broker/uptime", "$SYS/broker/uptime", False),
+    ("$SYS/#", "$SYS/broker/uptime", True),
+])
+def test_wildcards(topic_filter, topic, matches):
+    assert (trie(topic_filter).match(topic) == [topic_filter]) is matches
+
+
+def test_subscribers_in_the_order_they_were_added():
+    topics = trie("homectrl/#", "homectrl/device/+/data", "homectrl/device/kitchen/data", "other/#")
+    assert topics.match("homectrl/device/kitchen/data") == ["homectrl/#", "homectrl/device/+/data", "homectrl/device/kitchen/data"]
+    assert topics.match("homectrl/device/pantry/data") == ["homectrl/#", "homectrl/device/+/data"]
+
+
+def test_one_subscriber_of_several_filters_matched_once():
+    topics = TopicTrie()
+    topics.add("homectrl/device/+/data", "devices")
+    topics.add("homectrl/device/+/live", "devices")
+    topics.add("homectrl/#", "devices")
+    assert topics.match("homectrl/device/kitchen/data") == ["devices"]
+
+
+def test_cache_cleared_when_a_filter_is_added():
+    topics = trie("homectrl/device/+/data")
+    assert topics.match("homectrl/onair/temperature/kitchen") == []
+    topics.add("homectrl/onair/#", "onair")
+    assert topics.match("homectrl/onair/temperature/kitchen") == ["onair"]
@@ -0,0 +1,55 @@
+from backend.tracing import LatencyTracer, percentile
+
+
+def trace(seq: int, ts: float = 1000) -> dict:
+    return {"seq": seq, "ts": ts, "onair_rx": ts + 10, "onair_tx": ts + 12, "restapi_rx": ts + 15}
+
+
+def test_sequence_gaps_are_lost_messages():
+    tracer = LatencyTracer()
+    for seq in (1, 2, 5, 6):
+        tracer.received("kitchen", trace(seq))
+    report = tracer.report("kitchen")
+    assert (report["received"], report["lost"], report["loss"], report["last_seq"]) == (4, 2, round(2 / 6, 4), 6)
+
+
+def test_restarts_and_duplicates_are_not_lost():
+    tracer = LatencyTracer()
+    for seq in (7, 8, 8, 1, 2):
+        tracer.received("kitchen", trace(seq))
+    report = tracer.report("kitchen")
+    assert (report["lost"], report["restarts"], report["duplicates"]) == (0, 1, 1)
+
+
+def test_stages_recorded_where_they_are_measured():
+    tracer = LatencyTracer()
+    tracer.received("kitchen", trace(1))
+    latency = tracer.report("kitchen")["latency_ms"]
+    assert {name: stage["p50"] for name, stage in latency.items()} == {"device_onair": 10, "onair": 2, "broker": 3}
+
+    tracer.pushed("kitchen", trace(1) | {"restapi_tx": 1020})
+    latency = tracer.report("kitchen")["latency_ms"]
+    assert (latency["restapi"]["p50"], latency["total"]["p50"], latency["onair"]["count"]) == (5, 20, 1)
+
+
+def test_missing_timestamps_are_skipped():
+    tracer = LatencyTracer()
+    tracer.received("kitchen", {"seq": 1, "ts": 1000, "onair_rx": 1004})
+    assert list(tracer.report("kitchen")["latency_ms"]) == ["device_onair"]
+
+
+def test_percentiles_over_the_window():
+    assert percentile(list(range(1, 101)), 0.5) == 51
+    assert percentile(list(range(1, 101)), 0.99) == 100
+    tracer = LatencyTracer(window=10)
+    for seq in range(1, 21):
+        tracer.received("kitchen", trace(seq) | {"onair_rx": 1000 + seq})
+    stage = tracer.report("kitchen")["latency_ms"]["device_onair"]
+    assert (stage["count"], stage["p50"], stage["max"]) == (10, 16, 20)
+
+
+def test_report_of_an_unknown_device():
+    tracer = LatencyTracer()
+    tracer.received("pantry", trace(1))
+    assert tracer.report("kitchen") == {}
+    assert list(tracer.report()) == ["pantry"]
@@ -0,0 +1,57 @@
+import datetime
+import decimal
+
+from backend.tests.conftest import NAME
+
+
+def radar(storage, create_at: datetime.datetime, distance: int):
+    return storage.Radar(name=NAME, create_at=create_at, presence=True, target_state=1, distance=distance,
+                         move_distance=distance, move_energy=50, static_distance=distance, static_energy=50)
+
+
+def test_flush_writes_every_radar_sample(db, now):
+    from backend.writer import StorageWriter
+    writer = StorageWriter()
+    first = radar(db, now, 100)
+    second = radar(db, now + datetime.timedelta(seconds=1), 120)
+
+    # Separate flushes: the first one is the cached last value when the second is checked
+    writer._flush([first])
+    writer._flush([second])
+
+    with db.database:
+        rows = list(db.Radar.select().where(db.Radar.name == NAME).order_by(db.Radar.create_at))
+    assert [row.distance for row in rows] == [100, 120]
+    assert first.id == rows[0].id and second.id == rows[1].id
+
+
+def test_flush_skips_unchanged_values(db, now):
+    from backend.writer import StorageWriter
+    writer = StorageWriter()
+    entries = [db.Temperature(name=NAME, create_at=now + datetime.timedelta(seconds=i), value=value)
+               for i, value in enumerate((20.5, 20.5, 21.0, 21.0, 20.5))]
+
+    writer._flush(entries)
+
+    with db.database:
+        values = [row.value for row in db.Temperature.select().where(db.Temperature.name == NAME).order_by(db.Temperature.create_at)]
+    assert values == [decimal.Decimal("20.5"), decimal.Decimal("21.0"), decimal.Decimal("20.5")]
+
+
+def test_flush_falls_back_to_single_inserts(db, now):
+    from backend.writer import StorageWriter, ENTRIES
+    writer = StorageWriter()
+    failed = ENTRIES.get("failed")
+    # An unknown device name breaks the batch insert (foreign key), the other entries are still written:
+    entries = [db.Temperature(name=NAME, create_at=now, value=20.0),
+               db.Temperature(name="test-unknown-device", create_at=now, value=20.0),
+               db.Humidity(name=NAME, create_at=now, value=40.0)]
+
+    writer._flush(entries)
+
+    with db.database:
+        assert db.Temperature.select().where(db.Temperature.name == NAME).count() == 1
+        assert db.Humidity.select().where(db.Humidity.name == NAME).count() == 1
+    assert ENTRIES.get("failed") == failed + 1
+    # Not written, so not the last value either:
+    assert (db.Temperature, "test-unknown-device") not in db.last_values.values
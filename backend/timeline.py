@@ -0,0 +1,39 @@
+import datetime
+
+import numpy as np
+
+
+def state_changes(create_at, values, start_date: datetime.datetime, end_date: datetime.datetime) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Change points of a state series as (epoch seconds, int values), sorted and one per second.
+    The state before the first change is the opposite of the first value (at start_date),
+    the last value lasts until end_date. Within the same second '0' wins.
+    """
+    seconds = np.asarray(create_at, dtype="datetime64[s]").astype(np.int64)
+    values = np.asarray(values).astype(int)
+    seconds = np.concatenate(([np.datetime64(start_date, "s").astype(np.int64)],
+                              seconds,
+                              [np.datetime64(end_date, "s").astype(np.int64)]))
+    values = np.concatenate(([(values[0] + 1) % 2], values, [values[-1]]))
+    order = np.lexsort((values, seconds))
+    seconds, values = seconds[order], values[order]
+    first = np.ones(len(seconds), dtype=bool)
+    first[1:] = seconds[1:] != seconds[:-1]
+    return seconds[first], values[first]
+
+
+def minute_occupancy(seconds: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per-minute state of change points from state_changes(), as (minute epoch seconds, 0/1):
+    1 for every minute in which the state was '1' for at least one second.
+    Each change holds until the next one, the last one for its second only.
+    """
+    first_minute = seconds[0] // 60
+    minutes = seconds[-1] // 60 - first_minute + 1
+    on = values != 0
+    until = np.append(seconds[1:] - 1, seconds[-1])
+    diff = np.zeros(minutes + 1, dtype=np.int64)
+    np.add.at(diff, seconds[on] // 60 - first_minute, 1)
+    np.add.at(diff, until[on] // 60 - first_minute + 1, -1)
+    occupied = (np.cumsum(diff[:-1]) > 0).astype(int)
+    return (first_minute + np.arange(minutes)) * 60, occupied
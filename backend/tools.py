@@ -1,13 +1,15 @@
 import array
 import atexit
-import datetime
-import decimal
+import collections
 import functools
+import gzip
+import hashlib
 import logging
 import os
 import json
 import struct
 import sys
+import threading
 import time
 
 import webrepl
@@ -16,12 +18,19 @@ import termios, select
 import readline
 
 from time import sleep
-from paho.mqtt.client import Client as PahoMQTTClient, CallbackAPIVersion, MQTTMessageInfo
+from paho.mqtt.client import Client as PahoMQTTClient, CallbackAPIVersion, MQTTMessageInfo, MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN, MQTTv5
 
+from backend import jsoncodec
+from backend.jsoncodec import HomeCtrlJsonEncoder
+from backend.metrics import registry
+from backend.topictrie import TopicTrie
 from common.common import Common
 from common.communication import Communication
 from configuration import Configuration
 
+logger = logging.getLogger("onair.mqtt")
+
+
 class WSCommandLineClient:
     def __init__(self, server_id: str, json_format = True):
         def save(prev_h_len, histfile):
@@ -348,23 +357,133 @@ class WebREPLClient(webrepl.Webrepl):
             console.exit()
 
 
+PUBLISHES = registry.counter("mqtt_publishes_total", "MQTT publishes: sent, suppressed as unchanged retained, buffered, dropped", ("result",))
+
+
 class MQTTClient(PahoMQTTClient):
-    def __init__(self, on_connect=None, on_disconnect=None, on_message=None, on_publish=None, keepalive:int = None):
+    """
+    Publishes skip a retained payload identical to the last one sent on a topic
+    matching 'mqtt.publisher.dedupe' (top level 'ignore' fields, like timestamps,
+    left out of the comparison). Once the network loop has connected, publishes
+    made while disconnected are kept in a bounded buffer and sent on reconnect
+    instead of reconnecting inline.
+    """
+
+    def __init__(self, on_connect=None, on_disconnect=None, on_message=None, on_publish=None, keepalive:int = None,
+                 host: str = None, port: int = None):
         super().__init__(CallbackAPIVersion.VERSION2)
         conf = Configuration.get_mqtt_config()
-        self.on_connect = on_connect
+        publisher = conf.get("publisher", {})
+        self.user_on_connect = on_connect
+        self.on_connect = self._on_connect
         self.on_message = on_message
         self.on_disconnect = on_disconnect
         self.on_publish = on_publish
         self.username_pw_set(conf["username"], conf["password"])
         if keepalive:
             self.keepalive = keepalive
-        self.connect(conf["host"], conf["port"])
 
-    def publish(self, *args, **kwargs) -> MQTTMessageInfo:
-        if not self.is_connected():
-            self.reconnect()
-        return super().publish(*args, **kwargs)
+        self.dedupe = TopicTrie()
+        for topic in publisher.get("dedupe", []):
+            self.dedupe.add(topic, True)
+        self.ignore = set(publisher.get("ignore", []))
+        self.retained = {}
+        self.broker = None
+        self.buffer = collections.deque(maxlen=publisher.get("buffer_size", 1000))
+        self.buffer_lock = threading.Lock()
+        self.looping = False
+        self.connect(host or conf["host"], port or conf["port"])
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        self.looping = True
+        if not reason_code.is_failure:
+            broker = (self.host, self.port)
+            if broker != self.broker or (self._resumes_session() and not flags.session_present):
+                # Another broker, or one that lost the session it was asked to resume: retained payloads
+                # sent before may be gone, so they are not suppressed when published again
+                self.retained.clear()
+            self.broker = broker
+            self.drain()
+        if self.user_on_connect is not None:
+            self.user_on_connect(client, userdata, flags, reason_code, properties)
+
+    def _resumes_session(self) -> bool:
+        # A clean session starts empty on every connect, so only a resumed one tells about the broker's state
+        if self._protocol == MQTTv5:
+            return self._clean_start is not True
+        return not self._clean_session
+
+    def digest(self, payload) -> bytes:
+        if isinstance(payload, str):
+            if self.ignore and payload.startswith("{"):
+                try:
+                    data = json_deserial(payload)
+                    payload = json_serial({key: value for key, value in data.items() if key not in self.ignore}, sort_keys=True)
+                except ValueError:
+                    pass
+            payload = payload.encode()
+        elif not isinstance(payload, (bytes, bytearray)):
+            payload = str(payload).encode()
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None) -> MQTTMessageInfo:
+        digest = None
+        if retain and self.dedupe.match(topic):
+            if payload is None or payload == "" or payload == b"":
+                self.retained.pop(topic, None)
+            else:
+                digest = self.digest(payload)
+                if self.retained.get(topic) == digest:
+                    PUBLISHES.labels("suppressed").inc()
+                    info = MQTTMessageInfo(0)
+                    info.rc = MQTT_ERR_SUCCESS
+                    info._set_as_published()
+                    return info
+
+        if not self.looping:
+            if not self.is_connected():
+                self.reconnect()
+            return self._send(topic, payload, qos, retain, properties, digest)
+
+        # The network loop reconnects and drain() empties the buffer checking it under the same lock:
+        # a publish either sees the connection up and nothing pending, or is buffered before drain() ends.
+        # The lock is not held while sending, paho may run callbacks (and so drain()) meanwhile.
+        with self.buffer_lock:
+            buffered = not self.is_connected() or bool(self.buffer)
+            if buffered:
+                if len(self.buffer) == self.buffer.maxlen:
+                    PUBLISHES.labels("dropped").inc()
+                self.buffer.append((topic, payload, qos, retain, properties, digest))
+                PUBLISHES.labels("buffered").inc()
+        if not buffered:
+            return self._send(topic, payload, qos, retain, properties, digest)
+        info = MQTTMessageInfo(0)
+        info.rc = MQTT_ERR_NO_CONN
+        return info
+
+    def _send(self, topic: str, payload, qos: int, retain: bool, properties, digest: bytes | None) -> MQTTMessageInfo:
+        # The digest is kept only once the publish is handed over to the broker connection
+        info = super().publish(topic, payload, qos, retain, properties)
+        if info.rc == MQTT_ERR_SUCCESS:
+            PUBLISHES.labels("sent").inc()
+            if digest is not None:
+                self.retained[topic] = digest
+        return info
+
+    def drain(self):
+        with self.buffer_lock:
+            if self.buffer:
+                logger.info(f"Sending {len(self.buffer)} publishes buffered while disconnected")
+        while True:
+            with self.buffer_lock:
+                if not self.buffer:
+                    return
+                pending = self.buffer.popleft()
+            self._send(*pending)
+
+    def stats(self) -> dict:
+        return ({result: int(PUBLISHES.get(result)) for result in ("sent", "suppressed", "buffered", "dropped")}
+                | {"pending": len(self.buffer), "retained": len(self.retained)})
 
 
 class MQTTMonitor:
@@ -428,21 +547,135 @@ class MQTTMonitor:
             client.disconnect()
 
 
-class HomeCtrlJsonEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime.datetime) or isinstance(obj, datetime.date) or isinstance(obj, datetime.time):
-            return obj.isoformat()
-        elif isinstance(obj, decimal.Decimal):
-            return float(obj)
-        return json.JSONEncoder.default(self, obj)
+class MQTTLog:
+    """
+    Compact, append-only capture of MQTT traffic: gzip members (one more per
+    recording session appended to the file) of records framed as
+    <timestamp: double><retain: byte><topic length: ushort><payload length: uint><topic><payload>.
+    """
+
+    HEADER = struct.Struct("<dBHI")
+
+    @staticmethod
+    def pack(timestamp: float, topic: str, payload: bytes, retain: bool) -> bytes:
+        topic = topic.encode()
+        return MQTTLog.HEADER.pack(timestamp, retain, len(topic), len(payload)) + topic + payload
+
+    @staticmethod
+    def read(file: str):
+        with gzip.open(file, "rb") as f:
+            try:
+                while header := f.read(MQTTLog.HEADER.size):
+                    if len(header) < MQTTLog.HEADER.size:
+                        return
+                    timestamp, retain, topic_length, payload_length = MQTTLog.HEADER.unpack(header)
+                    topic = f.read(topic_length)
+                    payload = f.read(payload_length)
+                    if len(payload) < payload_length:
+                        return
+                    yield timestamp, topic.decode(), payload, bool(retain)
+            except EOFError:
+                # The recording was killed, its last gzip member is not closed
+                return
+
+
+class MQTTRecorder(MQTTMonitor):
+
+    logger = logging.getLogger("MQTT.record")
+
+    def __init__(self, topic, file: str, flush_interval: float = 1.0):
+        super().__init__(topic)
+        self.file = file
+        self.flush_interval = flush_interval
+        self.out = None
+        self.lock = threading.Lock()
+        self.count = 0
+        self.flushed_at = 0.0
+
+    def on_message(self, client, userdata, msg):
+        record = MQTTLog.pack(time.time(), msg.topic, msg.payload, msg.retain)
+        with self.lock:
+            self.out.write(record)
+            self.count += 1
+            # Synced, so a killed recording loses at most flush_interval of traffic:
+            if time.monotonic() - self.flushed_at >= self.flush_interval:
+                self.out.flush()
+                self.flushed_at = time.monotonic()
+
+    def start(self):
+        self.out = gzip.open(self.file, "ab")
+        self.logger.info(f"Recording {self.topic} to {self.file}, Ctrl-C to stop")
+        try:
+            super().start()
+        finally:
+            with self.lock:
+                self.out.close()
+            self.logger.info(f"Recorded {self.count} messages to {self.file}")
+
+
+class MQTTReplayer:
+    """
+    Publishes a capture of MQTTRecorder with the original timing, 'speed' times
+    faster (0: as fast as possible), to a broker, by default a local one.
+    """
+
+    logger = logging.getLogger("MQTT.replay")
+
+    def __init__(self, file: str, speed: float = 1.0, topics: list = None, host: str = "localhost", port: int = None):
+        from backend.topictrie import TopicTrie
+        self.file = file
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.topics = None
+        if topics:
+            self.topics = TopicTrie()
+            for topic in topics:
+                self.topics.add(topic, True)
+
+    def start(self):
+        client = MQTTClient(host=self.host, port=self.port)
+        client.loop_start()
+        deadline = time.monotonic() + 10
+        while not client.is_connected():
+            if time.monotonic() > deadline:
+                raise ConnectionError(f"Cannot connect to MQTT broker {self.host}")
+            sleep(0.05)
+
+        count = 0
+        lag = 0.0
+        started = time.monotonic()
+        first = None
+        try:
+            for timestamp, topic, payload, retain in MQTTLog.read(self.file):
+                if self.topics is not None and not self.topics.match(topic):
+                    continue
+                if first is None:
+                    first = timestamp
+                if self.speed:
+                    due = started + (timestamp - first) / self.speed
+                    if (delay := due - time.monotonic()) > 0:
+                        sleep(delay)
+                    else:
+                        lag = max(lag, -delay)
+                client.publish(topic, payload, retain=retain)
+                count += 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            elapsed = time.monotonic() - started
+            client.disconnect()
+            client.loop_stop()
+            self.logger.info(f"Replayed {count} messages in {elapsed:.1f}s ({count / max(elapsed, 0.001):.0f} msg/s), "
+                             f"speed: {self.speed or 'max'}, max lag: {lag * 1000:.0f}ms")
 
 
 def json_serial(obj, indent:int = None, sort_keys: bool = False):
-    return json.dumps(obj, cls=HomeCtrlJsonEncoder, indent=indent, sort_keys=sort_keys)
+    return jsoncodec.dumps(obj, indent=indent, sort_keys=sort_keys)
 
 
 def json_deserial(json_str):
-    return json.loads(json_str, parse_float=lambda x: round(decimal.Decimal(x), 10))
+    return jsoncodec.loads(json_str)
 
 
 def singleton(cls):
@@ -0,0 +1,57 @@
+class _Node:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = []
+
+
+class TopicTrie:
+    """
+    MQTT topic filters (with '+' and '#' wildcards) compiled into a trie of topic
+    levels. match() walks the levels of a topic once, whatever the number of
+    filters, and returns the subscribers in the order they were added.
+    """
+
+    CACHE_SIZE = 4096
+
+    def __init__(self):
+        self.root = _Node()
+        self.filters = []
+        self.order = {}
+        self.cache = {}
+
+    def add(self, topic_filter: str, subscriber) -> None:
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        if subscriber not in node.subscribers:
+            node.subscribers.append(subscriber)
+        if topic_filter not in self.filters:
+            self.filters.append(topic_filter)
+        self.order.setdefault(subscriber, len(self.order))
+        self.cache.clear()
+
+    def match(self, topic: str) -> list:
+        if (result := self.cache.get(topic)) is None:
+            found = set()
+            levels = topic.split("/")
+            # Wildcards at the first level do not match topics starting with '$' (e.g. $SYS):
+            self._match(self.root, levels, 0, found, not topic.startswith("$"))
+            result = sorted(found, key=self.order.get)
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.clear()
+            self.cache[topic] = result
+        return result
+
+    def _match(self, node: _Node, levels: list, index: int, found: set, wildcards: bool = True) -> None:
+        if wildcards and (child := node.children.get("#")) is not None:
+            # 'a/#' matches 'a' as well as everything below it
+            found.update(child.subscribers)
+        if index == len(levels):
+            found.update(node.subscribers)
+            return
+        if (child := node.children.get(levels[index])) is not None:
+            self._match(child, levels, index + 1, found)
+        if wildcards and (child := node.children.get("+")) is not None:
+            self._match(child, levels, index + 1, found)
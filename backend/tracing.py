@@ -0,0 +1,107 @@
+import time
+from collections import deque
+
+# Stages of the trace envelope, as (name, from, to) timestamps, all in ms since the epoch (UTC):
+#   ts          device (RTC, NTP synchronized), set by BoardApplication.publish
+#   onair_rx    onair, message received by Devices.on_message
+#   onair_tx    onair, entry published by Devices.process_entry
+#   restapi_rx  restapi, onair message received
+#   restapi_tx  restapi, pushed to the WebSocket clients
+STAGES = [
+    ("device_onair", "ts", "onair_rx"),
+    ("onair", "onair_rx", "onair_tx"),
+    ("broker", "onair_tx", "restapi_rx"),
+    ("restapi", "restapi_rx", "restapi_tx"),
+    ("total", "ts", "restapi_tx"),
+]
+
+
+def now_ms() -> float:
+    return time.time() * 1000
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class DeviceTrace:
+
+    def __init__(self, window: int):
+        self.samples = {name: deque(maxlen=window) for name, _, _ in STAGES}
+        self.last_seq = None
+        self.received = 0
+        self.lost = 0
+        self.restarts = 0
+        self.duplicates = 0
+
+    def sequence(self, seq: int):
+        self.received += 1
+        if self.last_seq is not None:
+            if seq == self.last_seq:
+                self.duplicates += 1
+            elif seq < self.last_seq:
+                # The device restarted (or its counter wrapped), counting starts again:
+                self.restarts += 1
+            else:
+                self.lost += seq - self.last_seq - 1
+        self.last_seq = seq
+
+    def report(self) -> dict:
+        latency = {}
+        for name, values in self.samples.items():
+            if values:
+                values = list(values)
+                latency[name] = {
+                    "count": len(values),
+                    "p50": round(percentile(values, 0.50), 1),
+                    "p90": round(percentile(values, 0.90), 1),
+                    "p99": round(percentile(values, 0.99), 1),
+                    "max": round(max(values), 1),
+                }
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "loss": round(self.lost / (self.received + self.lost), 4) if self.received + self.lost else 0.0,
+            "restarts": self.restarts,
+            "duplicates": self.duplicates,
+            "last_seq": self.last_seq,
+            "latency_ms": latency,
+        }
+
+
+class LatencyTracer:
+    """
+    Per device latency percentiles of the trace envelope stages (over the last
+    'window' samples) and sequence gaps, counted as lost messages.
+    """
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self.devices = {}
+
+    def device(self, name: str) -> DeviceTrace:
+        if (device := self.devices.get(name)) is None:
+            device = self.devices[name] = DeviceTrace(self.window)
+        return device
+
+    def add(self, name: str, trace: dict, stages: tuple = None):
+        device = self.device(name)
+        for stage, start, end in STAGES:
+            if (stages is None or stage in stages) and trace.get(start) is not None and trace.get(end) is not None:
+                device.samples[stage].append(trace[end] - trace[start])
+
+    def received(self, name: str, trace: dict):
+        # Every device message, forwarded by onair on the trace facet
+        if (seq := trace.get("seq")) is not None:
+            self.device(name).sequence(seq)
+        self.add(name, trace, ("device_onair", "onair", "broker"))
+
+    def pushed(self, name: str, trace: dict):
+        # An entry pushed to the browsers
+        self.add(name, trace, ("restapi", "total"))
+
+    def report(self, name: str = None) -> dict:
+        if name is not None:
+            return self.devices[name].report() if name in self.devices else {}
+        return {name: device.report() for name, device in sorted(self.devices.items())}
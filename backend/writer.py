@@ -0,0 +1,171 @@
+import logging
+import queue
+import threading
+import time
+from typing import Type
+
+from backend.metrics import registry, SIZE_BUCKETS
+from backend.storage import database, last_values, HomeCtrlBaseModel
+from configuration import Configuration
+
+logger = logging.getLogger("storage.writer")
+
+WRITE_SECONDS = registry.histogram("storage_write_seconds", "Storage writer flush time (one transaction)")
+BATCH_SIZE = registry.histogram("storage_write_batch_size", "Entries written per storage writer flush", buckets=SIZE_BUCKETS)
+QUEUE_DEPTH = registry.gauge("storage_writer_queue_depth", "Entries waiting for the storage writer")
+QUEUE_MAX_DEPTH = registry.gauge("storage_writer_queue_max_depth", "Most entries waiting for the storage writer")
+ENTRIES = registry.counter("storage_writer_entries_total", "Entries handed to the storage writer, by outcome", ("outcome",))
+BATCHES = registry.counter("storage_writer_batches_total", "Storage writer flushes")
+
+OUTCOMES = ("submitted", "written", "skipped", "dropped", "blocked", "failed")
+
+
+class StorageWriter:
+    """
+    Write-behind persistence of device entries.
+
+    Entries are handed over with submit() (from the MQTT thread) and written
+    by a dedicated thread. Entries are grouped per model and flushed with one
+    multi-row insert per model, in a single transaction, when either
+    batch_size entries are pending or flush_interval seconds have passed.
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, queue_size: int = None, put_timeout: float = None):
+        conf = Configuration.get_writer_config()
+        self.batch_size = batch_size or conf.get("batch_size", 200)
+        self.flush_interval = flush_interval or conf.get("flush_interval", 2.0)
+        self.put_timeout = put_timeout if put_timeout is not None else conf.get("put_timeout", 0.1)
+        self.queue = queue.Queue(maxsize=queue_size or conf.get("queue_size", 10_000))
+        self.exit = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.exit = False
+            self.thread = threading.Thread(target=self._loop, name="storage-writer", daemon=True)
+            self.thread.start()
+            logger.info(f"Storage writer started: batch_size={self.batch_size}, flush_interval={self.flush_interval}, "
+                        f"queue_size={self.queue.maxsize}")
+
+    def stop(self, timeout: float = 10):
+        if self.thread is not None:
+            self.exit = True
+            self.thread.join(timeout=timeout)
+            if self.thread.is_alive():
+                # Still flushing, and it drains the queue itself before it ends: flushing here too would race with it
+                logger.warning(f"Storage writer still flushing after {timeout}s, not waiting for it: {self.stats()}")
+                return
+            self.thread = None
+        # Whatever is still waiting (or was submitted after the thread ended) is written here:
+        self._flush(self._drain())
+        logger.info(f"Storage writer stopped: {self.stats()}, last values cache: {last_values.stats()}")
+
+    def submit(self, entry: HomeCtrlBaseModel) -> bool:
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            ENTRIES.labels("blocked").inc()
+            try:
+                self.queue.put(entry, timeout=self.put_timeout)
+            except queue.Full:
+                ENTRIES.labels("dropped").inc()
+                logger.error(f"Storage writer queue full, entry dropped: {type(entry).__name__} {entry.__data__}")
+                return False
+        ENTRIES.labels("submitted").inc()
+        QUEUE_MAX_DEPTH.set_max(self.queue.qsize())
+        return True
+
+    def stats(self) -> dict:
+        return ({outcome: int(ENTRIES.get(outcome)) for outcome in OUTCOMES}
+                | {"batches": int(BATCHES.get()), "max_depth": int(QUEUE_MAX_DEPTH.get()), "depth": self.queue.qsize()})
+
+    def _drain(self) -> list:
+        result = []
+        while True:
+            try:
+                result.append(self.queue.get_nowait())
+            except queue.Empty:
+                return result
+
+    def _loop(self):
+        pending = []
+        deadline = None
+        while not self.exit:
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                pending.append(self.queue.get(timeout=timeout))
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(pending)
+                pending = []
+                deadline = None
+        self._flush(pending + self._drain())
+        database.close()
+
+    @staticmethod
+    def _is_new(entry: HomeCtrlBaseModel) -> bool:
+        if entry.equals(last_values.get(type(entry), entry.name_id)):
+            return False
+        last_values.put(entry)
+        return True
+
+    def _flush(self, entries: list):
+        if not entries:
+            return
+        start = time.monotonic()
+        grouped: dict[Type[HomeCtrlBaseModel], list] = {}
+        skipped = 0
+        for entry in entries:
+            try:
+                if self._is_new(entry):
+                    grouped.setdefault(type(entry), []).append(entry)
+                else:
+                    skipped += 1
+            except Exception as e:
+                ENTRIES.labels("failed").inc()
+                logger.error(f"Storage writer cannot process entry {type(entry).__name__} {entry.__data__}: {e}")
+
+        written = 0
+        try:
+            with database.atomic():
+                for model, rows in grouped.items():
+                    # The ids are set on the entries, as save() does, since they are the cached last values:
+                    query = model.insert_many([self._row(model, row) for row in rows])
+                    ids = query.returning(model._meta.primary_key).tuples().execute()
+                    for row, (id,) in zip(rows, ids):
+                        row.id = id
+                    written += len(rows)
+        except Exception as e:
+            logger.error(f"Storage writer batch insert failed, falling back to single inserts: {e}")
+            written = self._flush_one_by_one(grouped)
+
+        ENTRIES.labels("written").inc(written)
+        ENTRIES.labels("skipped").inc(skipped)
+        BATCHES.inc()
+        WRITE_SECONDS.observe(time.monotonic() - start)
+        BATCH_SIZE.observe(written)
+        QUEUE_DEPTH.set(self.queue.qsize())
+        logger.debug(f"Storage writer flush: {written} written, {skipped} skipped, "
+                     f"{len(grouped)} models in {(time.monotonic() - start) * 1000:.1f}ms")
+
+    def _flush_one_by_one(self, grouped: dict) -> int:
+        written = 0
+        for model, rows in grouped.items():
+            for row in rows:
+                try:
+                    with database.atomic():
+                        row.id = model.insert(self._row(model, row)).execute()
+                    written += 1
+                except Exception as e:
+                    ENTRIES.labels("failed").inc()
+                    last_values.invalidate(model, row.name_id)
+                    logger.error(f"Storage writer cannot insert {model.__name__} {row.__data__}: {e}")
+        return written
+
+    @staticmethod
+    def _row(model: Type[HomeCtrlBaseModel], entry: HomeCtrlBaseModel) -> dict:
+        return {field.name: entry.__data__.get(field.name)
+                for field in model._meta.sorted_fields if field is not model._meta.primary_key}
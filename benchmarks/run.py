@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import pathlib
+import platform
+import random
+import statistics
+import sys
+import time
+import traceback
+from types import SimpleNamespace
+
+from benchmarks.swarm import DeviceSwarm
+from configuration import Configuration
+
+# Throughput and latency of the backend hot paths, on a synthetic device swarm,
+# compared with a stored baseline (benchmarks/baseline.json, recorded with --save
+# on the machine the services run on). Benchmarks using the database run against
+# a throwaway PostgreSQL database ('benchmarks.database', created when missing),
+# never the configured one. Exits with 1 when a benchmark is slower than its
+# baseline by more than the tolerance.
+# Usage: python -m benchmarks.run [-b name ...] [--size N] [--save] [--tolerance 0.2]
+
+logger = logging.getLogger("benchmarks")
+
+BASELINE = pathlib.Path(__file__).parent / "baseline.json"
+BENCHMARKS = {}
+
+
+class Result:
+
+    def __init__(self, ops: int, seconds: float, latencies: list = None):
+        self.ops = ops
+        self.seconds = seconds
+        self.latencies = latencies or []
+
+    @property
+    def us_per_op(self) -> float:
+        return self.seconds / self.ops * 1_000_000
+
+    def to_dict(self) -> dict:
+        result = {"ops": self.ops, "us_per_op": round(self.us_per_op, 3), "ops_per_s": round(self.ops / self.seconds)}
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            result["p50_ms"] = round(ordered[len(ordered) // 2] * 1000, 3)
+            result["p99_ms"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3)
+        return result
+
+
+def benchmark(name: str, database: bool = False):
+    def register(fn):
+        BENCHMARKS[name] = SimpleNamespace(fn=fn, database=database)
+        return fn
+    return register
+
+
+def measure(run, setup=lambda: None, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+class PublishCounter:
+    # Stands for the MQTT client of a service: counts what would be published
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.published += 1
+
+
+@benchmark("json_deserial")
+def json_deserial_benchmark(swarm: DeviceSwarm, size: int) -> Result:
+    from backend.tools import json_deserial
+    payloads = [payload for _, payload in swarm.messages(size)]
+    return Result(size, measure(lambda _: [json_deserial(payload) for payload in payloads]))
+
+
+@benchmark("json_serial")
+def json_serial_benchmark(swarm: DeviceSwarm, size: int) -> Result:
+    from backend.tools import json_serial
+    entries = swarm.onair_entries(size)
+    return Result(size, measure(lambda _: [json_serial(entry) for entry in entries]))
+
+
+@benchmark("devices_ingest", database=True)
+def devices_ingest_benchmark(swarm: DeviceSwarm, size: int) -> Result:
+    # Devices.on_message: decode, data2entries, change detection and process_entry (publish, writer hand over)
+    from backend import storage
+    from backend.services.devices import Devices
+    from backend.services.onairservice import OnAirMessage
+    from backend.writer import StorageWriter
+
+    devices = Devices()
+    devices.mqtt = PublishCounter()
+    devices.writer = StorageWriter(queue_size=size * 20)
+    devices.status = {entity: {} for entity in storage.device_entities()}
+    raw = [SimpleNamespace(topic=topic, payload=payload.encode(), qos=0, retain=False) for topic, payload in swarm.messages(size)]
+
+    def run(_):
+        with storage.database:
+            for msg in raw:
+                devices.on_message(None, None, OnAirMessage(msg))
+        devices.writer._drain()
+
+    return Result(size, measure(run))
+
+
+@benchmark("save_new_value", database=True)
+def save_new_value_benchmark(swarm: DeviceSwarm, size: int) -> Result:
+    from backend import storage
+    names = swarm.names
+    rng = random.Random(2)
+
+    def setup():
+        storage.last_values.invalidate()
+        now = datetime.datetime.now()
+        # About a third unchanged, as for real sensors:
+        return [storage.Temperature(name=names[i % len(names)], create_at=now + datetime.timedelta(milliseconds=i),
+                                    value=round(rng.choice((20.0, 20.0, 20.5, 21.0, 21.5)), 2))
+                for i in range(size)]
+
+    def run(entries):
+        with storage.database:
+            for entry in entries:
+                entry.save_new_value()
+
+    return Result(size, measure(run, setup, repeat=3))
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        from starlette.websockets import WebSocketState
+        self.application_state = WebSocketState.CONNECTED
+        self.frames = 0
+        self.bytes = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.frames += 1
+        self.bytes += len(text)
+
+    async def close(self):
+        pass
+
+
+@benchmark("ws_fanout", database=True)
+def ws_fanout_benchmark(swarm: DeviceSwarm, size: int, clients: int = 200) -> Result:
+    # ConnectionManager.send_delta to N clients, a quarter of them subscribed to a few devices only
+    from backend.restapi import ConnectionManager
+    facet = "temperature"
+    names = swarm.names
+    entries = swarm.onair_entries(len(names))
+
+    async def main() -> Result:
+        manager = ConnectionManager()
+        manager.loop = asyncio.get_running_loop()
+        manager.onair[facet] = {entry["name"]["value"]: json.loads(json.dumps(entry, default=str)) for entry in entries}
+        sockets = [FakeWebSocket() for _ in range(clients)]
+        for i, ws in enumerate(sockets):
+            id = await manager.connect(ws)
+            await manager.subscribe(id, facet, names[i % len(names):][:3] if i % 4 == 0 else None)
+        sent = sum(ws.frames for ws in sockets)
+
+        rng = random.Random(3)
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(size):
+            changed = set(rng.sample(names, 5))
+            begin = time.perf_counter()
+            await manager.send_delta(facet, changed)
+            latencies.append(time.perf_counter() - begin)
+        elapsed = time.perf_counter() - start
+        return Result(sum(ws.frames for ws in sockets) - sent, elapsed, latencies)
+
+    return asyncio.run(main())
+
+
+@benchmark("charts_polar", database=True)
+def charts_polar_benchmark(swarm: DeviceSwarm, size: int) -> Result:
+    from backend.charts import polar_24hours
+    end_date = datetime.datetime.now().replace(microsecond=0)
+    rows = swarm.presence_day(max(100, size), end_date)
+    return Result(1, measure(lambda _: polar_24hours(rows, end_date), repeat=3))
+
+
+def prepare_database(name: str, names: list):
+    # Points backend.storage (not imported yet) at a throwaway database, created when missing
+    import psycopg2
+    db = Configuration.get_database_config()
+    if name == db["db"]:
+        raise ValueError(f"The benchmarks database must not be the configured one: {name}")
+    connection = psycopg2.connect(dbname="postgres", user=db["username"], password=db["password"], host=db["host"], port=db["port"])
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("select 1 from pg_database where datname = %s", (name,))
+        if cursor.fetchone() is None:
+            cursor.execute(f'create database "{name}"')
+            logger.info(f"Database {name} created")
+    connection.close()
+    Configuration.MAP["database"] = db | {"db": name, "partitioning": {"enabled": False}}
+
+    from backend import storage
+    with storage.database:
+        for value in names:
+            storage.Name.get_or_create(value=value, defaults={"description": "benchmark"})
+
+
+def cpu_model() -> str:
+    # platform.processor() is empty on most Linux systems
+    try:
+        for line in pathlib.Path("/proc/cpuinfo").read_text().splitlines():
+            if line.startswith("model name"):
+                return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    print(f"{'benchmark':18} {'ops':>8} {'us/op':>12} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'baseline':>12}  change")
+    for name, result in results.items():
+        if isinstance(result, str):
+            print(f"{name:18} skipped: {result}")
+            continue
+        current = result.to_dict()
+        line = (f"{name:18} {current['ops']:8} {current['us_per_op']:12.3f} {current['ops_per_s']:10} "
+                f"{current.get('p50_ms', ''):>9} {current.get('p99_ms', ''):>9}")
+        if (reference := baseline.get(name)) is None:
+            print(f"{line} {'-':>12}  no baseline")
+            continue
+        change = current["us_per_op"] / reference["us_per_op"] - 1
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        host = reference.get("recorded", {}).get("host")
+        print(f"{line} {reference['us_per_op']:12.3f}  {change:+.1%}{'  REGRESSION' if regressed else ''}"
+              f"{f'  (baseline of {host})' if host and host != platform.node() else ''}")
+    return regressions
+
+
+def main():
+    conf = Configuration.MAP.get("benchmarks", {})
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="HomeCtrl backend benchmarks")
+    parser.add_argument("--benchmark", "-b", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run (default all)")
+    parser.add_argument("--size", "-n", type=int, default=conf.get("size", 2000), help="Messages (operations) per benchmark")
+    parser.add_argument("--devices", type=int, default=conf.get("devices", 50), help="Devices in the synthetic swarm")
+    parser.add_argument("--tolerance", type=float, default=conf.get("tolerance", 0.2), help="Allowed slowdown against the baseline")
+    parser.add_argument("--database", default=conf.get("database", "homectrl_bench"), help="Throwaway database")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    swarm = DeviceSwarm(args.devices)
+    selected = args.benchmark or list(BENCHMARKS)
+    if any(BENCHMARKS[name].database for name in selected):
+        try:
+            prepare_database(args.database, swarm.names)
+        except Exception as e:
+            logger.error(f"No benchmarks database, skipping the benchmarks using it: {e}")
+            selected = [name for name in selected if not BENCHMARKS[name].database]
+
+    results = {}
+    for name in args.benchmark or list(BENCHMARKS):
+        if name not in selected:
+            results[name] = "no database"
+            continue
+        try:
+            results[name] = BENCHMARKS[name].fn(swarm, args.size)
+        except ImportError as e:
+            results[name] = f"{e}"
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = f"failed: {e}"
+
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        # Where and when each result was recorded: a baseline compares only on the same machine
+        recorded = {"at": datetime.date.today().isoformat(), "host": platform.node(), "machine": platform.machine(),
+                    "processor": cpu_model(), "cpus": os.cpu_count(), "python": platform.python_version()}
+        measured = {name: result.to_dict() | {"size": args.size, "devices": args.devices, "recorded": recorded}
+                    for name, result in results.items() if isinstance(result, Result)}
+        BASELINE.write_text(json.dumps(baseline | measured, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline saved: {', '.join(measured)}")
+    elif regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
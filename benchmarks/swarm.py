@@ -0,0 +1,98 @@
+import datetime
+import decimal
+import json
+import random
+
+from configuration import Topic
+
+# Synthetic device swarm: messages shaped like the ones devices publish on
+# homectrl/device/<name>/data, with values drifting the way real sensors do
+# (most messages change one or two values, presence and light flip now and then).
+
+
+class SyntheticDevice:
+
+    KINDS = ("climate", "radar", "electricity", "battery", "radio")
+
+    def __init__(self, name: str, kind: str, rng: random.Random):
+        self.name = name
+        self.kind = kind
+        self.rng = rng
+        self.temperature = rng.uniform(18, 24)
+        self.humidity = rng.uniform(35, 60)
+        self.pressure = rng.uniform(995, 1030)
+        self.presence = False
+        self.light = False
+        self.distance = rng.randint(50, 400)
+        self.energy = rng.randint(100_000, 2_000_000)
+        self.battery = rng.randint(20, 100)
+        self.volume = rng.randint(0, 30)
+
+    def data(self) -> dict:
+        rng = self.rng
+        if self.kind == "climate":
+            self.temperature += rng.choice((-0.05, 0, 0, 0.05))
+            self.humidity += rng.choice((-0.2, 0, 0, 0.2))
+            if rng.random() < 0.1:
+                self.presence = not self.presence
+            if rng.random() < 0.02:
+                self.light = not self.light
+            return {"live": True, "temperature": round(self.temperature, 2), "humidity": round(self.humidity, 2),
+                    "pressure": round(self.pressure, 1), "darkness": self.light, "light": self.light,
+                    "presence": self.presence, "transient_lux": rng.randint(0, 800)}
+        elif self.kind == "radar":
+            self.presence = rng.random() < 0.5
+            self.distance = max(0, self.distance + rng.randint(-20, 20))
+            return {"radar": {"presence": self.presence, "target_state": rng.randint(0, 3), "distance": self.distance,
+                              "move": {"distance": self.distance, "energy": rng.randint(0, 100)},
+                              "static": {"distance": self.distance, "energy": rng.randint(0, 100)}}}
+        elif self.kind == "electricity":
+            power = round(rng.uniform(0, 2300), 2)
+            self.energy += int(power / 60)
+            return {"electricity": {"voltage": round(rng.uniform(225, 240), 2), "current": round(power / 230, 3),
+                                    "active_power": power, "active_energy": self.energy,
+                                    "power_factor": round(rng.uniform(0.6, 1.0), 3)}}
+        elif self.kind == "battery":
+            if rng.random() < 0.05:
+                self.battery = max(0, self.battery - 1)
+            return {"battery": {"value": self.battery, "voltage": round(3.3 + self.battery / 100, 6)}}
+        else:
+            if rng.random() < 0.1:
+                self.volume = rng.randint(0, 30)
+            return {"radio": {"station": {"name": "Radio", "code": "r1"}, "volume": {"volume": self.volume, "is_muted": False},
+                              "playinfo": "Artist - Title"}}
+
+
+class DeviceSwarm:
+
+    def __init__(self, devices: int = 50, seed: int = 1):
+        self.rng = random.Random(seed)
+        kinds = SyntheticDevice.KINDS
+        self.devices = [SyntheticDevice(f"bench{i:03}", kinds[i % len(kinds)], self.rng) for i in range(devices)]
+
+    @property
+    def names(self) -> list:
+        return [device.name for device in self.devices]
+
+    def messages(self, count: int) -> list:
+        # [(topic, payload)] as devices publish them, round robin with some devices talking more
+        result = []
+        for _ in range(count):
+            device = self.rng.choice(self.devices)
+            result.append((Topic.Device.format(device.name, Topic.Device.Facility.data), json.dumps(device.data())))
+        return result
+
+    def onair_entries(self, count: int) -> list:
+        # Entries as Devices publishes them on homectrl/onair/<facet>/<name> (model_to_dict of a model)
+        now = datetime.datetime.now().replace(microsecond=0)
+        return [{"id": 1_000_000 + i, "name": {"value": self.devices[i % len(self.devices)].name, "description": None, "enabled": True},
+                 "create_at": now + datetime.timedelta(seconds=i),
+                 "value": decimal.Decimal(f"{self.rng.uniform(18, 24):.2f}")}
+                for i in range(count)]
+
+    def presence_day(self, changes: int, end_date: datetime.datetime) -> list:
+        # Rows of one day of presence changes, as charts.polar_24hours takes them
+        start = end_date - datetime.timedelta(days=1)
+        offsets = sorted(self.rng.randrange(0, 24 * 60 * 60 * 1_000_000) for _ in range(changes))
+        return [{"create_at": start + datetime.timedelta(microseconds=offset), "value": i % 2 == 0}
+                for i, offset in enumerate(offsets)]
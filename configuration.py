@@ -75,10 +75,19 @@ class Topic:
             # There are some more dynamic facets here, like light, presence, live, etc...
             activity = "activity"
             meteo = "meteo"
+            supervisor = "supervisor"
+            profile = "profile"
 
             def __str__(self):
                 return self.name
 
+    class Control:
+        # homectrl/control/<system>/<action>
+        _topic = _Topic("homectrl/control", 2)
+        format = _topic.format
+        parse = _topic.parse
+        is_topic = _topic.is_topic
+
 
 class Configuration:
     PATH = os.path.dirname(os.path.realpath(__file__))
@@ -109,6 +118,38 @@ class Configuration:
     def get_database_config():
         return Configuration.MAP["database"]
 
+    @staticmethod
+    def get_writer_config():
+        return Configuration.MAP.get("writer", {})
+
+    @staticmethod
+    def get_retention_config():
+        return Configuration.MAP.get("retention", {})
+
+    @staticmethod
+    def get_onair_config():
+        return Configuration.MAP.get("onair", {})
+
+    @staticmethod
+    def get_profiling_config():
+        return Configuration.MAP.get("profiling", {})
+
+    @staticmethod
+    def get_metrics_config():
+        return Configuration.MAP.get("metrics", {})
+
+    @staticmethod
+    def get_meteo_config():
+        return Configuration.MAP.get("meteo", {})
+
+    @staticmethod
+    def get_http_config():
+        return Configuration.MAP.get("http", {})
+
+    @staticmethod
+    def get_restapi_config():
+        return Configuration.MAP.get("restapi", {})
+
     @staticmethod
     def get_mqtt_config():
         return Configuration.MAP["mqtt"]
@@ -0,0 +1,99 @@
+import datetime
+import decimal
+import json
+import sys
+import time
+
+from backend import jsoncodec
+
+# Compares the JSON codec behind json_serial / json_deserial with the former one
+# (stdlib, every float parsed through Decimal), on payloads shaped like the ones
+# devices publish (homectrl/device/<name>/data) and onair republishes. Also checks
+# that the orjson and standard library paths give identical output, or the same
+# values for floats in exponent notation (written 1e16 by orjson, 1e+16 by the
+# standard library); non-finite floats are null in both.
+# Usage: python -m devel.json_benchmark [messages]
+
+
+def legacy_serial(obj):
+    return json.dumps(obj, cls=jsoncodec.HomeCtrlJsonEncoder)
+
+
+def legacy_deserial(json_str):
+    return json.loads(json_str, parse_float=lambda x: round(decimal.Decimal(x), 10))
+
+
+def as_decimals(obj):
+    # What a storage.DecimalField makes of a decoded float
+    if isinstance(obj, dict):
+        return {key: as_decimals(value) for key, value in obj.items()}
+    elif isinstance(obj, float):
+        return decimal.Decimal(repr(obj))
+    return obj
+
+
+def device_payloads(count: int) -> list:
+    result = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            data = {"name": "kitchen", "live": True, "temperature": round(21.3 + (i % 50) / 100, 2), "humidity": 48.27,
+                    "pressure": 1013.2, "darkness": i % 7 == 0, "light": False, "presence": i % 3 == 0}
+        elif kind == 1:
+            data = {"name": "radar", "radar": {"presence": i % 2 == 0, "target_state": 3, "distance": 131 + i % 40,
+                    "move": {"distance": 120, "energy": 45}, "static": {"distance": 90, "energy": 12}}}
+        elif kind == 2:
+            data = {"name": "socket", "electricity": {"voltage": 231.4, "current": round(0.52 + (i % 9) / 100, 2),
+                    "active_power": 104.75, "active_energy": 1284011 + i, "power_factor": 0.87}}
+        else:
+            data = {"name": "dev", "live": True, "voltage": 3.912, "error": "", "transient_lux": round(143.6 + i % 11, 1)}
+        result.append(json.dumps(data))
+    return result
+
+
+def onair_entries(count: int) -> list:
+    now = datetime.datetime.now().replace(microsecond=0)
+    return [{"id": 1_000_000 + i, "name": {"value": "kitchen", "description": "Kuchnia"},
+             "create_at": now + datetime.timedelta(seconds=i), "value": decimal.Decimal("21.35")}
+            for i in range(count)]
+
+
+def measure(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    if jsoncodec.orjson is None:
+        print("orjson not installed, json_serial / json_deserial use the standard library")
+        raise SystemExit(1)
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    payloads = device_payloads(messages)
+    entries = onair_entries(messages)
+
+    for payload, entry in zip(payloads, entries):
+        decoded = jsoncodec.loads(payload)
+        assert as_decimals(decoded) == legacy_deserial(payload)
+        assert jsoncodec.dumps(decoded) == jsoncodec.dumps_stdlib(decoded)
+        assert jsoncodec.dumps(entry) == jsoncodec.dumps_stdlib(entry)
+        assert json.loads(jsoncodec.dumps(entry)) == json.loads(legacy_serial(entry))
+
+    for value in (1e16, 1e-7, -2.5e-12, 6.02e23, decimal.Decimal("1E+16")):
+        assert json.loads(jsoncodec.dumps({"value": value})) == json.loads(jsoncodec.dumps_stdlib({"value": value}))
+    for value in (float("nan"), float("inf"), -float("inf"), decimal.Decimal("NaN")):
+        assert jsoncodec.dumps({"value": [value]}) == jsoncodec.dumps_stdlib({"value": [value]}) == '{"value":[null]}'
+
+    results = [
+        ("decode device payloads", lambda: [legacy_deserial(p) for p in payloads], lambda: [jsoncodec.loads(p) for p in payloads]),
+        ("encode onair entries", lambda: [legacy_serial(e) for e in entries], lambda: [jsoncodec.dumps(e) for e in entries]),
+    ]
+    print(f"{messages} messages, identical output (orjson / stdlib, same values in exponent notation) and values (former codec)")
+    for name, legacy, current in results:
+        legacy_time = measure(legacy)
+        current_time = measure(current)
+        print(f"{name:24} former: {legacy_time * 1000:8.2f} ms  orjson: {current_time * 1000:8.2f} ms  "
+              f"({legacy_time / current_time:.1f}x faster)")
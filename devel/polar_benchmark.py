@@ -0,0 +1,66 @@
+import datetime
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend.timeline import state_changes, minute_occupancy
+
+# Compares the per-minute occupancy used by charts.polar_24hours with the former
+# pandas implementation (1-second resampling), on a synthetic day of dense
+# Presence/Radar changes. Usage: python -m devel.polar_benchmark [changes]
+
+
+def legacy_minutes(df: pd.DataFrame, start_date: datetime.datetime, end_date: datetime.datetime) -> pd.DataFrame:
+    df = df.copy()
+    df["datetime"] = pd.to_datetime(df["create_at"]).dt.floor("s")
+    df["value"] = df["value"].astype(int)
+    df.drop(columns=["create_at"], inplace=True)
+    df = pd.concat([
+        pd.DataFrame([[(df.iloc[0]["value"] + 1) % 2, start_date]], columns=df.columns),
+        df,
+        pd.DataFrame([[df.iloc[-1]["value"], end_date]], columns=df.columns)], ignore_index=True)
+    df = df.sort_values("value", ascending=True).drop_duplicates("datetime").sort_index()
+    df.set_index("datetime", inplace=True)
+    df = df.resample(rule='s', origin=start_date).ffill().reset_index()
+    df["datetime"] = pd.to_datetime(df["datetime"]).dt.floor("min")
+    df = df.sort_values("value", ascending=False).drop_duplicates("datetime").sort_index().reset_index()
+    return df
+
+
+def synthetic_day(end_date: datetime.datetime, changes: int, seed: int = 1) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(end_date - datetime.timedelta(days=1), "us")
+    offsets = np.sort(rng.integers(0, 24 * 60 * 60 * 1_000_000, changes)).astype("timedelta64[us]")
+    return pd.DataFrame({
+        "create_at": (start + offsets).astype("datetime64[us]"),
+        "value": rng.integers(0, 2, changes).astype(bool),
+    })
+
+
+def measure(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    changes = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    end_date = datetime.datetime.now().replace(microsecond=0)
+    start_date = end_date - datetime.timedelta(days=1)
+    df = synthetic_day(end_date, changes)
+
+    legacy = legacy_minutes(df, start_date, end_date)
+    minutes, occupied = minute_occupancy(*state_changes(df["create_at"], df["value"], start_date, end_date))
+    assert np.array_equal(legacy["datetime"].to_numpy().astype("datetime64[s]").astype(np.int64), minutes)
+    assert np.array_equal(legacy["value"].to_numpy(), occupied)
+
+    legacy_time = measure(lambda: legacy_minutes(df, start_date, end_date))
+    interval_time = measure(lambda: minute_occupancy(*state_changes(df["create_at"], df["value"], start_date, end_date)))
+    print(f"{changes} changes, {len(minutes)} minutes, identical output")
+    print(f"pandas 1s resampling: {legacy_time * 1000:8.2f} ms")
+    print(f"interval engine:      {interval_time * 1000:8.2f} ms  ({legacy_time / interval_time:.0f}x faster)")
@@ -11,6 +11,8 @@ class Configuration:
     TOPIC_HOMECTRL_ONAIR = TOPIC_HOMECTRL + "/onair"
     TOPIC_HOMECTRL_ONAIR_ACTIVITY = TOPIC_HOMECTRL_ONAIR + "/activity"
     TOPIC_ROOT = TOPIC_HOMECTRL + "/device/{}"
+    # Add the trace envelope (sequence number and timestamp) to published messages:
+    TRACE = False
 
     NTP_SERVER = "status.home"
     # NTP_SERVER = "pool.ntp.org"
@@ -1,4 +1,5 @@
 import React, {createContext, useState, useEffect} from 'react';
+import {mergeFacet, subscribeFacet} from "./facet";
 
 export const LiveDeviceContext = createContext({});
 
@@ -6,14 +7,11 @@ export const LiveDeviceProvider = ({children}) => {
     const [devices, setDevices] = useState({});
 
     useEffect(() => {
-        const socket = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/live');
+        const unsubscribe = subscribeFacet("live", (receivedMessage) => {
+            setDevices(devices => mergeFacet(devices, receivedMessage));
+        });
 
-        socket.onmessage = (event) => {
-            const receivedMessage = JSON.parse(event.data);
-            setDevices(receivedMessage.result);
-        };
-
-        return () => socket.close();
+        return () => unsubscribe();
     }, []);
 
     return (
@@ -1,6 +1,7 @@
 import React, {useState, useEffect, useContext, useRef} from 'react';
 import {IsAlive, LiveDeviceContext} from "../LiveDeviceContext";
 import {useExpandable} from "../ExpandableContext";
+import {mergeFacet, subscribeFacet} from "../facet";
 
 const Controls = (props) => {
     const [state, setState] = useState([]);
@@ -28,14 +29,9 @@ const Controls = (props) => {
     useEffect(() => {
         if (!capabilities || Object.keys(capabilities).length === 0) return;
 
-        const socket = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/state');
-        socket.onopen = () => {
-            console.log('WebSocket connection established.');
-        };
-        socket.onmessage = (event) => {
-            const receivedMessage = JSON.parse(event.data);
-            setState(receivedMessage.result);
-        };
+        const unsubscribe = subscribeFacet("state", (receivedMessage) => {
+            setState(state => mergeFacet(state, receivedMessage));
+        });
 
         // Initialize slider values
         const initialValues = {};
@@ -49,7 +45,7 @@ const Controls = (props) => {
         setSliderValues(initialValues);
 
         return () => {
-            socket.close();
+            unsubscribe();
         };
     }, [capabilities]);
 
@@ -1,6 +1,7 @@
 import React, {useState, useEffect, useContext} from 'react';
 import {LiveDeviceContext} from "../LiveDeviceContext";
 import {useExpandable} from "../ExpandableContext";
+import {mergeFacet, subscribeFacet} from "../facet";
 
 const Electricity = (props) => {
     const [entries, setEntries] = useState([]);
@@ -18,19 +19,14 @@ const Electricity = (props) => {
     }
 
     useEffect(() => {
-        const socket = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/electricity');
-        socket.onopen = () => {
-            console.log('WebSocket connection established.');
-        };
-        socket.onmessage = (event) => {
-            //console.log(event.data)
-            const receivedMessage = JSON.parse(event.data);
-            setEntries(receivedMessage.result);
-        };
+        const unsubscribe = subscribeFacet("electricity", (receivedMessage) => {
+            //console.log(receivedMessage)
+            setEntries(entries => mergeFacet(entries, receivedMessage));
+        });
         // Initial fetch
         setEntries([]);
         return () => {
-            socket.close();
+            unsubscribe();
         };
     }, []);
 
@@ -1,6 +1,7 @@
 import React, {useState, useEffect, useContext} from 'react';
 import {LiveDeviceContext, IsAlive} from "../LiveDeviceContext";
 import {useExpandable} from "../ExpandableContext";
+import {mergeFacet, subscribeFacet} from "../facet";
 
 
 const EntryBoolean = (props) => {
@@ -18,20 +19,15 @@ const EntryBoolean = (props) => {
     };
 
     useEffect(() => {
-        const socket = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/' + props.facet);
-        socket.onopen = () => {
-            console.log('WebSocket connection established.');
-        };
-        socket.onmessage = (event) => {
-            //console.log(event.data)
-            const receivedMessage = JSON.parse(event.data);
-            setEntries(receivedMessage.result);
+        const unsubscribe = subscribeFacet(props.facet, (receivedMessage) => {
+            //console.log(receivedMessage)
+            setEntries(entries => mergeFacet(entries, receivedMessage));
 
-        };
+        });
         // Initial fetch
         setEntries([]);
         return () => {
-            socket.close();
+            unsubscribe();
         };
     }, [props.facet]);
 
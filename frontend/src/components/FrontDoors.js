@@ -1,6 +1,7 @@
 import React, {useState, useEffect, useContext} from 'react';
 import {LiveDeviceContext, IsAlive} from "../LiveDeviceContext";
 import {useExpandable} from "../ExpandableContext";
+import {mergeFacet, subscribeFacet} from "../facet";
 
 
 const FrontDoors = (props) => {
@@ -19,20 +20,18 @@ const FrontDoors = (props) => {
     };
 
     useEffect(() => {
-        const socketDoors = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/doors');
-        const socketBell = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/bell');
-        socketDoors.onmessage = (event) => {
-            setEntriesDoors(JSON.parse(event.data).result);
-        };
-        socketBell.onmessage = (event) => {
-            setEntriesBell(JSON.parse(event.data).result);
-        };
+        const unsubscribeDoors = subscribeFacet("doors", (receivedMessage) => {
+            setEntriesDoors(entries => mergeFacet(entries, receivedMessage));
+        });
+        const unsubscribeBell = subscribeFacet("bell", (receivedMessage) => {
+            setEntriesBell(entries => mergeFacet(entries, receivedMessage));
+        });
         // Initial fetch
         setEntriesDoors([]);
         setEntriesBell([]);
         return () => {
-            socketDoors.close();
-            socketBell.close();
+            unsubscribeDoors();
+            unsubscribeBell();
         };
     }, []);
 
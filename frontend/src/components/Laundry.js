@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import {useExpandable} from "../ExpandableContext";
+import {subscribeFacet} from "../facet";
 
 const Laundry = (props) => {
     const [laundry, setLaundry] = useState({});
@@ -18,23 +19,18 @@ const Laundry = (props) => {
         };
         fetchStats();
 
-        const socket = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/activity');
-        socket.onopen = () => {
-            console.log('WebSocket connection established.');
-        };
-        socket.onmessage = (event) => {
-            //console.log(event.data)
-            const receivedMessage = JSON.parse(event.data);
+        const unsubscribe = subscribeFacet("activity", (receivedMessage) => {
+            //console.log(receivedMessage)
             for (const activity of receivedMessage.result){
                 if (activity.name === "laundry") {
                     setLaundry(activity);
                     break;
                 }
             }
-        };
+        });
         setLaundry({});
         return () => {
-            socket.close();
+            unsubscribe();
         };
     }, []);
 
@@ -1,27 +1,27 @@
 import React, { useState, useEffect } from 'react';
 import {useExpandable} from "../ExpandableContext";
+import {mergeFacet, subscribeFacet} from "../facet";
 
 const Radio = (props) => {
-    const [radio, setRadio] = useState({});
+    const [entries, setEntries] = useState([]);
     const { isExpanded, toggle } = useExpandable();
 
     useEffect(() => {
-        const socket = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws/radio');
-        socket.onopen = () => {
-            console.log('WebSocket connection established.');
-        };
-        socket.onmessage = (event) => {
-            //console.log(event.data)
-            const receivedMessage = JSON.parse(event.data);
-            setRadio(receivedMessage.result[0]);
-        };
+        const unsubscribe = subscribeFacet("radio", (receivedMessage) => {
+            //console.log(receivedMessage)
+            setEntries(entries => mergeFacet(entries, receivedMessage));
+        });
         // Initial fetch
-        setRadio({});
+        setEntries([]);
         return () => {
-            socket.close();
+            unsubscribe();
         };
     }, []);
 
+    // Deltas carry only the changed devices: this radio is looked up in the merged state
+    const name = props.name || "radio";
+    const radio = entries.find(e => e.name === name) || (entries.length === 1 ? entries[0] : {});
+
     if (radio.live) {
         return (
             <div className="card border-light mb-3" style={{maxWidth: '30rem'}}>
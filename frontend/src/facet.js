@@ -0,0 +1,73 @@
+// All facets share one WebSocket to the multiplexed /ws endpoint. Each facet sends a full snapshot
+// on subscribe, then only the devices changed since the last push.
+const PING_INTERVAL = 20000;
+const RECONNECT_DELAY = 5000;
+
+const listeners = {};
+let socket = null;
+let reconnect = null;
+
+const send = (message) => {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify(message));
+    }
+};
+
+const connect = () => {
+    clearTimeout(reconnect);
+    reconnect = null;
+    let ping = null;
+    socket = new WebSocket(process.env.REACT_APP_HOMECTRL_RESTAPI_URL + '/ws');
+    socket.onopen = () => {
+        console.log('WebSocket connection established.');
+        Object.keys(listeners).forEach(facet => send({action: "subscribe", facet: facet}));
+        ping = setInterval(() => send({action: "ping"}), PING_INTERVAL);
+    };
+    socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        (listeners[message.facet] || []).forEach(callback => callback(message));
+    };
+    socket.onclose = () => {
+        clearInterval(ping);
+        socket = null;
+        if (Object.keys(listeners).length > 0) {
+            reconnect = setTimeout(connect, RECONNECT_DELAY);
+        }
+    };
+};
+
+export const subscribeFacet = (facet, callback) => {
+    if (!listeners[facet]) {
+        listeners[facet] = new Set();
+        send({action: "subscribe", facet: facet});
+    } else {
+        send({action: "snapshot", facet: facet});
+    }
+    listeners[facet].add(callback);
+    if (socket === null && reconnect === null) {
+        connect();
+    }
+    return () => {
+        listeners[facet].delete(callback);
+        if (listeners[facet].size === 0) {
+            delete listeners[facet];
+            send({action: "unsubscribe", facet: facet});
+        }
+    };
+};
+
+export const mergeFacet = (entries, message) => {
+    if (message.type !== "delta") {
+        return message.result;
+    }
+    const merged = Array.isArray(entries) ? [...entries] : [];
+    for (const entry of message.result) {
+        const index = merged.findIndex(e => e.name === entry.name);
+        if (index >= 0) {
+            merged[index] = entry;
+        } else {
+            merged.push(entry);
+        }
+    }
+    return merged;
+};
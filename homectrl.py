@@ -69,12 +69,12 @@ class HomeCtrl(Common):
         ping.set_defaults(command="ping")
 
         db = subparsers.add_parser("db", help="Open database command-line tool", formatter_class=self.Formatter)
-        db.add_argument("db_action", choices=["cmd", "last"], default="cmd", nargs="?")
+        db.add_argument("db_action", choices=["cmd", "last", "partition"], default="cmd", nargs="?")
         db.add_argument("--sql", help="SQL query")
         db.set_defaults(command="db")
 
         mqtt = subparsers.add_parser("mqtt", help="Take an action on MQTT queue", formatter_class=self.Formatter)
-        mqtt.add_argument("mqtt_action", choices=["monitor", "delete", "publish"], default="monitor", nargs="?")
+        mqtt.add_argument("mqtt_action", choices=["monitor", "delete", "publish", "record", "replay"], default="monitor", nargs="?")
         mqtt_group = mqtt.add_mutually_exclusive_group()
         mqtt_group.add_argument("--topic", "-t", help="Topic name. Default: '{}/#'".format(Topic.Root), nargs="+")\
             .completer=TopicCompleter(boards, Configuration.meteo_providers())
@@ -83,6 +83,11 @@ class HomeCtrl(Common):
 
         mqtt.add_argument("--message", "-m", help="Message to publish", required="publish" in sys.argv)
         mqtt.add_argument("--retain", "-r", help="Retain the message", action="store_true")
+        mqtt.add_argument("--file", "-f", help="Traffic capture file to record to (appended) or to replay",
+                          required="record" in sys.argv or "replay" in sys.argv)
+        mqtt.add_argument("--speed", "-s", type=float, default=1.0,
+                          help="Replay speed: 1 - original timing, N - N times faster, 0 - as fast as possible")
+        mqtt.add_argument("--broker", "-b", default="localhost", help="Replay to this broker, host[:port]")
         mqtt.set_defaults(command="mqtt")
 
         sms = subparsers.add_parser("sms", help="SMS tool", formatter_class=self.Formatter)
@@ -175,6 +180,10 @@ class HomeCtrl(Common):
                     os.system(cmd)
             elif args.db_action == "last":
                 self.list_db()
+            elif args.db_action == "partition":
+                # One-off: converts the history tables to monthly partitions (database.partitioning.enabled)
+                from backend import storage
+                storage.maintain_partitions(convert=True)
 
         elif args.command == "mqtt":
             from backend.tools import MQTTMonitor, MQTTClient
@@ -198,6 +207,15 @@ class HomeCtrl(Common):
                 else:
                     raise ValueError("Specify the topic to delete")
 
+            elif args.mqtt_action == "record":
+                from backend.tools import MQTTRecorder
+                MQTTRecorder(args.topic or "{}/#".format(Topic.Root), args.file).start()
+
+            elif args.mqtt_action == "replay":
+                from backend.tools import MQTTReplayer
+                host, _, port = args.broker.partition(":")
+                MQTTReplayer(args.file, args.speed, args.topic, host, int(port) if port else None).start()
+
             elif args.mqtt_action == "publish":
                 if args.topic:
                     client = MQTTClient()
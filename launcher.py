@@ -7,26 +7,43 @@ import asyncio
 import logging
 import time
 
+from configuration import Configuration
+
 services = ["onair", "restapi", "attic", "charts", "devel", "devel-mqtt"]
 
 parser = argparse.ArgumentParser(description="HomeCtrl service launcher", add_help=True)
 parser.add_argument("service",  choices=services, help="Backend service to start")
 argcomplete.autocomplete(parser)
-args = parser.parse_args()
+# Workers of the onair supervisor are spawned processes that import this module as __mp_main__:
+args = parser.parse_args() if __name__ == "__main__" else None
 
 logging.basicConfig(level=logging.INFO)
 for handler in logging.getLogger().handlers:
     handler.setFormatter(logging.Formatter("[%(asctime)s][%(levelname)s][%(name)s] %(message)s"))
 
 
-system = args.service
+system = args.service if args else None
+
+if system is None:
+    pass
+
+elif system == "onair" and Configuration.get_onair_config().get("supervisor", {}).get("enabled"):
+
+    from backend.supervisor import Supervisor
+
+    logging.info("Starting OnAir supervisor...")
+    supervisor = Supervisor()
+    try:
+        supervisor.start()
+    except KeyboardInterrupt:
+        logging.info("Stopped OnAir supervisor")
 
-if system == "onair":
+elif system == "onair":
 
     from backend.onair import OnAir
 
     logging.info("Starting OnAir...")
-    onAir = OnAir()
+    onAir = OnAir(metrics_port=Configuration.get_metrics_config().get("onair_port"))
     try:
         onAir.start()
         while True:
@@ -40,19 +57,19 @@ if system == "onair":
 elif system == "restapi":
     import uvicorn
     import socket
-    from backend.restapi import app, UVICORN_LOG_CONFIG
+    from backend.restapi import app, UVICORN_LOG_CONFIG, UVICORN_WS_CONFIG
 
     if socket.gethostname() == 'pi':
         bind_to = 'status.home'
     else:
         bind_to = 'localhost'
 
-    uvicorn.run("backend.restapi:app", host=bind_to, port=8000, workers=1, log_config=UVICORN_LOG_CONFIG)
+    uvicorn.run("backend.restapi:app", host=bind_to, port=8000, workers=1, log_config=UVICORN_LOG_CONFIG, **UVICORN_WS_CONFIG)
 
 elif system == "charts":
     from backend.charts import ChartsGenerator
     try:
-        ChartsGenerator().start()
+        ChartsGenerator(metrics_port=Configuration.get_metrics_config().get("charts_port")).start()
     except KeyboardInterrupt:
         pass
 
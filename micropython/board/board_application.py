@@ -12,6 +12,9 @@ from configuration import Configuration
 from board.boot import Boot
 import json, machine, esp32, gc, ubinascii
 
+# Seconds from 1970 to the epoch of the port (2000 on some):
+EPOCH_OFFSET = 0 if time.gmtime(0)[0] == 1970 else 946_684_800
+
 class MQTT(shared.Exitable, shared.Named):
 
     I_AM_ALIVE = json.dumps({"live": True, 'message': 'hello'})
@@ -143,6 +146,9 @@ class BoardApplication(shared.Named, shared.Exitable):
             (self.topic_live, _, self.topic_state, self.topic_capabilities, topic_control) = Configuration.topics(name)
             self.mqtt_subscriptions = {topic_control: None}
             self.mqtt_custom_config = {}
+            self.trace = Configuration.TRACE
+            self.trace_seq = 0
+            self.trace_clock = None
 
         self.control = {}
         self.capabilities = {'controls': []}
@@ -178,12 +184,40 @@ class BoardApplication(shared.Named, shared.Exitable):
         | self.time_sync.to_dict()
         | ({'ap': boot.ap.ifconfig()} if boot.ap else {}))
 
+    async def trace_anchor(self):
+        # (RTC second, ticks_ms) taken when the RTC second changes, so that milliseconds counted from it
+        # are aligned on the RTC seconds. Polls every millisecond for up to a second: at start and after RTC syncs.
+        self.trace_clock = None
+        second = time.time()
+        while (now := time.time()) == second:
+            await asyncio.sleep_ms(1)
+        self.trace_clock = (now, time.ticks_ms())
+
+    def trace_envelope(self):
+        # seq: per application, a gap means a lost message; ts: RTC as UTC ms since 1970; up: monotonic ms
+        ticks = time.ticks_ms()
+        second = time.time()
+        if self.trace_clock is None:
+            # Until the anchor is taken, whole seconds
+            millis = 0
+        else:
+            anchor_second, anchor_ticks = self.trace_clock
+            # Milliseconds since the RTC second began, bounded to it should ticks and RTC drift apart:
+            millis = min(999, max(0, time.ticks_diff(ticks, anchor_ticks) - (second - anchor_second) * 1000))
+        self.trace_seq += 1
+        return {'seq': self.trace_seq, 'ts': (time.local_to_utc(second) + EPOCH_OFFSET) * 1000 + millis,
+                'up': ticks}
+
     async def publish(self, topic, data, retain=False, qos=0, properties=None):
         if self.use_mqtt:
+            if self.trace and isinstance(data, dict):
+                data = data | {'trace': self.trace_envelope()}
             await self.mqtt.publish(topic, json.dumps(data), retain, qos, properties)
 
     async def start(self):
         if self.use_mqtt:
+            if self.trace:
+                asyncio.create_task(self.trace_anchor())
             self.mqtt = MQTT(self.name, self.mqtt_subscriptions, self.mqtt_custom_config)
             await self.mqtt.connect()
             # await self.publish(self.topic_state, self.control, True)
@@ -227,6 +261,8 @@ class BoardApplication(shared.Named, shared.Exitable):
                     self.time_sync.endpoint.loaded['time'] = True
                     # Just a dummy increment to indicate that sync was done
                     self.time_sync.value = self.time_sync.value + 1
+                    if self.use_mqtt and self.trace:
+                        await self.trace_anchor()
                     self.log.info(f"Daily RTC sync finished successfully. Date/Time: {util.time_str()}")
                 else:
                     self.log.info(f"Daily RTC sync not completed.")
@@ -20,13 +20,40 @@ def rtc_to_sys(rtc_read_func):
     except:
         return False
 
+def ntp_time_ms(host: str, timeout: int = 1):
+    # As ntptime.time(), with the fraction of the second ntptime drops: (seconds since the port epoch,
+    # milliseconds), as of the reply received, half the round trip added.
+    import socket, struct
+    query = bytearray(48)
+    query[0] = 0x1B
+    addr = socket.getaddrinfo(host, 123)[0][-1]
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.settimeout(timeout)
+        sent = time.ticks_ms()
+        s.sendto(query, addr)
+        msg = s.recv(48)
+        received = time.ticks_ms()
+    finally:
+        s.close()
+    seconds, fraction = struct.unpack("!II", msg[40:48])
+    if seconds < 3913056000:
+        # NTP era 1 (after 2036)
+        seconds += 0x100000000
+    seconds -= 2208988800 if time.gmtime(0)[0] == 1970 else 3155673600
+    millis = (fraction * 1000 >> 32) + time.ticks_diff(received, sent) // 2
+    return seconds + millis // 1000, millis % 1000
+
 def ntp_to_sys(ntphost: str = None):
     import ntptime
     from machine import RTC
     if ntphost:
         ntptime.host = ntphost
-    cet = time.localtime(time.utc_to_local(ntptime.time()))
+    seconds, millis = ntp_time_ms(ntptime.host)
+    # The fraction of the second goes in the subseconds field (microseconds on the ESP32 port), so the RTC
+    # seconds begin on time without waiting for the next NTP second
+    cet = time.localtime(time.utc_to_local(seconds))
     (year, month, mday, hour, minute, second, weekday, yearday) = cet
-    RTC().datetime((year, month, mday, 0, hour, minute, second, 0))
+    RTC().datetime((year, month, mday, 0, hour, minute, second, millis * 1000))
     print(f"Time loaded: {time.localtime()}")
 